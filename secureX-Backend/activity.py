@@ -0,0 +1,153 @@
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import Date, Integer, case, cast, delete, func, insert, literal, select, text, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, LedgerEntry, UserActivity, ConnectionActivity, DailyActivity
+from money import Money, sum_money
+
+# Dashboard aggregates, maintained incrementally with each ledger entry. A rebuild recomputes
+# them from ledger_entries after a backfill or repair:
+#   python activity.py [database-url]
+
+ACTIVITY_RECENT_DAYS = int(os.environ.get('ACTIVITY_RECENT_DAYS', '30'))
+
+COUNTERS = ('deposited', 'withdrawn', 'deposit_count', 'withdrawal_count')
+
+
+def utc_now():
+    # Naive UTC, the same clock as CURRENT_TIMESTAMP column defaults
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _upsert(dialect_name, model, values):
+    # Increments are computed by the database, so concurrent transfers never lose one
+    statement = (postgresql.insert if dialect_name == 'postgresql' else sqlite.insert)(model).values(**values)
+    table = model.__table__
+    changes = {name: table.c[name] + statement.excluded[name] for name in COUNTERS}
+    changes['last_activity_at'] = statement.excluded.last_activity_at
+    return statement.on_conflict_do_update(index_elements=list(table.primary_key.columns), set_=changes)
+
+
+def record_transfer(entry):
+    """Add a new ledger entry to every aggregate; commits with the caller's transaction."""
+    if entry.created_at is None:
+        entry.created_at = utc_now()
+    deposit = entry.entry_type == 'deposit'
+    increments = {
+        'deposited': entry.amount if deposit else Money(),
+        'withdrawn': Money() if deposit else entry.amount,
+        'deposit_count': int(deposit),
+        'withdrawal_count': int(not deposit),
+        'last_activity_at': entry.created_at
+    }
+    dialect_name = db.session.get_bind().dialect.name
+    for model, keys in (
+            (UserActivity, {'user_id': entry.user_id}),
+            (ConnectionActivity, {'bank_connection_id': entry.bank_connection_id, 'user_id': entry.user_id}),
+            (DailyActivity, {'user_id': entry.user_id, 'day': entry.created_at.date()})):
+        db.session.execute(_upsert(dialect_name, model, dict(keys, **increments)))
+
+
+def rebuild(connection):
+    """Recompute every aggregate from ledger_entries in the connection's transaction."""
+    if connection.dialect.name == 'postgresql':
+        # New entries wait for the rebuild, so none is counted twice or missed
+        connection.execute(text('LOCK TABLE ledger_entries IN SHARE MODE'))
+        day = cast(LedgerEntry.created_at, Date)
+    else:
+        day = func.date(LedgerEntry.created_at)
+
+    deposit = LedgerEntry.entry_type == 'deposit'
+    counters = [
+        sum_money(case((deposit, LedgerEntry.amount), else_=0)),
+        sum_money(case((deposit, 0), else_=LedgerEntry.amount)),
+        func.sum(case((deposit, 1), else_=0)),
+        func.sum(case((deposit, 0), else_=1)),
+        func.max(LedgerEntry.created_at),
+    ]
+    rebuilt = {}
+    for model, keys in (
+            (UserActivity, {'user_id': LedgerEntry.user_id}),
+            (ConnectionActivity, {'bank_connection_id': LedgerEntry.bank_connection_id,
+                                  'user_id': LedgerEntry.user_id}),
+            (DailyActivity, {'user_id': LedgerEntry.user_id, 'day': day})):
+        connection.execute(delete(model))
+        grouped = select(*keys.values(), *counters).group_by(*keys.values())
+        result = connection.execute(insert(model).from_select(
+            [*keys, *COUNTERS, 'last_activity_at'], grouped))
+        rebuilt[model.__tablename__] = result.rowcount
+    return rebuilt
+
+
+def summary_statement(user_id, since):
+    """Every aggregate row the dashboard needs, as one UNION ALL of primary-key and index seeks."""
+
+    def counters(model):
+        return [getattr(model, name) for name in COUNTERS] + [model.last_activity_at]
+
+    return union_all(
+        select(literal('user').label('scope'), literal(None, Integer).label('bank_connection_id'),
+               literal(None, Date).label('day'), *counters(UserActivity))
+        .where(UserActivity.user_id == user_id),
+        select(literal('connection'), ConnectionActivity.bank_connection_id, literal(None, Date),
+               *counters(ConnectionActivity))
+        .where(ConnectionActivity.user_id == user_id),
+        select(literal('day'), literal(None, Integer), DailyActivity.day, *counters(DailyActivity))
+        .where(DailyActivity.user_id == user_id, DailyActivity.day >= since),
+    )
+
+
+def _counters_dict(row):
+    return {
+        'deposited': str(row.deposited),
+        'withdrawn': str(row.withdrawn),
+        'deposit_count': row.deposit_count,
+        'withdrawal_count': row.withdrawal_count,
+        'last_activity_at': row.last_activity_at
+    }
+
+
+def load_summary(user_id, today=None):
+    today = today or utc_now().date()
+    month_start = today.replace(day=1)
+    since = min(month_start, today - timedelta(days=ACTIVITY_RECENT_DAYS - 1))
+
+    totals = {'deposited': str(Money()), 'withdrawn': str(Money()), 'deposit_count': 0,
+              'withdrawal_count': 0, 'last_activity_at': None}
+    month = {name: Money() if name in ('deposited', 'withdrawn') else 0 for name in COUNTERS}
+    connections = []
+    daily = []
+    for row in db.session.execute(summary_statement(user_id, since)):
+        if row.scope == 'user':
+            totals = _counters_dict(row)
+        elif row.scope == 'connection':
+            connections.append(dict(_counters_dict(row), bank_connection_id=row.bank_connection_id,
+                                    net_deposited=str(row.deposited - row.withdrawn)))
+        else:
+            if row.day >= month_start:
+                for name in COUNTERS:
+                    month[name] = month[name] + getattr(row, name)
+            if row.day > today - timedelta(days=ACTIVITY_RECENT_DAYS):
+                daily.append(dict(_counters_dict(row), day=row.day.isoformat()))
+
+    return {
+        'user_id': int(user_id),
+        'totals': totals,
+        'this_month': {name: str(value) if isinstance(value, Money) else value for name, value in month.items()},
+        'connections': sorted(connections, key=lambda connection: connection['bank_connection_id']),
+        'daily': sorted(daily, key=lambda day: day['day'], reverse=True)
+    }
+
+
+if __name__ == '__main__':
+    from db_config import DATABASE_URL, make_engine
+    from migrate import upgrade
+
+    engine = make_engine(sys.argv[1] if len(sys.argv) > 1 else DATABASE_URL)
+    upgrade(engine)
+    with engine.begin() as connection:
+        for table, rows in rebuild(connection).items():
+            print(f'{table}: {rows} rows')
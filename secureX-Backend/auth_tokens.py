@@ -0,0 +1,203 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from flask_jwt_extended import JWTManager, create_access_token
+from sqlalchemy import delete, select
+
+from models import db, RevokedToken
+
+JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')  # Falls back to the app's SECRET_KEY
+ACCESS_TOKEN_LIFETIME = timedelta(seconds=int(os.environ.get('ACCESS_TOKEN_LIFETIME', str(24 * 3600))))
+# Decoded tokens kept per process so repeat requests skip the signature check
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '4096'))
+# How often each process pulls revocations made by other processes
+REVOCATION_REFRESH_INTERVAL = float(os.environ.get('REVOCATION_REFRESH_INTERVAL', '5'))
+REVOCATION_BLOOM_CAPACITY = int(os.environ.get('REVOCATION_BLOOM_CAPACITY', '100000'))
+REVOCATION_BLOOM_ERROR_RATE = float(os.environ.get('REVOCATION_BLOOM_ERROR_RATE', '0.001'))
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class TokenCache:
+    """LRU of raw token -> verified claims; entries are dropped once the token expires."""
+
+    def __init__(self, max_entries=TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token):
+        with self._lock:
+            claims = self._entries.get(token)
+            if claims is None or claims['exp'] <= time.time():
+                self._entries.pop(token, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return claims
+
+    def put(self, token, claims):
+        with self._lock:
+            self._entries[token] = claims
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def device_key(user_id, device):
+    return f'device:{user_id}:{device}'
+
+
+class RevocationList:
+    """Bloom filter over the revoked_tokens table.
+
+    Requests only touch the database when the filter reports a possible match, and the
+    verdict for that token is remembered until new revocations arrive.
+    """
+
+    def __init__(self, capacity=REVOCATION_BLOOM_CAPACITY, error_rate=REVOCATION_BLOOM_ERROR_RATE,
+                 refresh_interval=REVOCATION_REFRESH_INTERVAL):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._loaded = 0
+        self._last_id = None
+        self._next_refresh = 0.0
+        self._verdicts = {}
+        self.confirmed = 0
+        self.cleared = 0
+
+    def _rebuild(self):
+        # Expired revocations can no longer match a valid token, so they are pruned here
+        db.session.execute(delete(RevokedToken).where(RevokedToken.expires_at < int(time.time())))
+        db.session.commit()
+        self._bloom = BloomFilter(self.capacity, self.error_rate)
+        self._loaded = 0
+        self._last_id = 0
+
+    def refresh(self):
+        with self._lock:
+            if self._last_id is None or self._loaded > self.capacity:
+                self._rebuild()
+            rows = db.session.execute(
+                select(RevokedToken.id, RevokedToken.key)
+                .where(RevokedToken.id > self._last_id, RevokedToken.expires_at >= int(time.time()))
+                .order_by(RevokedToken.id)
+            ).all()
+            for row_id, key in rows:
+                self._bloom.add(key)
+                self._last_id = row_id
+            if rows:
+                self._loaded += len(rows)
+                self._verdicts.clear()
+            self._next_refresh = time.monotonic() + self.refresh_interval
+
+    def is_revoked(self, claims):
+        if time.monotonic() >= self._next_refresh:
+            self.refresh()
+        keys = [f'jti:{claims["jti"]}']
+        if claims.get('device'):
+            keys.append(device_key(claims['sub'], claims['device']))
+        suspects = [key for key in keys if key in self._bloom]
+        if not suspects:
+            return False
+
+        verdict = self._verdicts.get(claims['jti'])
+        if verdict is None:
+            verdict = db.session.execute(
+                select(RevokedToken.id)
+                .where(RevokedToken.key.in_(suspects), RevokedToken.revoked_at >= claims['iat'])
+                .limit(1)
+            ).first() is not None
+            if verdict:
+                self.confirmed += 1
+            else:
+                self.cleared += 1  # Filter false positive, or a token issued after its device was revoked
+            with self._lock:
+                if len(self._verdicts) >= TOKEN_CACHE_SIZE:
+                    self._verdicts.clear()
+                self._verdicts[claims['jti']] = verdict
+        return verdict
+
+    def _revoke(self, key, expires_at):
+        db.session.add(RevokedToken(key=key, revoked_at=int(time.time()), expires_at=int(expires_at)))
+        db.session.commit()
+        with self._lock:
+            self._bloom.add(key)
+            self._verdicts.clear()
+
+    def revoke_token(self, claims):
+        self._revoke(f'jti:{claims["jti"]}', claims['exp'])
+
+    def revoke_device(self, user_id, device):
+        # Covers every token already issued to the device; new logins from it get fresh tokens
+        self._revoke(device_key(user_id, device), time.time() + ACCESS_TOKEN_LIFETIME.total_seconds())
+
+    def stats(self):
+        return {'confirmed': self.confirmed, 'cleared': self.cleared}
+
+
+class CachingJWTManager(JWTManager):
+    def _decode_jwt_from_config(self, encoded_token, csrf_value=None, allow_expired=False):
+        cacheable = csrf_value is None and not allow_expired
+        if cacheable:
+            claims = token_cache.get(encoded_token)
+            if claims is not None:
+                return dict(claims)
+        claims = super()._decode_jwt_from_config(encoded_token, csrf_value, allow_expired)
+        if cacheable:
+            token_cache.put(encoded_token, dict(claims))
+        return claims
+
+
+token_cache = TokenCache()
+revocation_list = RevocationList()
+
+
+def issue_access_token(user):
+    return create_access_token(identity=str(user.id),
+                               additional_claims={'email': user.email, 'device': user.authorised_device},
+                               expires_delta=ACCESS_TOKEN_LIFETIME)
+
+
+def init_auth(app):
+    app.config['JWT_SECRET_KEY'] = JWT_SECRET_KEY or app.config['SECRET_KEY']
+    jwt = CachingJWTManager(app)
+
+    @jwt.token_in_blocklist_loader
+    def _is_revoked(jwt_header, jwt_payload):
+        return revocation_list.is_revoked(jwt_payload)
+
+    return jwt
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from money import Money
+
+BALANCE_CACHE_BACKEND = os.environ.get('BALANCE_CACHE_BACKEND', 'memory')  # 'memory' or 'redis'
+BALANCE_CACHE_TTL = float(os.environ.get('BALANCE_CACHE_TTL', '30'))
+BALANCE_CACHE_SIZE = int(os.environ.get('BALANCE_CACHE_SIZE', '10000'))
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry.
+
+    A key's version stamp lives in its LRU record next to the entry, so versions are
+    bounded by max_entries too; an invalidated key keeps its record with no entry.
+    """
+
+    def __init__(self, max_entries=BALANCE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> [entry or None, expires_at, version]
+        self.evictions = 0
+        self.expirations = 0
+
+    def _record(self, key):
+        record = self._entries.get(key)
+        if record is None:
+            record = self._entries[key] = [None, 0.0, 0]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return record
+
+    def get(self, key):
+        record = self._entries.get(key)
+        if record is None or record[0] is None:
+            return None
+        if record[1] <= time.monotonic():
+            record[0] = None
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return record[0]
+
+    def set(self, key, entry, ttl):
+        record = self._record(key)
+        record[0], record[1] = entry, time.monotonic() + ttl
+
+    def delete(self, key):
+        record = self._entries.get(key)
+        if record is not None:
+            record[0] = None
+
+    def get_version(self, key):
+        record = self._entries.get(key)
+        return record[2] if record else 0
+
+    def incr_version(self, key):
+        record = self._record(key)
+        record[2] += 1
+        return record[2]
+
+    def clear(self):
+        # Versions stay, so a fill loaded before the clear is still checked against them
+        for record in self._entries.values():
+            record[0] = None
+
+
+class RedisBackend:
+    """Shares entries and version stamps between processes through Redis."""
+
+    def __init__(self, url=REDIS_URL):
+        import redis  # Only needed when BALANCE_CACHE_BACKEND=redis
+        self._redis = redis.Redis.from_url(url)
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        raw = self._redis.get(f'balance:{key}')
+        if not raw:
+            return None
+        entry = json.loads(raw)
+        entry['balance'] = Money.from_stroops(entry['balance'])
+        return entry
+
+    def set(self, key, entry, ttl):
+        raw = json.dumps({'balance': entry['balance'].stroops, 'version': entry['version']})
+        self._redis.set(f'balance:{key}', raw, px=int(ttl * 1000))
+
+    def delete(self, key):
+        self._redis.delete(f'balance:{key}')
+
+    def get_version(self, key):
+        return int(self._redis.get(f'balance_version:{key}') or 0)
+
+    def incr_version(self, key):
+        return self._redis.incr(f'balance_version:{key}')
+
+    def clear(self):
+        for key in self._redis.scan_iter('balance:*'):
+            self._redis.delete(key)
+
+
+class BalanceCache:
+    """Read-through cache of StellarAccount balances, invalidated on write.
+
+    Every entry carries the key's version stamp. Writers bump the version and drop
+    the entry once they commit, so a fill loaded by an older read is never stored.
+    """
+
+    def __init__(self, backend=None, ttl=BALANCE_CACHE_TTL):
+        self.backend = backend or (RedisBackend() if BALANCE_CACHE_BACKEND == 'redis' else MemoryBackend())
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(user_id, stellar_address):
+        return f'{user_id}:{stellar_address}'
+
+    def get(self, key, loader):
+        with self._lock:
+            version = self.backend.get_version(key)
+            entry = self.backend.get(key)
+            if entry is not None and entry['version'] == version:
+                self.hits += 1
+                return entry['balance']
+            self.misses += 1
+
+        balance = loader()
+        if balance is None:
+            return None
+        with self._lock:
+            # Skip the fill if a write committed while we were reading the database
+            if self.backend.get_version(key) == version:
+                self.backend.set(key, {'balance': balance, 'version': version}, self.ttl)
+        return balance
+
+    def invalidate(self, key):
+        with self._lock:
+            self.backend.incr_version(key)
+            self.backend.delete(key)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.backend.evictions,
+            'expirations': self.backend.expirations
+        }
+
+
+balance_cache = BalanceCache()
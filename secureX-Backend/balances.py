@@ -0,0 +1,61 @@
+from sqlalchemy import type_coerce
+
+from models import db, StellarAccount, BalanceHold
+from money import MoneyType
+
+# All balance mutations are single conditional UPDATEs evaluated by the database, so
+# concurrent workers never act on a balance they read earlier in Python.
+
+
+def credit(stellar_account_id, amount):
+    (StellarAccount.query
+     .filter(StellarAccount.id == stellar_account_id)
+     .update({StellarAccount.balance: StellarAccount.balance + amount}, synchronize_session=False))
+
+
+def reserve(stellar_account_id, saga_id, amount):
+    """Reserve funds for a withdrawal; returns False when the available balance is too low."""
+    reserved = (StellarAccount.query
+                .filter(StellarAccount.id == stellar_account_id,
+                        type_coerce(StellarAccount.balance - StellarAccount.reserved_balance, MoneyType) >= amount)
+                .update({StellarAccount.reserved_balance: StellarAccount.reserved_balance + amount},
+                        synchronize_session=False))
+    if not reserved:
+        db.session.rollback()
+        return False
+    db.session.add(BalanceHold(stellar_account_id=stellar_account_id, saga_id=saga_id,
+                               amount=amount, status='held'))
+    db.session.commit()
+    return True
+
+
+def _close_holds(saga_id, status):
+    # Claim the holds first so a hold is settled or released exactly once
+    holds = BalanceHold.query.filter_by(saga_id=saga_id, status='held').all()
+    for hold in holds:
+        closed = (BalanceHold.query
+                  .filter(BalanceHold.id == hold.id, BalanceHold.status == 'held')
+                  .update({BalanceHold.status: status}, synchronize_session=False))
+        if not closed:
+            continue
+        changes = {StellarAccount.reserved_balance: StellarAccount.reserved_balance - hold.amount}
+        if status == 'settled':
+            changes[StellarAccount.balance] = StellarAccount.balance - hold.amount
+        (StellarAccount.query
+         .filter(StellarAccount.id == hold.stellar_account_id)
+         .update(changes, synchronize_session=False))
+    return len(holds)
+
+
+def settle_holds(saga_id):
+    # Turns the reservation into a debit; commits with the caller's transaction
+    return _close_holds(saga_id, 'settled')
+
+
+def release_holds(saga_id):
+    # Gives the reserved funds back; commits with the caller's transaction
+    return _close_holds(saga_id, 'released')
+
+
+def current_balance(stellar_account_id):
+    return db.session.query(StellarAccount.balance).filter(StellarAccount.id == stellar_account_id).scalar()
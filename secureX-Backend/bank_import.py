@@ -0,0 +1,61 @@
+import csv
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from http_client import client, PartnerBusy, BANK_API_URL
+
+BULK_IMPORT_MAX_ROWS = int(os.environ.get('BULK_IMPORT_MAX_ROWS', '1000'))
+# Verifications in flight per import; keep below HTTP_MAX_CONCURRENCY so one import cannot starve transfers
+BULK_VERIFY_CONCURRENCY = int(os.environ.get('BULK_VERIFY_CONCURRENCY', '8'))
+
+IMPORT_FIELDS = ('bank_name', 'account_number', 'connection_status')
+
+
+def parse_rows(payload, content_type):
+    """Parse a CSV (with a header line) or JSON batch into a list of dicts; raises ValueError."""
+    if content_type in ('text/csv', 'application/csv'):
+        rows = list(csv.DictReader(io.StringIO(payload)))
+    else:
+        body = json.loads(payload or 'null')
+        rows = body.get('accounts') if isinstance(body, dict) else body
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValueError('Expected a list of accounts')
+    if not rows:
+        raise ValueError('No accounts to import')
+    if len(rows) > BULK_IMPORT_MAX_ROWS:
+        raise ValueError(f'At most {BULK_IMPORT_MAX_ROWS} accounts per import')
+    return [{field: str(row.get(field) or '').strip() for field in IMPORT_FIELDS} for row in rows]
+
+
+def _verify(row, user_name):
+    response = client.post(BANK_API_URL + "/connect", json={
+        "account_number": row['account_number'],
+        "bank_name": row['bank_name'],
+        "user_name": user_name
+    })
+    response_data = response.json() if response.content else {}
+    if response.status_code != 200 or not response_data.get('verified'):
+        return {'status': 'failed', 'message': 'Bank account verification failed'}
+    if not response_data.get('routing_number'):
+        return {'status': 'failed', 'message': 'Bank did not return a routing number'}
+    return {'status': 'verified', 'routing_number': response_data['routing_number']}
+
+
+def verify_rows(rows, user_name, concurrency=BULK_VERIFY_CONCURRENCY):
+    """Yield (index, result) as each verification finishes, at most `concurrency` at a time."""
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bank-verify')
+    try:
+        futures = {executor.submit(_verify, rows[index], user_name): index for index in range(len(rows))}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except PartnerBusy:
+                result = {'status': 'busy', 'message': 'Bank is busy, retry this account later'}
+            except Exception as e:
+                result = {'status': 'error', 'message': f'Bank verification error: {str(e)}'}
+            yield futures[future], result
+    finally:
+        # A client that disconnects mid-stream stops the verifications still queued
+        executor.shutdown(wait=False, cancel_futures=True)
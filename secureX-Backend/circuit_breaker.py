@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+
+BREAKER_STORE = os.environ.get('BREAKER_STORE', 'sqlite')  # 'sqlite' (shared by local processes) or 'memory'
+BREAKER_STORE_PATH = os.environ.get('BREAKER_STORE_PATH',
+                                    os.path.join(tempfile.gettempdir(), 'securex_breakers.db'))
+# Rolling window the error rate is measured over, split into buckets that age out one at a time
+BREAKER_WINDOW = float(os.environ.get('BREAKER_WINDOW', '30'))
+BREAKER_BUCKETS = int(os.environ.get('BREAKER_BUCKETS', '10'))
+BREAKER_MIN_CALLS = int(os.environ.get('BREAKER_MIN_CALLS', '10'))
+BREAKER_ERROR_RATE = float(os.environ.get('BREAKER_ERROR_RATE', '0.5'))
+BREAKER_OPEN_SECONDS = float(os.environ.get('BREAKER_OPEN_SECONDS', '30'))
+# A half-open probe that has not reported back by then is presumed lost and another may start
+BREAKER_PROBE_TIMEOUT = float(os.environ.get('BREAKER_PROBE_TIMEOUT', '15'))
+# How stale this process's view of the shared state may get
+BREAKER_SYNC_INTERVAL = float(os.environ.get('BREAKER_SYNC_INTERVAL', '0.5'))
+
+
+class CircuitOpen(Exception):
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f'Circuit open for {endpoint}')
+        self.endpoint = endpoint
+        self.retry_after = max(retry_after, 0.0)
+
+
+class MemoryStore:
+    """Breaker states for a single process."""
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint):
+        with self._lock:
+            return self._states.get(endpoint, ('closed', 0.0))
+
+    def all(self):
+        with self._lock:
+            return dict(self._states)
+
+    def set(self, endpoint, state, until):
+        with self._lock:
+            self._states[endpoint] = (state, until)
+
+    def try_probe(self, endpoint, now, probe_until):
+        with self._lock:
+            state, until = self._states.get(endpoint, ('closed', 0.0))
+            if state == 'closed' or until > now:
+                return False
+            self._states[endpoint] = ('half_open', probe_until)
+            return True
+
+
+class SqliteStore:
+    """Breaker states in a small SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path=BREAKER_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(
+            'CREATE TABLE IF NOT EXISTS breakers ('
+            'endpoint TEXT PRIMARY KEY, state TEXT NOT NULL, until REAL NOT NULL)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, endpoint):
+        row = self._connection().execute(
+            'SELECT state, until FROM breakers WHERE endpoint = ?', (endpoint,)).fetchone()
+        return row or ('closed', 0.0)
+
+    def all(self):
+        return {endpoint: (state, until) for endpoint, state, until in
+                self._connection().execute('SELECT endpoint, state, until FROM breakers')}
+
+    def set(self, endpoint, state, until):
+        self._connection().execute(
+            'INSERT INTO breakers (endpoint, state, until) VALUES (?, ?, ?) '
+            'ON CONFLICT (endpoint) DO UPDATE SET state = excluded.state, until = excluded.until',
+            (endpoint, state, until))
+
+    def try_probe(self, endpoint, now, probe_until):
+        # Compare-and-set, so exactly one process gets to probe a lapsed breaker
+        cursor = self._connection().execute(
+            "UPDATE breakers SET state = 'half_open', until = ? "
+            "WHERE endpoint = ? AND state != 'closed' AND until <= ?",
+            (probe_until, endpoint, now))
+        return cursor.rowcount == 1
+
+
+class CircuitBreaker:
+    """Closed -> open when the rolling error rate crosses the threshold; open -> half-open
+    after BREAKER_OPEN_SECONDS, when a single probe call decides between closed and open."""
+
+    def __init__(self, endpoint, store, window=BREAKER_WINDOW, buckets=BREAKER_BUCKETS,
+                 min_calls=BREAKER_MIN_CALLS, error_rate=BREAKER_ERROR_RATE,
+                 open_seconds=BREAKER_OPEN_SECONDS, probe_timeout=BREAKER_PROBE_TIMEOUT,
+                 sync_interval=BREAKER_SYNC_INTERVAL):
+        self.endpoint = endpoint
+        self.store = store
+        self.bucket_seconds = window / buckets
+        self.buckets = buckets
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout
+        self.sync_interval = sync_interval
+        self._window = deque()  # [bucket_start, successes, failures]
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._until = 0.0
+        self._synced_at = 0.0
+        self._probing = False
+
+    def _sync(self, now):
+        if now - self._synced_at >= self.sync_interval and not self._probing:
+            self._state, self._until = self.store.get(self.endpoint)
+            self._synced_at = now
+
+    def _counts(self, now):
+        while self._window and self._window[0][0] <= now - self.bucket_seconds * self.buckets:
+            self._window.popleft()
+        successes = sum(bucket[1] for bucket in self._window)
+        failures = sum(bucket[2] for bucket in self._window)
+        return successes, failures
+
+    def _open(self, now):
+        self._state, self._until = 'open', now + self.open_seconds
+        self._synced_at = now
+        self.store.set(self.endpoint, 'open', self._until)
+
+    def before_call(self):
+        """Raise CircuitOpen unless the call may go ahead."""
+        now = time.time()
+        with self._lock:
+            self._sync(now)
+            if self._state == 'closed':
+                return
+            if now < self._until:
+                raise CircuitOpen(self.endpoint, self._until - now)
+            if self.store.try_probe(self.endpoint, now, now + self.probe_timeout):
+                self._state, self._until = 'half_open', now + self.probe_timeout
+                self._probing = True
+                return
+            # Another process is probing, or has already closed the breaker
+            self._state, self._until = self.store.get(self.endpoint)
+            self._synced_at = now
+            if self._state == 'closed':
+                return
+            raise CircuitOpen(self.endpoint, self._until - now)
+
+    def open_for(self):
+        """Seconds until a call could go ahead; 0 when closed or due a probe. Claims nothing."""
+        now = time.time()
+        with self._lock:
+            self._sync(now)
+            if self._state == 'closed':
+                return 0.0
+            return max(self._until - now, 0.0)
+
+    def record(self, success):
+        now = time.time()
+        with self._lock:
+            if self._probing:
+                self._probing = False
+                self._window.clear()
+                if success:
+                    self._state, self._until = 'closed', 0.0
+                    self._synced_at = now
+                    self.store.set(self.endpoint, 'closed', 0.0)
+                else:
+                    self._open(now)
+                return
+
+            start = now - now % self.bucket_seconds
+            if not self._window or self._window[-1][0] != start:
+                self._window.append([start, 0, 0])
+            self._window[-1][1 if success else 2] += 1
+            if success or self._state != 'closed':
+                return
+            successes, failures = self._counts(now)
+            calls = successes + failures
+            if calls >= self.min_calls and failures / calls >= self.error_rate:
+                self._window.clear()
+                self._open(now)
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            self._sync(now)
+            successes, failures = self._counts(now)
+            calls = successes + failures
+            return {
+                'state': self._state,
+                'retry_after': round(max(self._until - now, 0.0), 3) if self._state != 'closed' else 0.0,
+                'calls': calls,
+                'error_rate': round(failures / calls, 3) if calls else 0.0
+            }
+
+
+class BreakerRegistry:
+    def __init__(self, store=None):
+        self._store = store
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = SqliteStore() if BREAKER_STORE == 'sqlite' else MemoryStore()
+        return self._store
+
+    def get(self, endpoint):
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(endpoint)
+                if breaker is None:
+                    breaker = self._breakers[endpoint] = CircuitBreaker(endpoint, self.store)
+        return breaker
+
+    def snapshot(self):
+        # Include endpoints only other processes have called, so health covers the whole host
+        for endpoint in self.store.all():
+            self.get(endpoint)
+        return {endpoint: breaker.snapshot() for endpoint, breaker in sorted(self._breakers.items())}
+
+
+def endpoint_name(host, path):
+    # Ids in the path (e.g. /transactions/<hash>) share their route's breaker
+    segments = ['*' if any(ch.isdigit() for ch in segment) else segment for segment in path.split('/')]
+    return host + '/'.join(segments)
+
+
+breakers = BreakerRegistry()
@@ -1,9 +1,32 @@
-from flask import request, jsonify, make_response
+import base64
+import csv
+import json
+import math
+from flask import request, jsonify, make_response, Response, stream_with_context
+from sqlalchemy import insert, tuple_
 from models import *
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
-import requests
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from datetime import datetime
+from http_client import client, PartnerBusy, PartnerUnavailable, BANK_API_URL, HORIZON_URL
+from jobs import enqueue_job, register_handler
+from saga import start_saga, run_step, complete_saga, abort_saga
+from balance_cache import balance_cache
+from balances import credit, reserve, settle_holds, current_balance
+from money import Money
+from passwords import password_hasher, AccountBusy
+from db_config import read_replica
+from request_context import load_transfer_context
+from auth_tokens import issue_access_token, revocation_list
+from bank_import import parse_rows, verify_rows
+from activity import record_transfer, load_summary, utc_now
+
+def _partner_unavailable(e):
+    # The call never reached the partner: shed locally, or the endpoint's circuit is open
+    if isinstance(e, PartnerUnavailable):
+        response = jsonify({'message': 'Partner service is unavailable, try again later'})
+        response.headers['Retry-After'] = str(math.ceil(e.retry_after))
+        return response, 503
+    return jsonify({'message': 'Partner service is busy, try again shortly'}), 429
 
 def create_account(data):
     try:
@@ -20,7 +43,7 @@ def create_account(data):
         if User.query.filter_by(email=email, authorised_device=authorised_device).first():
             return jsonify({'message': 'User with this email or authorised device already exists'}), 400
 
-        hashed_password = generate_password_hash(password, method='bcrypt')
+        hashed_password = password_hasher.hash(password)
 
         new_user = User(
             email=email,
@@ -36,8 +59,8 @@ def create_account(data):
         # Create a Stellar account for the user
         try:
             # Call Stellar API to create account
-            stellar_api_url = "https://horizon-testnet.stellar.org/accounts"
-            stellar_response = requests.post(stellar_api_url)
+            stellar_api_url = HORIZON_URL + "/accounts"
+            stellar_response = client.post(stellar_api_url)
             
             if stellar_response.status_code == 200:
                 stellar_data = stellar_response.json()
@@ -48,8 +71,8 @@ def create_account(data):
                 new_stellar_account = StellarAccount(
                     user_id=new_user.id,
                     stellar_address=stellar_address,
-                    balance=0.0,
-                    is_active=True
+                    stellar_secret=seed,
+                    balance=Money()
                 )
                 db.session.add(new_stellar_account)
                 db.session.commit()
@@ -64,6 +87,9 @@ def create_account(data):
                 db.session.rollback()
                 return jsonify({'message': 'Failed to create Stellar account'}), 500
                 
+        except PartnerBusy as e:
+            db.session.rollback()
+            return _partner_unavailable(e)
         except Exception as e:
             db.session.rollback()
             return jsonify({'message': f'Error creating Stellar account: {str(e)}'}), 500
@@ -86,8 +112,15 @@ def login_account(data):
 
         user = User.query.filter_by(email=email, authorised_device=authorised_device).first()
 
-        if not user or not check_password_hash(user.password, password):
-            return jsonify({'message': 'Invalid credentials'}), 401
+        try:
+            if not user or not password_hasher.verify(user.email, user.password, password):
+                return jsonify({'message': 'Invalid credentials'}), 401
+        except AccountBusy:
+            return jsonify({'message': 'Too many login attempts, try again shortly'}), 429
+
+        # Upgrade hashes made with an older method or cost on the first successful login
+        if password_hasher.needs_rehash(user.password):
+            user.password = password_hasher.hash(password)
 
         user.last_login = last_login
         if user.location != location:
@@ -95,7 +128,7 @@ def login_account(data):
             
         db.session.commit()
 
-        access_token = create_access_token(identity={'email': user.email}, expires_delta=timedelta(days=1))
+        access_token = issue_access_token(user)
 
         return jsonify({'access_token': access_token}), 200
     except Exception as e:
@@ -116,13 +149,34 @@ def biometrics_login(data):
             return jsonify({'message': 'User not found'}), 404
         
         if user.biometrics:
-            access_token = create_access_token(identity={'email': user.email}, expires_delta=timedelta(days=1))
+            access_token = issue_access_token(user)
             return jsonify({'access_token': access_token}), 200
         else:
             return jsonify({'message': 'Biometrics not enabled for this user'}), 403
     except Exception as e:
         return jsonify({'message': str(e)}), 500
 
+def logout_account():
+    try:
+        revocation_list.revoke_token(get_jwt())
+        return jsonify({'message': 'Logged out'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+def revoke_device(data):
+    try:
+        device_id = data.get('device_id')
+
+        if not device_id:
+            return jsonify({'message': 'Device ID is required'}), 400
+
+        revocation_list.revoke_device(get_jwt_identity(), device_id)
+        return jsonify({'message': 'Device tokens revoked'}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
 def update_user(data):
     try:
         user_id = data.get('user_id')
@@ -156,7 +210,8 @@ def connect_bank_account(data):
         account_number = data.get('account_number')
         connection_status = data.get('connection_status')
 
-        if not user_id or not bank_name or not account_number or not routing_number or not connection_status:
+        # The routing number comes back from the bank's verification below
+        if not user_id or not bank_name or not account_number or not connection_status:
             return jsonify({'message': 'All fields are required'}), 400
 
         user = User.query.filter_by(id=user_id).first()
@@ -164,14 +219,14 @@ def connect_bank_account(data):
             return jsonify({'message': 'User not found'}), 404
 
         try:
-            bank_api_url = "https://api.bankingpartner.com/connect"
+            bank_api_url = BANK_API_URL + "/connect"
             
             verification_data = {
                 "account_number": account_number,
                 "bank_name": bank_name,
                 "user_name": user.name
             }
-            response = requests.post(bank_api_url, json=verification_data)
+            response = client.post(bank_api_url, json=verification_data)
             
             response_data = response.json()
             if response.status_code != 200 or not response_data.get('verified'):
@@ -191,6 +246,8 @@ def connect_bank_account(data):
 
             return jsonify({'message': 'Bank account connected successfully'}), 201
 
+        except PartnerBusy as e:
+            return _partner_unavailable(e)
         except Exception as e:
             return jsonify({'message': f'Bank verification error: {str(e)}'}), 500
 
@@ -199,6 +256,91 @@ def connect_bank_account(data):
         return jsonify({'message': str(e)}), 500
     
 
+def _import_line(index, row, result):
+    return json.dumps(dict({'row': index + 1, 'account_number': row['account_number']}, **result)) + '\n'
+
+def import_bank_connections(data):
+    try:
+        user_id = data.get('user_id')
+        if not user_id:
+            return jsonify({'message': 'User ID is required'}), 400
+
+        user = User.query.filter_by(id=user_id).first()
+        if not user:
+            return jsonify({'message': 'User not found'}), 404
+
+        try:
+            rows = parse_rows(data.get('payload'), data.get('content_type'))
+        except (ValueError, csv.Error) as e:
+            return jsonify({'message': f'Invalid import: {str(e)}'}), 400
+
+        # Rows that can be rejected without a bank call, checked against one lookup
+        existing = set(db.session.query(BankConnection.bank_name, BankConnection.account_number)
+                       .filter(BankConnection.user_id == user.id,
+                               BankConnection.account_number.in_({row['account_number'] for row in rows})))
+        results = [None] * len(rows)
+        pending, queued = [], set()
+        for index, row in enumerate(rows):
+            account = (row['bank_name'], row['account_number'])
+            if not row['bank_name'] or not row['account_number']:
+                results[index] = {'status': 'invalid', 'message': 'bank_name and account_number are required'}
+            elif len(row['account_number']) > 20:
+                results[index] = {'status': 'invalid', 'message': 'account_number is too long'}
+            elif account in existing:
+                results[index] = {'status': 'duplicate', 'message': 'Bank account is already connected'}
+            elif account in queued:
+                results[index] = {'status': 'duplicate', 'message': 'Bank account appears earlier in this import'}
+            else:
+                queued.add(account)
+                pending.append(index)
+        user_name = user.name
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+    def generate():
+        # One JSON line per row: rejected rows as soon as they are known, connected rows
+        # once the single bulk insert has committed, then a summary line
+        counts = {}
+        for index, result in enumerate(results):
+            if result:
+                counts[result['status']] = counts.get(result['status'], 0) + 1
+                yield _import_line(index, rows[index], result)
+
+        verified = []
+        for position, result in verify_rows([rows[index] for index in pending], user_name):
+            index = pending[position]
+            if result['status'] == 'verified':
+                verified.append((index, result['routing_number']))
+                continue
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+            yield _import_line(index, rows[index], result)
+
+        if verified:
+            verified.sort()
+            try:
+                ids = db.session.scalars(
+                    insert(BankConnection).returning(BankConnection.id, sort_by_parameter_order=True),
+                    [{
+                        'user_id': user.id,
+                        'bank_name': rows[index]['bank_name'],
+                        'account_number': rows[index]['account_number'],
+                        'routing_number': routing_number,
+                        'connection_status': rows[index]['connection_status'] or 'connected'
+                    } for index, routing_number in verified]).all()
+                db.session.commit()
+                outcomes = [{'status': 'connected', 'bank_connection_id': id} for id in ids]
+            except Exception as e:
+                db.session.rollback()
+                outcomes = [{'status': 'error', 'message': f'Failed to save: {str(e)}'}] * len(verified)
+            for (index, _), outcome in zip(verified, outcomes):
+                counts[outcome['status']] = counts.get(outcome['status'], 0) + 1
+                yield _import_line(index, rows[index], outcome)
+
+        yield json.dumps({'summary': dict(counts, total=len(rows))}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson'), 200
+
 def disconnect_bank_account(data):
     try:
         user_id = data.get('user_id')
@@ -207,38 +349,33 @@ def disconnect_bank_account(data):
         if not user_id or not bank_connection_id:
             return jsonify({'message': 'All fields are required'}), 400
 
-        # Verify user exists
-        user = User.query.filter_by(id=user_id).first()
+        # Verify user and bank connection exist
+        user, connection, _ = load_transfer_context(user_id, bank_connection_id=bank_connection_id)
         if not user:
             return jsonify({'message': 'User not found'}), 404
 
-        # Find the bank connection before deletion
-        connection = BankConnection.query.filter_by(id=bank_connection_id, user_id=user_id).first()
         if not connection:
             return jsonify({'message': 'Bank connection not found'}), 404
 
         # Make API request to bank to intimate disconnection
         try:
-            bank_api_url = "https://api.bankingpartner.com/disconnect"
+            bank_api_url = BANK_API_URL + "/disconnect"
             disconnection_data = {
                 "account_number": connection.account_number,
                 "routing_number": connection.routing_number,
                 "bank_name": connection.bank_name,
                 "user_id": user_id
             }
-            response = requests.post(bank_api_url, json=disconnection_data)
+            response = client.post(bank_api_url, json=disconnection_data)
             
             if response.status_code != 200:
                 return jsonify({'message': 'Failed to notify bank about disconnection'}), 500
             
+        except PartnerBusy as e:
+            return _partner_unavailable(e)
         except Exception as e:
             return jsonify({'message': f'Bank notification error: {str(e)}'}), 500
 
-        connection = BankConnection.query.filter_by(id=bank_connection_id, user_id=user_id).first()
-
-        if not connection:
-            return jsonify({'message': 'Bank connection not found'}), 404
-
         db.session.delete(connection)
         db.session.commit()
 
@@ -247,203 +384,424 @@ def disconnect_bank_account(data):
         db.session.rollback()
         return jsonify({'message': str(e)}), 500
     
-def deposit_funds(data):
-    try:
-        user_id = data.get('user_id')
-        stellar_address = data.get('stellar_address')
-        amount = data.get('amount')
-        bank_connection_id = data.get('bank_connection_id')  
+def _transfer_fields(data):
+    return data.get('user_id'), data.get('stellar_address'), data.get('amount'), data.get('bank_connection_id')
 
-        if not user_id or not stellar_address or not amount or not bank_connection_id:
-            return jsonify({'message': 'All fields are required'}), 400
+def _load_transfer_accounts(data, check_balance=False):
+    user_id, stellar_address, amount, bank_connection_id = _transfer_fields(data)
 
-        # Verify user exists
-        user = User.query.filter_by(id=user_id).first()
-        if not user:
-            return jsonify({'message': 'User not found'}), 404
+    if not user_id or not stellar_address or not amount or not bank_connection_id:
+        return None, (jsonify({'message': 'All fields are required'}), 400)
 
-        # Verify bank connection exists
-        bank_connection = BankConnection.query.filter_by(id=bank_connection_id, user_id=user_id).first()
-        if not bank_connection:
-            return jsonify({'message': 'Bank connection not found'}), 404
+    try:
+        amount = Money.parse(amount)
+    except ValueError:
+        return None, (jsonify({'message': 'Invalid amount'}), 400)
+    if amount <= 0:
+        return None, (jsonify({'message': 'Invalid amount'}), 400)
+
+    # Verify user, bank connection and Stellar account exist in a single query
+    user, bank_connection, stellar_account = load_transfer_context(
+        user_id, bank_connection_id=bank_connection_id, stellar_address=stellar_address)
+    if not user:
+        return None, (jsonify({'message': 'User not found'}), 404)
+
+    if not bank_connection:
+        return None, (jsonify({'message': 'Bank connection not found'}), 404)
+
+    # Check for sufficient balance for withdrawals
+    if not stellar_account:
+        return None, (jsonify({'message': 'Stellar account not found'}), 404)
+
+    if check_balance and stellar_account.available_balance < amount:
+        return None, (jsonify({'message': 'Insufficient funds in Stellar account'}), 400)
+
+    return (bank_connection, stellar_account, amount), None
+
+def _record_transfer(saga, bank_connection, stellar_account, entry_type, amount, bank_reference, stellar_reference):
+    # Ledger entry (with the partner references reconciliation matches on), the bank leg for
+    # the connection's history, and the dashboard totals all commit with the saga completion
+    entry = LedgerEntry(
+        saga_id=saga.id,
+        user_id=stellar_account.user_id,
+        stellar_account_id=stellar_account.id,
+        bank_connection_id=bank_connection.id,
+        entry_type=entry_type,
+        amount=amount,
+        bank_reference=bank_reference,
+        stellar_reference=stellar_reference,
+        created_at=utc_now()
+    )
+    db.session.add(entry)
+    db.session.add(BankTransaction(
+        bank_connection_id=bank_connection.id,
+        transaction_date=entry.created_at,
+        amount=amount,
+        description=f'SecureX {entry_type} {"to" if entry_type == "deposit" else "from"} {stellar_account.stellar_address}',
+        transaction_type='debit' if entry_type == 'deposit' else 'credit'
+    ))
+    record_transfer(entry)
+    return entry
 
-        # Verify Stellar account exists
-        stellar_account = StellarAccount.query.filter_by(user_id=user_id, stellar_address=stellar_address).first()
-        if not stellar_account:
-            return jsonify({'message': 'Stellar account not found'}), 404
+def deposit_funds(data):
+    saga = None
+    try:
+        accounts, error = _load_transfer_accounts(data)
+        if error:
+            return error
+        user_id, stellar_address, _, _ = _transfer_fields(data)
+        bank_connection, stellar_account, amount = accounts
+
+        # A leg whose breaker is open would only fail after earlier legs moved money
+        try:
+            client.check_available(BANK_API_URL + "/withdraw", BANK_API_URL + "/refund",
+                                   HORIZON_URL + "/transactions")
+        except PartnerUnavailable as e:
+            return _partner_unavailable(e)
+
+        # Every partner call is recorded in the outbox with its compensation, so a failure
+        # (or a crash) is undone by the outbox dispatcher instead of an inline refund
+        saga = start_saga('deposit', data)
 
         # Make API request to bank to withdraw funds
         try:
-            bank_api_url = "https://api.bankingpartner.com/withdraw"
             bank_data = {
                 "account_number": bank_connection.account_number,
                 "routing_number": bank_connection.routing_number,
-                "amount": amount,
+                "amount": str(amount),
                 "user_id": user_id
             }
-            bank_response = requests.post(bank_api_url, json=bank_data)
+            bank_response = run_step(saga, 'bank_withdraw', BANK_API_URL + "/withdraw", bank_data,
+                                     compensation=('bank_refund', BANK_API_URL + "/refund", bank_data))
             
             if bank_response.status_code != 200:
+                abort_saga(saga)
                 return jsonify({'message': 'Failed to withdraw funds from bank account'}), 500
+
+            bank_reference = bank_response.json().get('id')
+        except PartnerBusy as e:
+            abort_saga(saga)
+            return _partner_unavailable(e)
         except Exception as e:
+            abort_saga(saga)
             return jsonify({'message': f'Bank API error: {str(e)}'}), 500
 
         # Make API request to Stellar testnet to deposit funds
         try:
-            stellar_testnet_api_url = "https://horizon-testnet.stellar.org/transactions"
             deposit_data = {
                 "stellar_address": stellar_address,
-                "amount": amount,
+                "amount": str(amount),
                 "user_id": user_id,
                 "network": "testnet"
             }
-            stellar_response = requests.post(stellar_testnet_api_url, json=deposit_data)
+            reversal_data = dict(deposit_data, operation="withdrawal")
+            stellar_response = run_step(saga, 'stellar_deposit', HORIZON_URL + "/transactions", deposit_data,
+                                        compensation=('stellar_reversal', HORIZON_URL + "/transactions", reversal_data))
             
             if stellar_response.status_code != 200:
-                # Refund the bank withdrawal if Stellar deposit fails
-                refund_url = "https://api.bankingpartner.com/refund"
-                requests.post(refund_url, json=bank_data)
+                # Refunds the bank withdrawal through the outbox
+                abort_saga(saga)
                 return jsonify({'message': 'Failed to deposit funds to Stellar account'}), 500
             
-            transaction_id = stellar_response.json().get('id')
+            stellar_body = stellar_response.json()
+            transaction_id = stellar_body.get('id')
+            # Batched submissions return a per-operation id; reconciliation matches on the hash
+            stellar_reference = stellar_body.get('hash') or transaction_id
             
+        except PartnerBusy as e:
+            abort_saga(saga)
+            return _partner_unavailable(e)
         except Exception as e:
-            # Refund the bank withdrawal if Stellar deposit fails
-            refund_url = "https://api.bankingpartner.com/refund"
-            requests.post(refund_url, json=bank_data)
+            abort_saga(saga)
             return jsonify({'message': f'Stellar testnet API error: {str(e)}'}), 500
 
-        # Update Stellar account balance
-        stellar_account.balance += amount
+        # Update Stellar account balance in SQL so concurrent updates are not lost
+        credit(stellar_account.id, amount)
         
-        # Record the transaction in our database
-        new_transaction = Transaction(
-            user_id=user_id,
-            stellar_account_id=stellar_account.id,
-            bank_connection_id=bank_connection_id,
-            amount=amount,
-            transaction_type="deposit",
-            transaction_id=transaction_id,
-            status="completed"
-        )
-        db.session.add(new_transaction)
-        db.session.commit()
+        _record_transfer(saga, bank_connection, stellar_account, "deposit", amount,
+                         bank_reference, stellar_reference)
+        # Commits the balance update together with the saga completion
+        complete_saga(saga)
+        new_balance = current_balance(stellar_account.id)
+        # Drop rather than overwrite: a concurrent transfer may commit after us, and the next read refills
+        balance_cache.invalidate(balance_cache.key(user_id, stellar_address))
 
         return jsonify({
             'message': 'Funds deposited successfully', 
-            'new_balance': stellar_account.balance,
+            'new_balance': str(new_balance),
             'transaction_id': transaction_id
         }), 200
     except Exception as e:
         db.session.rollback()
+        if saga is not None:
+            abort_saga(saga)
         return jsonify({'message': str(e)}), 500
 
 def withdraw_funds(data):
+    saga = None
     try:
-        user_id = data.get('user_id')
-        stellar_address = data.get('stellar_address')
-        amount = data.get('amount')
-        bank_connection_id = data.get('bank_connection_id')
-
-        if not user_id or not stellar_address or not amount or not bank_connection_id:
-            return jsonify({'message': 'All fields are required'}), 400
+        accounts, error = _load_transfer_accounts(data, check_balance=True)
+        if error:
+            return error
+        user_id, stellar_address, _, _ = _transfer_fields(data)
+        bank_connection, stellar_account, amount = accounts
 
-        # Verify user exists
-        user = User.query.filter_by(id=user_id).first()
-        if not user:
-            return jsonify({'message': 'User not found'}), 404
+        try:
+            client.check_available(HORIZON_URL + "/transactions", BANK_API_URL + "/deposit",
+                                   BANK_API_URL + "/withdraw")
+        except PartnerUnavailable as e:
+            return _partner_unavailable(e)
 
-        # Verify bank connection exists
-        bank_connection = BankConnection.query.filter_by(id=bank_connection_id, user_id=user_id).first()
-        if not bank_connection:
-            return jsonify({'message': 'Bank connection not found'}), 404
+        saga = start_saga('withdraw', data)
 
-        # Verify Stellar account exists and has sufficient balance
-        stellar_account = StellarAccount.query.filter_by(user_id=user_id, stellar_address=stellar_address).first()
-        if not stellar_account:
-            return jsonify({'message': 'Stellar account not found'}), 404
-        
-        if stellar_account.balance < amount:
+        # Reserve the funds before any partner call; concurrent withdrawals cannot both pass
+        if not reserve(stellar_account.id, saga.id, amount):
+            abort_saga(saga)
             return jsonify({'message': 'Insufficient funds in Stellar account'}), 400
 
         # Make API request to Stellar testnet to withdraw funds
         try:
-            stellar_testnet_api_url = "https://horizon-testnet.stellar.org/transactions"
             withdraw_data = {
                 "stellar_address": stellar_address,
-                "amount": amount,
+                "amount": str(amount),
                 "user_id": user_id,
                 "operation": "withdrawal",
                 "network": "testnet"
             }
-            stellar_response = requests.post(stellar_testnet_api_url, json=withdraw_data)
+            refund_data = dict(withdraw_data, operation="refund")
+            stellar_response = run_step(saga, 'stellar_withdraw', HORIZON_URL + "/transactions", withdraw_data,
+                                        compensation=('stellar_refund', HORIZON_URL + "/transactions", refund_data))
             
             if stellar_response.status_code != 200:
+                abort_saga(saga)
                 return jsonify({'message': 'Failed to withdraw funds from Stellar account'}), 500
                 
-            transaction_id = stellar_response.json().get('id')
+            stellar_body = stellar_response.json()
+            transaction_id = stellar_body.get('id')
+            # Batched submissions return a per-operation id; reconciliation matches on the hash
+            stellar_reference = stellar_body.get('hash') or transaction_id
             
+        except PartnerBusy as e:
+            abort_saga(saga)
+            return _partner_unavailable(e)
         except Exception as e:
+            abort_saga(saga)
             return jsonify({'message': f'Stellar testnet API error: {str(e)}'}), 500
 
         # Make API request to bank to deposit funds
         try:
-            bank_api_url = "https://api.bankingpartner.com/deposit"
             bank_data = {
                 "account_number": bank_connection.account_number,
                 "routing_number": bank_connection.routing_number,
-                "amount": amount,
+                "amount": str(amount),
                 "user_id": user_id
             }
-            bank_response = requests.post(bank_api_url, json=bank_data)
+            bank_response = run_step(saga, 'bank_deposit', BANK_API_URL + "/deposit", bank_data,
+                                     compensation=('bank_reversal', BANK_API_URL + "/withdraw", bank_data))
             
             if bank_response.status_code != 200:
-                # Refund the Stellar withdrawal if bank deposit fails
-                refund_url = "https://horizon-testnet.stellar.org/transactions"
-                refund_data = {
-                    "stellar_address": stellar_address,
-                    "amount": amount,
-                    "user_id": user_id,
-                    "operation": "refund",
-                    "network": "testnet"
-                }
-                requests.post(refund_url, json=refund_data)
+                # Refunds the Stellar withdrawal through the outbox
+                abort_saga(saga)
                 return jsonify({'message': 'Failed to deposit funds to bank account'}), 500
+
+            bank_reference = bank_response.json().get('id')
             
+        except PartnerBusy as e:
+            abort_saga(saga)
+            return _partner_unavailable(e)
         except Exception as e:
-            # Attempt to refund the Stellar withdrawal
-            refund_url = "https://horizon-testnet.stellar.org/transactions"
-            refund_data = {
-                "stellar_address": stellar_address,
-                "amount": amount,
-                "user_id": user_id,
-                "operation": "refund",
-                "network": "testnet"
-            }
-            requests.post(refund_url, json=refund_data)
+            abort_saga(saga)
             return jsonify({'message': f'Bank API error: {str(e)}'}), 500
 
-        # Update Stellar account balance
-        stellar_account.balance -= amount
+        # Turn the reservation into a debit
+        settle_holds(saga.id)
         
-        # Record the transaction
-        new_transaction = Transaction(
-            user_id=user_id,
-            stellar_account_id=stellar_account.id,
-            bank_connection_id=bank_connection_id,
-            amount=amount,
-            transaction_type="withdrawal",
-            transaction_id=transaction_id,
-            status="completed"
-        )
-        db.session.add(new_transaction)
-        db.session.commit()
+        _record_transfer(saga, bank_connection, stellar_account, "withdrawal", amount,
+                         bank_reference, stellar_reference)
+        # Commits the balance update together with the saga completion
+        complete_saga(saga)
+        new_balance = current_balance(stellar_account.id)
+        # Drop rather than overwrite: a concurrent transfer may commit after us, and the next read refills
+        balance_cache.invalidate(balance_cache.key(user_id, stellar_address))
 
         return jsonify({
             'message': 'Funds withdrawn successfully', 
-            'new_balance': stellar_account.balance,
+            'new_balance': str(new_balance),
             'transaction_id': transaction_id
         }), 200
     except Exception as e:
         db.session.rollback()
-        return jsonify({'message': str(e)}), 500
\ No newline at end of file
+        if saga is not None:
+            abort_saga(saga)
+        return jsonify({'message': str(e)}), 500
+
+def _enqueue_transfer(job_type, data, check_balance=False):
+    try:
+        accounts, error = _load_transfer_accounts(data, check_balance=check_balance)
+        if error:
+            return error
+
+        job = enqueue_job(job_type, data, user_id=accounts[1].user_id)
+        return jsonify({'message': 'Request accepted', 'job_id': job.id, 'status': 'pending'}), 202
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'message': str(e)}), 500
+
+def deposit_funds_async(data):
+    return _enqueue_transfer('deposit', data)
+
+def withdraw_funds_async(data):
+    return _enqueue_transfer('withdraw', data, check_balance=True)
+
+def get_job_status(job_id, user_id):
+    try:
+        job = db.session.get(Job, job_id)
+        # Another user's job is reported as missing, so job ids cannot be probed
+        if not job or str(job.user_id) != str(user_id):
+            return jsonify({'message': 'Job not found'}), 404
+
+        return jsonify(job.to_dict()), 200
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+register_handler('deposit', deposit_funds)
+register_handler('withdraw', withdraw_funds)
+
+def get_balance(data):
+    try:
+        user_id = data.get('user_id')
+        stellar_address = data.get('stellar_address')
+
+        if not user_id or not stellar_address:
+            return jsonify({'message': 'All fields are required'}), 400
+
+        def load():
+            account = StellarAccount.query.filter_by(user_id=user_id, stellar_address=stellar_address).first()
+            return account.balance if account else None
+
+        balance = balance_cache.get(balance_cache.key(user_id, stellar_address), load)
+        if balance is None:
+            return jsonify({'message': 'Stellar account not found'}), 404
+
+        return jsonify({'stellar_address': stellar_address, 'balance': str(balance)}), 200
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+def get_activity_summary(data):
+    try:
+        user_id = data.get('user_id')
+
+        if not user_id:
+            return jsonify({'message': 'All fields are required'}), 400
+
+        # Precomputed aggregates, so the cost does not grow with the user's history
+        return jsonify(load_summary(user_id)), 200
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+HISTORY_EXPORT_CHUNK = 1000
+
+def _encode_cursor(transaction):
+    raw = f'{transaction.transaction_date.isoformat()}|{transaction.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor):
+    transaction_date, transaction_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(transaction_date), int(transaction_id)
+
+def _history_query(bank_connection_id, data):
+    # Newest first over the (bank_connection_id, transaction_date, id) index
+    query = BankTransaction.query.filter(BankTransaction.bank_connection_id == bank_connection_id)
+    if data.get('start_date'):
+        query = query.filter(BankTransaction.transaction_date >= datetime.fromisoformat(data['start_date']))
+    if data.get('end_date'):
+        query = query.filter(BankTransaction.transaction_date < datetime.fromisoformat(data['end_date']))
+    if data.get('transaction_type'):
+        query = query.filter(BankTransaction.transaction_type == data['transaction_type'])
+    return query.order_by(BankTransaction.transaction_date.desc(), BankTransaction.id.desc())
+
+def _history_page(query, after, limit):
+    # Keyset pagination: seek past the last row seen instead of OFFSET, so every page costs the same
+    if after:
+        query = query.filter(tuple_(BankTransaction.transaction_date, BankTransaction.id) < after)
+    return query.limit(limit).all()
+
+def _load_history_connection(data):
+    user_id = data.get('user_id')
+    bank_connection_id = data.get('bank_connection_id')
+
+    if not user_id or not bank_connection_id:
+        return None, (jsonify({'message': 'All fields are required'}), 400)
+
+    if data.get('transaction_type') and data['transaction_type'] not in ('debit', 'credit'):
+        return None, (jsonify({'message': 'Invalid transaction type'}), 400)
+
+    _, connection, _ = load_transfer_context(user_id, bank_connection_id=bank_connection_id)
+    if not connection:
+        return None, (jsonify({'message': 'Bank connection not found'}), 404)
+
+    return connection, None
+
+def get_transaction_history(data):
+    try:
+        connection, error = _load_history_connection(data)
+        if error:
+            return error
+
+        try:
+            limit = min(int(data.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+            after = _decode_cursor(data['cursor']) if data.get('cursor') else None
+        except ValueError:
+            return jsonify({'message': 'Invalid limit or cursor'}), 400
+        if limit < 1:
+            return jsonify({'message': 'Invalid limit or cursor'}), 400
+
+        # Fetch one extra row to know whether another page exists
+        with read_replica():
+            rows = _history_page(_history_query(connection.id, data), after, limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        return jsonify({
+            'transactions': [row.to_dict() for row in rows],
+            'next_cursor': _encode_cursor(rows[-1]) if has_more else None
+        }), 200
+    except ValueError as e:
+        return jsonify({'message': f'Invalid date: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+def export_transaction_history(data):
+    try:
+        connection, error = _load_history_connection(data)
+        if error:
+            return error
+
+        query = _history_query(connection.id, data)
+        with read_replica():
+            query.limit(1).all()  # Surface bad filters as a 400 before streaming starts
+    except ValueError as e:
+        return jsonify({'message': f'Invalid date: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'message': str(e)}), 500
+
+    def generate():
+        # Streams a JSON array chunk by chunk so memory stays flat for any history size
+        yield '['
+        after, first = None, True
+        while True:
+            with read_replica():
+                rows = _history_page(query, after, HISTORY_EXPORT_CHUNK)
+            for row in rows:
+                yield ('' if first else ',') + json.dumps(row.to_dict(), default=str)
+                first = False
+            if len(rows) < HISTORY_EXPORT_CHUNK:
+                break
+            after = (rows[-1].transaction_date, rows[-1].id)
+            db.session.expunge_all()
+        yield ']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json'), 200
+
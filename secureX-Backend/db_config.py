@@ -0,0 +1,101 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+# Flask-SQLAlchemy puts relative SQLite paths in the app's instance folder; resolve them the
+# same way up front so the app and the command-line tools open the same file
+INSTANCE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+
+
+def resolve_url(url):
+    prefix = 'sqlite:///'
+    if url and url.startswith(prefix):
+        path = url[len(prefix):]
+        if path and path != ':memory:' and not path.startswith(('/', 'file:')):
+            return prefix + os.path.join(INSTANCE_PATH, path)
+    return url
+
+
+DATABASE_URL = resolve_url(os.environ.get('DATABASE_URL', 'sqlite:///database.db'))
+# Optional read-only replica for queries wrapped in read_replica()
+DATABASE_REPLICA_URL = resolve_url(os.environ.get('DATABASE_REPLICA_URL'))
+
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def engine_options(url):
+    if url.startswith('sqlite'):
+        return {
+            'connect_args': {
+                'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000,
+                'check_same_thread': False
+            }
+        }
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True
+    }
+
+
+def make_engine(url=DATABASE_URL):
+    # For scripts that run outside the app
+    url = resolve_url(url)
+    return create_engine(url, **engine_options(url))
+
+
+@event.listens_for(Engine, 'connect')
+def _configure_sqlite(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers run alongside the single writer; busy_timeout queues writers instead of failing
+    cursor.execute(f'PRAGMA journal_mode={SQLITE_JOURNAL_MODE}')
+    cursor.execute(f'PRAGMA synchronous={SQLITE_SYNCHRONOUS}')
+    cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+    cursor.close()
+
+
+class RoutingSession(Session):
+    """Sends reads inside read_replica() to the replica engine when one is configured."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and _use_replica.get() and 'replica' in self._db.engines
+                and not (self.new or self.dirty or self.deleted)):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def read_replica():
+    # Only for reads that tolerate replication lag
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def configure_database(app, url=DATABASE_URL, replica_url=DATABASE_REPLICA_URL):
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+    if replica_url:
+        app.config['SQLALCHEMY_BINDS'] = {
+            'replica': dict(engine_options(replica_url), url=replica_url)
+        }
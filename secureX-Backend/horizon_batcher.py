@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as ResultTimeout
+
+from http_client import client, PartnerBusy, HORIZON_URL
+
+# Seconds to wait for more payments before submitting; 0 submits every payment on its own
+HORIZON_BATCH_WINDOW = float(os.environ.get('HORIZON_BATCH_WINDOW', '0'))
+# Stellar allows at most 100 operations per transaction
+HORIZON_BATCH_MAX_OPS = min(int(os.environ.get('HORIZON_BATCH_MAX_OPS', '100')), 100)
+HORIZON_BATCH_TIMEOUT = float(os.environ.get('HORIZON_BATCH_TIMEOUT', '30'))
+
+
+class BatchTimeout(PartnerBusy):
+    """Raised when an operation waited out the timeout still queued; it was never sent."""
+
+
+class OperationResult:
+    """Per-operation slice of a batched submission, shaped like a requests.Response."""
+
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+
+    def json(self):
+        return self._body
+
+
+class HorizonBatcher:
+    """Coalesces payments into multi-operation Horizon transactions."""
+
+    def __init__(self, url=HORIZON_URL + "/transactions", window=HORIZON_BATCH_WINDOW,
+                 max_ops=HORIZON_BATCH_MAX_OPS, timeout=HORIZON_BATCH_TIMEOUT):
+        self.url = url
+        self.window = window
+        self.max_ops = max_ops
+        self.timeout = timeout
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self.batches_submitted = 0
+        self.operations_submitted = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def submit(self, operation, reference=None):
+        if not self.enabled:
+            return client.post(self.url, json=operation)
+
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='horizon-batcher', daemon=True)
+                self._thread.start()
+            entry = (dict(operation, reference=reference), future)
+            self._pending.append(entry)
+            self._cond.notify()
+        try:
+            return future.result(self.timeout)
+        except ResultTimeout:
+            with self._cond:
+                # Still queued: withdraw it so it is definitely not sent. Once taken into a
+                # batch its outcome is unknown and the timeout propagates as is.
+                for i, item in enumerate(self._pending):
+                    if item is entry:
+                        del self._pending[i]
+                        raise BatchTimeout(f'{self.url} operation not sent within {self.timeout}s') from None
+            raise
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # Window starts at the first queued payment; a full batch goes out immediately
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.max_ops:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_ops]
+            del self._pending[:self.max_ops]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                continue  # Everything queued timed out and was withdrawn during the window
+            try:
+                self._submit_batch(batch)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _submit_batch(self, batch):
+        response = client.post(self.url, json={
+            "operations": [operation for operation, _ in batch],
+            "network": "testnet"
+        })
+        self.batches_submitted += 1
+        self.operations_submitted += len(batch)
+        body = response.json() if response.content else {}
+
+        if response.status_code == 200:
+            transaction_id = body.get('id')
+            results = body.get('operations') or []
+            for i, (_, future) in enumerate(batch):
+                result = results[i] if i < len(results) else {}
+                future.set_result(OperationResult(200, {
+                    'id': result.get('id') or transaction_id,
+                    'transaction_id': transaction_id,
+                    'hash': result.get('transaction_hash') or body.get('hash')
+                }))
+            return
+
+        # Stellar transactions are atomic: when some operations are rejected, fail those
+        # and resubmit the rest so one bad payment cannot sink the whole batch
+        codes = ((body.get('extras') or {}).get('result_codes') or {}).get('operations') or []
+        if len(codes) == len(batch) and any(code == 'op_success' for code in codes):
+            retry = []
+            for code, (operation, future) in zip(codes, batch):
+                if code == 'op_success':
+                    retry.append((operation, future))
+                else:
+                    future.set_result(OperationResult(response.status_code, {'result_code': code}))
+            with self._cond:
+                self._pending[:0] = retry
+                self._cond.notify()
+            return
+
+        for _, future in batch:
+            future.set_result(OperationResult(response.status_code, body))
+
+
+horizon_batcher = HorizonBatcher()
@@ -0,0 +1,220 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import case
+
+from models import db, StellarAccount, StreamCursor, OutboxMessage
+from http_client import client, HORIZON_URL
+from balance_cache import balance_cache
+from money import Money
+
+INGEST_STREAM_PATH = os.environ.get('INGEST_STREAM_PATH', '/payments')
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', '200'))
+INGEST_FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL', '1.0'))
+INGEST_RECONNECT_DELAY = float(os.environ.get('INGEST_RECONNECT_DELAY', '1.0'))
+
+CURSOR_NAME = 'horizon_payments'
+NATIVE_PAYMENT_TYPES = ('payment', 'path_payment_strict_receive', 'path_payment_strict_send')
+
+
+def load_cursor(name=CURSOR_NAME):
+    cursor = db.session.get(StreamCursor, name)
+    return cursor.paging_token if cursor else 'now'
+
+
+def payment_deltas(record):
+    # Native XLM movements as (address, delta in stroops) pairs
+    if record.get('type') == 'create_account':
+        amount = Money.parse(record['starting_balance']).stroops
+        return [(record['account'], amount), (record['funder'], -amount)]
+    if record.get('type') in NATIVE_PAYMENT_TYPES and record.get('asset_type') == 'native':
+        amount = Money.parse(record['amount']).stroops
+        return [(record['to'], amount), (record['from'], -amount)]
+    return []
+
+
+def own_references(records):
+    """References of the records that are payments we submitted ourselves.
+
+    Every Horizon submission carries its outbox message's idempotency key, which is
+    committed before the call is made (see saga._post), so the match does not depend
+    on when the stream delivers the payment.
+    """
+    keys = {}
+    for record in records:
+        saga_id, _, message_id = (record.get('reference') or '').rpartition('-')
+        if saga_id and message_id.isdigit():
+            keys[int(message_id)] = record['reference']
+    if not keys:
+        return set()
+    messages = db.session.query(OutboxMessage.id, OutboxMessage.saga_id).filter(OutboxMessage.id.in_(list(keys)))
+    return {keys[message_id] for message_id, saga_id in messages if keys[message_id] == f'{saga_id}-{message_id}'}
+
+
+def apply_batch(records, name=CURSOR_NAME):
+    """Apply a batch of stream records and advance the cursor in one transaction.
+
+    The cursor only moves together with the balances it covers, so a restart resumes
+    exactly after the last applied record: no gaps and no double-apply.
+    """
+    if not records:
+        return {}
+
+    # Payments we submitted ourselves were already applied by the controllers
+    own = own_references(records)
+
+    deltas = {}
+    for record in records:
+        if record.get('reference') in own or record.get('transaction_successful') is False:
+            continue
+        for address, delta in payment_deltas(record):
+            deltas[address] = deltas.get(address, 0) + delta
+
+    touched = {}
+    if deltas:
+        accounts = (db.session.query(StellarAccount.stellar_address, StellarAccount.user_id)
+                    .filter(StellarAccount.stellar_address.in_(list(deltas))).all())
+        touched = {address: user_id for address, user_id in accounts}
+        if touched:
+            # One UPDATE for the whole batch, computed in SQL so concurrent local updates are kept
+            (StellarAccount.query
+             .filter(StellarAccount.stellar_address.in_(list(touched)))
+             .update({StellarAccount.balance: StellarAccount.balance + case(
+                 {address: deltas[address] for address in touched},
+                 value=StellarAccount.stellar_address,
+                 else_=0)}, synchronize_session=False))
+
+    cursor = db.session.get(StreamCursor, name)
+    if cursor is None:
+        cursor = StreamCursor(name=name, paging_token=records[-1]['paging_token'])
+        db.session.add(cursor)
+    cursor.paging_token = records[-1]['paging_token']
+    db.session.commit()
+
+    for address, user_id in touched.items():
+        balance_cache.invalidate(balance_cache.key(user_id, address))
+    return {address: deltas[address] for address in touched}
+
+
+def iter_events(url, cursor, stop):
+    """Yield JSON records from a Horizon server-sent event stream."""
+    response = client.get(url, params={'cursor': cursor}, stream=True,
+                          headers={'Accept': 'text/event-stream'},
+                          timeout=(client.timeout[0], None))
+    try:
+        data = []
+        for line in response.iter_lines(decode_unicode=True):
+            if stop.is_set():
+                return
+            if line:
+                if line.startswith('data:'):
+                    data.append(line[5:].strip())
+                continue
+            payload, data = '\n'.join(data), []
+            # Horizon opens every stream with a bare "hello" message
+            if not payload or payload == '"hello"':
+                continue
+            record = json.loads(payload)
+            if isinstance(record, dict) and 'paging_token' in record:
+                yield record
+    finally:
+        response.close()
+
+
+class HorizonIngester:
+    """Streams Horizon payments and applies balance deltas in checkpointed batches."""
+
+    def __init__(self, app, url=HORIZON_URL + INGEST_STREAM_PATH, batch_size=INGEST_BATCH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL, name=CURSOR_NAME):
+        self.app = app
+        self.url = url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.name = name
+        self._events = queue.Queue(maxsize=batch_size * 10)
+        self._stop = threading.Event()
+        self._reset = threading.Event()
+        self._threads = []
+        self.applied = 0
+
+    def start(self):
+        for target, name in ((self._read, 'horizon-stream-reader'), (self._apply, 'horizon-stream-applier')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _read(self):
+        cursor = None
+        while not self._stop.is_set():
+            try:
+                if cursor is None:
+                    with self.app.app_context():
+                        cursor = load_cursor(self.name)
+                        db.session.remove()
+                for record in iter_events(self.url, cursor, self._stop):
+                    if self._reset.is_set() or not self._enqueue(record):
+                        break
+                    cursor = record['paging_token']
+            except Exception:
+                pass
+            if self._reset.is_set():
+                # Drop whatever is queued and re-read from the persisted checkpoint
+                self._drain()
+                cursor = None
+                self._reset.clear()
+                continue
+            # Reconnect from the last record read; anything unapplied is still queued
+            self._stop.wait(INGEST_RECONNECT_DELAY)
+
+    def _enqueue(self, record):
+        while not (self._stop.is_set() or self._reset.is_set()):
+            try:
+                self._events.put(record, timeout=self.flush_interval)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _drain(self):
+        while True:
+            try:
+                self._events.get_nowait()
+            except queue.Empty:
+                return
+
+    def _apply(self):
+        while not self._stop.is_set():
+            if self._reset.is_set():
+                self._stop.wait(0.1)
+                continue
+            try:
+                batch = [self._events.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._events.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            with self.app.app_context():
+                try:
+                    apply_batch(batch, self.name)
+                    self.applied += len(batch)
+                except Exception:
+                    db.session.rollback()
+                    # The failed batch is re-read from the persisted cursor, so nothing is lost
+                    self._reset.set()
+                finally:
+                    db.session.remove()
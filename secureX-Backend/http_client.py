@@ -0,0 +1,223 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from metrics import observe_partner_call, partner_calls_shed
+from circuit_breaker import breakers, endpoint_name, CircuitOpen
+
+# Partner base URLs, overridable so the backend can be pointed at local stubs
+BANK_API_URL = os.environ.get('BANK_API_URL', 'https://api.bankingpartner.com')
+HORIZON_URL = os.environ.get('HORIZON_URL', 'https://horizon-testnet.stellar.org')
+# Our Stellar account that pays out deposits and receives withdrawals
+DISTRIBUTION_ACCOUNT = os.environ.get('DISTRIBUTION_ACCOUNT', 'GSECUREXDISTRIBUTIONACCOUNT')
+
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', '3.05'))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', '10'))
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', '20'))
+MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', '2'))
+BACKOFF_BASE = float(os.environ.get('HTTP_BACKOFF_BASE', '0.2'))
+BACKOFF_CAP = float(os.environ.get('HTTP_BACKOFF_CAP', '2.0'))
+# Calls in flight per host; beyond this, callers wait up to HTTP_ADMISSION_WAIT and are then refused
+MAX_CONCURRENCY = int(os.environ.get('HTTP_MAX_CONCURRENCY', str(POOL_MAXSIZE)))
+ADMISSION_WAIT = float(os.environ.get('HTTP_ADMISSION_WAIT', '0.1'))
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+
+class PartnerBusy(Exception):
+    """Raised before sending when the host is at its concurrency cap; nothing reached the partner."""
+
+
+class PartnerUnavailable(PartnerBusy, CircuitOpen):
+    """Raised before sending while the endpoint's circuit breaker is open."""
+
+
+def reached_partner(error):
+    """False only when the request certainly never left this host (it failed while connecting)."""
+    if isinstance(error, PartnerBusy) or isinstance(error, requests.ConnectTimeout):
+        return False
+    if isinstance(error, requests.ConnectionError):
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return not isinstance(reason, NewConnectionError)
+    return True
+
+
+class HostMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.shed = 0
+        self.total_latency = 0.0
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'shed': self.shed,
+            'avg_latency': self.total_latency / self.requests if self.requests else 0.0
+        }
+
+
+class HostPool:
+    """Session, metrics and concurrency slots of one partner host, published together."""
+
+    def __init__(self, pool_maxsize, max_concurrency):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.metrics = HostMetrics()
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+
+
+class HttpClient:
+    """Shared outbound HTTP client with one keep-alive connection pool per host."""
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 pool_maxsize=POOL_MAXSIZE, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_cap=BACKOFF_CAP,
+                 max_concurrency=MAX_CONCURRENCY, admission_wait=ADMISSION_WAIT):
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_concurrency = max_concurrency
+        self.admission_wait = admission_wait
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        # Built completely before the single assignment that publishes it, so the unlocked read is safe
+        pool = self._hosts.get(host)
+        if pool is None:
+            with self._lock:
+                pool = self._hosts.get(host)
+                if pool is None:
+                    pool = self._hosts[host] = HostPool(self.pool_maxsize, self.max_concurrency)
+        return pool
+
+    def _backoff(self, attempt):
+        # Full jitter: sleep a random amount up to the exponential ceiling
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method, url, idempotent=None, timeout=None, **kwargs):
+        method = method.upper()
+        parts = urlsplit(url)
+        host = parts.netloc
+        pool = self._host(host)
+        session, metrics, slots = pool.session, pool.metrics, pool.slots
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = self.max_retries + 1 if idempotent else 1
+
+        breaker = breakers.get(endpoint_name(host, parts.path))
+        last_response = last_error = None
+
+        for attempt in range(attempts):
+            # Shed load instead of queueing threads behind a slow partner
+            if not slots.acquire(timeout=self.admission_wait):
+                partner_calls_shed.inc(host)
+                with self._lock:
+                    metrics.shed += 1
+                refused = PartnerBusy(f'{host} is at its concurrency limit')
+            else:
+                try:
+                    breaker.before_call()  # Fail fast while the endpoint is known to be down
+                    refused = None
+                except CircuitOpen as e:
+                    slots.release()
+                    refused = PartnerUnavailable(e.endpoint, e.retry_after)
+            if refused is not None:
+                # A refused retry reports the failure already seen instead
+                if last_response is not None:
+                    return last_response
+                if last_error is not None:
+                    raise last_error
+                raise refused
+
+            start = time.perf_counter()
+            try:
+                response = session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                elapsed = time.perf_counter() - start
+                breaker.record(False)
+                observe_partner_call(host, parts.path, type(e).__name__, elapsed)
+                with self._lock:
+                    metrics.requests += 1
+                    metrics.errors += 1
+                    metrics.total_latency += elapsed
+                if not reached_partner(e) and (last_response is not None or last_error is not None):
+                    # An earlier attempt may have arrived; report that outcome, not "never sent"
+                    if last_response is not None:
+                        return last_response
+                    raise last_error
+                if attempt + 1 >= attempts:
+                    raise
+                last_response, last_error = None, e
+            else:
+                elapsed = time.perf_counter() - start
+                breaker.record(response.status_code < 500)
+                observe_partner_call(host, parts.path, response.status_code, elapsed)
+                with self._lock:
+                    metrics.requests += 1
+                    metrics.total_latency += elapsed
+                    if response.status_code >= 500:
+                        metrics.errors += 1
+                if response.status_code not in RETRY_STATUSES or attempt + 1 >= attempts:
+                    return response
+                response.close()
+                last_response, last_error = response, None
+            finally:
+                slots.release()
+            with self._lock:
+                metrics.retries += 1
+            time.sleep(self._backoff(attempt))
+
+    def check_available(self, *urls):
+        """Raise PartnerUnavailable if any of these endpoints' breakers is open; sends nothing."""
+        for url in urls:
+            parts = urlsplit(url)
+            endpoint = endpoint_name(parts.netloc, parts.path)
+            retry_after = breakers.get(endpoint).open_for()
+            if retry_after > 0:
+                raise PartnerUnavailable(endpoint, retry_after)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def pool_stats(self):
+        stats = {}
+        with self._lock:
+            for host, pool in self._hosts.items():
+                entry = pool.metrics.to_dict()
+                adapter = pool.session.get_adapter('https://' + host)
+                connections = 0
+                for key in list(adapter.poolmanager.pools.keys()):
+                    pool = adapter.poolmanager.pools.get(key)
+                    if pool is not None:
+                        connections += pool.num_connections
+                entry['connections_opened'] = connections
+                stats[host] = entry
+        return stats
+
+    def close(self):
+        with self._lock:
+            for pool in self._hosts.values():
+                pool.session.close()
+            self._hosts.clear()
+
+
+client = HttpClient()
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import request, jsonify, make_response, Response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from models import db, IdempotencyKey
+
+IDEMPOTENCY_TTL = timedelta(seconds=int(os.environ.get('IDEMPOTENCY_TTL', str(24 * 3600))))
+# How long a duplicate waits for the first request before giving up with 409
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT', '30'))
+IDEMPOTENCY_POLL_INTERVAL = float(os.environ.get('IDEMPOTENCY_POLL_INTERVAL', '0.2'))
+# An in-progress key older than this belongs to a request that died, and can be taken over
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(seconds=int(os.environ.get('IDEMPOTENCY_LOCK_TIMEOUT', '300')))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.environ.get('IDEMPOTENCY_PURGE_INTERVAL', '300'))
+MAX_KEY_LENGTH = 255
+
+# An entry lives only while some duplicate holds its event, so abandoned keys do not pile up
+_waiters = weakref.WeakValueDictionary()
+_waiters_lock = threading.Lock()
+_next_purge = 0.0
+
+
+def fingerprint(endpoint, body):
+    canonical = json.dumps(body, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f'{endpoint}\n{canonical}'.encode()).hexdigest()
+
+
+def purge_expired_keys():
+    # One indexed range delete keeps the table at roughly one TTL's worth of keys
+    deleted = (IdempotencyKey.query
+               .filter(IdempotencyKey.expires_at < datetime.now())
+               .delete(synchronize_session=False))
+    db.session.commit()
+    return deleted
+
+
+def _purge_if_due():
+    global _next_purge
+    if time.monotonic() < _next_purge:
+        return
+    _next_purge = time.monotonic() + IDEMPOTENCY_PURGE_INTERVAL
+    purge_expired_keys()
+
+
+def _lookup(user_id, key):
+    return IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+
+
+def _claim(user_id, key, endpoint, request_fingerprint):
+    """Returns (row_id, None) when this request owns the key, else (None, existing_row)."""
+    now = datetime.now()
+    claim = {
+        'endpoint': endpoint,
+        'fingerprint': request_fingerprint,
+        'status': 'in_progress',
+        'status_code': None,
+        'response': None,
+        'locked_at': now,
+        'expires_at': now + IDEMPOTENCY_TTL
+    }
+    existing = _lookup(user_id, key)
+    if existing is None:
+        row = IdempotencyKey(user_id=user_id, key=key, **claim)
+        db.session.add(row)
+        try:
+            db.session.commit()
+            return row.id, None
+        except IntegrityError:
+            db.session.rollback()  # Another request inserted it first
+            return None, _lookup(user_id, key)
+
+    abandoned = existing.status == 'in_progress' and existing.locked_at < now - IDEMPOTENCY_LOCK_TIMEOUT
+    if existing.expires_at >= now and not abandoned:
+        return None, existing
+
+    # Expired keys and keys abandoned mid-request are reused; the update only wins once
+    taken = (IdempotencyKey.query
+             .filter(IdempotencyKey.id == existing.id,
+                     or_(IdempotencyKey.expires_at < now,
+                         and_(IdempotencyKey.status == 'in_progress',
+                              IdempotencyKey.locked_at < now - IDEMPOTENCY_LOCK_TIMEOUT)))
+             .update(claim, synchronize_session=False))
+    db.session.commit()
+    if taken:
+        return existing.id, None
+    return None, existing
+
+
+def _wait(user_id, key, deadline):
+    # Same-process duplicates are woken directly; others notice on the next poll
+    with _waiters_lock:
+        event = _waiters.get((user_id, key))
+        if event is None:
+            event = _waiters[(user_id, key)] = threading.Event()
+    event.wait(max(0.0, min(IDEMPOTENCY_POLL_INTERVAL, deadline - time.monotonic())))
+
+
+def _notify(user_id, key):
+    with _waiters_lock:
+        event = _waiters.pop((user_id, key), None)
+    if event:
+        event.set()
+
+
+def _replay(row):
+    response = Response(row.response, status=row.status_code, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _finish(row_id, response):
+    db.session.rollback()
+    query = IdempotencyKey.query.filter(IdempotencyKey.id == row_id)
+    if response is None or response.status_code in (429, 503):
+        # Raised, throttled, or refused by an open breaker: the client may retry with the same key
+        query.delete(synchronize_session=False)
+    else:
+        query.update({
+            'status': 'completed',
+            'status_code': response.status_code,
+            'response': response.get_data(as_text=True),
+            'expires_at': datetime.now() + IDEMPOTENCY_TTL
+        }, synchronize_session=False)
+    db.session.commit()
+
+
+def idempotent(endpoint):
+    """Honour an Idempotency-Key header on a money-moving route; place it below @jwt_required()."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({'message': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'}), 400
+
+            user_id = get_jwt_identity()
+            request_fingerprint = fingerprint(endpoint, request.get_json(silent=True))
+            _purge_if_due()
+
+            deadline = time.monotonic() + IDEMPOTENCY_WAIT
+            while True:
+                row_id, existing = _claim(user_id, key, endpoint, request_fingerprint)
+                if row_id is not None:
+                    break
+                if existing is None:
+                    continue  # The first request released the key between our insert and lookup
+                if existing.fingerprint != request_fingerprint:
+                    return jsonify({'message': 'Idempotency-Key was already used for a different request'}), 422
+                if existing.status == 'completed':
+                    return _replay(existing)
+                if time.monotonic() >= deadline:
+                    return jsonify({'message': 'A request with this Idempotency-Key is still in progress'}), 409
+                _wait(user_id, key, deadline)
+                db.session.rollback()  # Read the first request's outcome fresh
+
+            response = None
+            try:
+                response = make_response(view(*args, **kwargs))
+                return response
+            finally:
+                _finish(row_id, response)
+                _notify(user_id, key)
+        return wrapper
+    return decorator
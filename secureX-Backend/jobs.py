@@ -0,0 +1,152 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from models import db, Job
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '4'))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '1.0'))
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get('JOB_HEARTBEAT_INTERVAL', '10'))
+# A running job whose pool has not renewed its lease for this long is presumed dead
+JOB_LEASE_TIMEOUT = float(os.environ.get('JOB_LEASE_TIMEOUT', '60'))
+
+_handlers = {}
+_wakeup = threading.Event()
+
+
+def register_handler(job_type, handler):
+    # handler(payload) -> (response, status_code) like the controllers
+    _handlers[job_type] = handler
+
+
+def enqueue_job(job_type, payload, user_id=None):
+    job = Job(id=uuid.uuid4().hex, job_type=job_type, user_id=user_id, payload=json.dumps(payload),
+              status='pending')
+    db.session.add(job)
+    db.session.commit()
+    _wakeup.set()
+    return job
+
+
+def claim_next_job(worker_id):
+    # Compare-and-set on status so concurrent workers (or processes) never claim the same row
+    while True:
+        candidate = (db.session.query(Job.id)
+                     .filter(Job.status == 'pending')
+                     .order_by(Job.created_at, Job.id)
+                     .first())
+        if candidate is None:
+            return None
+        claimed = (Job.query
+                   .filter(Job.id == candidate.id, Job.status == 'pending')
+                   .update({Job.status: 'running', Job.attempts: Job.attempts + 1,
+                            Job.claimed_by: worker_id, Job.heartbeat_at: datetime.now()},
+                           synchronize_session=False))
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, candidate.id)
+
+
+def run_job(job):
+    handler = _handlers.get(job.job_type)
+    try:
+        if handler is None:
+            raise ValueError(f'No handler registered for job type {job.job_type}')
+        response, status_code = handler(json.loads(job.payload))
+        body = response.get_json()
+    except Exception as e:
+        db.session.rollback()
+        body, status_code = {'message': str(e)}, 500
+
+    job = db.session.get(Job, job.id)
+    job.result = json.dumps(body, default=str)
+    job.status_code = status_code
+    job.status = 'completed' if status_code < 400 else 'failed'
+    db.session.commit()
+    return job
+
+
+def renew_leases(worker_id):
+    count = (Job.query
+             .filter(Job.status == 'running', Job.claimed_by == worker_id)
+             .update({Job.heartbeat_at: datetime.now()}, synchronize_session=False))
+    db.session.commit()
+    return count
+
+
+def recover_interrupted_jobs(lease_timeout=JOB_LEASE_TIMEOUT):
+    # Jobs whose lease ran out were left by a dead process. They are not re-run: their
+    # sagas are compensated by saga.recover_sagas(), so the job is reported as failed
+    expired = datetime.now() - timedelta(seconds=lease_timeout)
+    count = (Job.query
+             .filter(Job.status == 'running', or_(Job.heartbeat_at.is_(None), Job.heartbeat_at < expired))
+             .update({Job.status: 'failed',
+                      Job.status_code: 500,
+                      Job.result: json.dumps({'message': 'Job interrupted before completion'})},
+                     synchronize_session=False))
+    db.session.commit()
+    return count
+
+
+class JobWorkerPool:
+    """Background threads that drain the jobs table."""
+
+    def __init__(self, app, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL,
+                 heartbeat_interval=JOB_HEARTBEAT_INTERVAL):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_id = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        with self.app.app_context():
+            recover_interrupted_jobs()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    job = claim_next_job(self.worker_id)
+                    if job is not None:
+                        run_job(job)
+                        continue
+                except Exception:
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            _wakeup.wait(self.poll_interval)
+            _wakeup.clear()
+
+    def _heartbeat(self):
+        # Keeps this pool's jobs leased, and fails those of pools that stopped renewing
+        while not self._stop.wait(self.heartbeat_interval):
+            with self.app.app_context():
+                try:
+                    renew_leases(self.worker_id)
+                    recover_interrupted_jobs()
+                except Exception:
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
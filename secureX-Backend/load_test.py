@@ -0,0 +1,322 @@
+import argparse
+import base64
+import itertools
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Open-loop load test of register, login, deposit and withdraw at a target request rate.
+#   python load_test.py --spawn --rps 20 --duration 30 --save-baseline
+#   python load_test.py --spawn --rps 20 --duration 30 --baseline         (exit 1 on regression, 2 if none saved)
+#   python load_test.py --url http://localhost:5000 --rps 50               (an already running backend)
+# --spawn starts the fake bank and Horizon (with --bank-latency-ms, --error-rate, ...) and a
+# backend on a scratch database, with rate limits raised so the run measures capacity.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'load_baseline.json')
+SCENARIOS = ('register', 'login', 'deposit', 'withdraw')
+EXPECTED_STATUS = {'register': 201, 'login': 200, 'deposit': 200, 'withdraw': 200}
+PASSWORD = 'load-test-password'
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def _wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'{url} exited with status {process.returncode} (port in use?)')
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not start')
+
+
+def _signal_group(process, sig):
+    try:
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+
+def spawn_stack(args, processes):
+    """Start fake partners and a backend, appending them to processes; returns the backend URL."""
+    base = args.base_port
+    faults = {'ERROR_RATE': str(args.error_rate), 'TIMEOUT_RATE': str(args.timeout_rate),
+              'TIMEOUT_S': str(args.timeout_s)}
+    services = [
+        ('test-Bank-1', base + 1, dict(faults, LATENCY_MS=str(args.bank_latency_ms))),
+        ('test-Horizon', base + 2, dict(faults, LATENCY_MS=str(args.horizon_latency_ms))),
+    ]
+    for directory, port, env in services:
+        processes.append(subprocess.Popen(
+            [sys.executable, os.path.join(ROOT, directory, 'main.py')],
+            env=dict(os.environ, PORT=str(port), **env),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True))
+        _wait_until_up(f'http://127.0.0.1:{port}/stats', processes[-1])
+
+    backend_port = base
+    high_limit = '1000000/1'
+    backend_env = dict(
+        os.environ,
+        DATABASE_URL='sqlite:///' + os.path.join(tempfile.mkdtemp(), 'load.db'),
+        BANK_API_URL=f'http://127.0.0.1:{base + 1}',
+        HORIZON_URL=f'http://127.0.0.1:{base + 2}',
+        BREAKER_STORE='memory',
+        LOGIN_RATE_LIMIT=high_limit, LOGIN_IP_RATE_LIMIT=high_limit,
+        TRANSFER_RATE_LIMIT=high_limit, TRANSFER_IP_RATE_LIMIT=high_limit)
+    processes.append(subprocess.Popen(
+        [sys.executable, '-c',
+         f'from main import app; app.run(host="127.0.0.1", port={backend_port}, threaded=True)'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=backend_env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True))
+    _wait_until_up(f'http://127.0.0.1:{backend_port}/health', processes[-1])
+    return f'http://127.0.0.1:{backend_port}'
+
+
+class VirtualUser:
+    def __init__(self, index):
+        suffix = uuid.uuid4().hex[:12]
+        self.email = f'load-{index}-{suffix}@example.com'
+        self.device = f'load-device-{suffix}'
+        self.user_id = None
+        self.token = None
+        self.stellar_address = None
+        self.bank_connection_id = None
+
+    def auth(self):
+        return {'Authorization': f'Bearer {self.token}'}
+
+
+class LoadTest:
+    def __init__(self, url, session_pool=64):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=session_pool)
+        self.session.mount('http://', adapter)
+        self.users = []
+        self._user_cycle = None
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self.samples = {name: [] for name in SCENARIOS}  # (latency seconds, status)
+
+    def _post(self, path, **kwargs):
+        return self.session.post(self.url + path, timeout=30, **kwargs)
+
+    def register(self, user):
+        return self._post('/register', json={
+            'email': user.email, 'password': PASSWORD, 'name': 'Load Test', 'phone': '0000000000',
+            'authorised_device': user.device, 'location': 'load-test'})
+
+    def login(self, user):
+        response = self._post('/login', json={
+            'email': user.email, 'password': PASSWORD, 'authorised_device': user.device,
+            'location': 'load-test'})
+        if response.status_code == 200:
+            user.token = response.json()['access_token']
+            payload = user.token.split('.')[1]
+            user.user_id = int(json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))['sub'])
+        return response
+
+    def _transfer(self, path, user, amount):
+        return self._post(path, headers=dict(user.auth(), **{'Idempotency-Key': uuid.uuid4().hex}), json={
+            'user_id': user.user_id, 'stellar_address': user.stellar_address,
+            'bank_connection_id': user.bank_connection_id, 'amount': amount})
+
+    def setup(self, users):
+        """Create the user pool used by login, deposit and withdraw; not measured."""
+        for index in range(users):
+            user = VirtualUser(index)
+            response = self.register(user)
+            if response.status_code != 201:
+                raise RuntimeError(f'register failed during setup: {response.status_code} {response.text}')
+            user.stellar_address = response.json()['stellar_address']
+            if self.login(user).status_code != 200:
+                raise RuntimeError('login failed during setup')
+            response = self._post('/bank-connections/import', headers=user.auth(),
+                                  json=[{'bank_name': 'Load Bank', 'account_number': str(10000 + index)}])
+            for line in response.text.splitlines():
+                row = json.loads(line)
+                if row.get('status') == 'connected':
+                    user.bank_connection_id = row['bank_connection_id']
+            if user.bank_connection_id is None:
+                raise RuntimeError(f'bank connection failed during setup: {response.text}')
+            # Seed a balance so withdrawals have funds to draw on
+            self._transfer('/deposit', user, '100')
+            self.users.append(user)
+        self._user_cycle = itertools.cycle(self.users)
+
+    def run_one(self, scenario):
+        with self._lock:
+            user = next(self._user_cycle)
+        if scenario == 'register':
+            new_user = VirtualUser(f'r{next(self._counter)}')
+            return self.register(new_user).status_code
+        if scenario == 'login':
+            return self.login(user).status_code
+        if scenario == 'deposit':
+            return self._transfer('/deposit', user, '1').status_code
+        return self._transfer('/withdraw', user, '1').status_code
+
+    def run(self, rps, duration, mix, workers):
+        # Open loop: requests are scheduled on a fixed clock and latency counts from the
+        # scheduled time, so a slow backend shows up as queueing instead of a lower send rate
+        schedule = list(itertools.chain.from_iterable([name] * weight for name, weight in mix.items()))
+        total = int(rps * duration)
+        start = time.perf_counter()
+
+        def task(scenario, scheduled):
+            try:
+                status = self.run_one(scenario)
+            except requests.RequestException as e:
+                status = type(e).__name__
+            latency = time.perf_counter() - scheduled
+            with self._lock:
+                self.samples[scenario].append((latency, status))
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for i in range(total):
+                scheduled = start + i / rps
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(task, schedule[i % len(schedule)], scheduled)
+        return time.perf_counter() - start
+
+    def report(self, elapsed, target_rps):
+        scenarios = {}
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            latencies = [latency for latency, _ in samples]
+            statuses = {}
+            for _, status in samples:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            errors = sum(1 for _, status in samples if status != EXPECTED_STATUS[name])
+            scenarios[name] = {
+                'requests': len(samples),
+                'error_rate': round(errors / len(samples), 4),
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+                'max_ms': round(max(latencies) * 1000, 1),
+                'statuses': statuses
+            }
+        completed = sum(result['requests'] for result in scenarios.values())
+        return {'target_rps': target_rps, 'achieved_rps': round(completed / elapsed, 2),
+                'duration_s': round(elapsed, 2), 'scenarios': scenarios}
+
+
+def compare(result, baseline, tolerance):
+    """Return the regressions of result against baseline as readable strings."""
+    regressions = []
+    if result['achieved_rps'] < baseline['achieved_rps'] * (1 - tolerance):
+        regressions.append(f'throughput {result["achieved_rps"]} rps < baseline {baseline["achieved_rps"]} rps')
+    for name, expected in baseline['scenarios'].items():
+        current = result['scenarios'].get(name)
+        if current is None:
+            regressions.append(f'{name}: no requests in this run')
+            continue
+        # A few milliseconds of slack keeps very fast endpoints from flapping
+        if current['p95_ms'] > expected['p95_ms'] * (1 + tolerance) + 5:
+            regressions.append(f'{name}: p95 {current["p95_ms"]} ms > baseline {expected["p95_ms"]} ms')
+        if current['error_rate'] > expected['error_rate'] + 0.01:
+            regressions.append(f'{name}: error rate {current["error_rate"]} > baseline {expected["error_rate"]}')
+    return regressions
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, weight = part.split('=')
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f'unknown scenario {name}')
+        mix[name] = int(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Open-loop load test of the SecureX backend')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--spawn', action='store_true', help='start fake partners and a scratch backend')
+    parser.add_argument('--base-port', type=int, default=8600)
+    parser.add_argument('--rps', type=float, default=10)
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--users', type=int, default=10, help='pre-registered users for login and transfers')
+    parser.add_argument('--workers', type=int, default=64, help='client threads')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('register=1,login=2,deposit=4,withdraw=3'))
+    parser.add_argument('--bank-latency-ms', type=float, default=20)
+    parser.add_argument('--horizon-latency-ms', type=float, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='injected partner 503 fraction')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='injected partner timeout fraction')
+    parser.add_argument('--timeout-s', type=float, default=30)
+    parser.add_argument('--output', help='write the JSON result here')
+    parser.add_argument('--save-baseline', nargs='?', const=BASELINE_PATH, help='store this run as the baseline')
+    parser.add_argument('--baseline', nargs='?', const=BASELINE_PATH, help='compare against a stored baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    args = parser.parse_args()
+    # No baseline is committed; record one on the reference machine first with --save-baseline
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error(f'baseline {args.baseline} not found; run once with --save-baseline to create it')
+
+    processes = []
+    try:
+        url = args.url
+        if args.spawn:
+            url = spawn_stack(args, processes)
+        test = LoadTest(url, session_pool=args.workers)
+        test.setup(args.users)
+        elapsed = test.run(args.rps, args.duration, args.mix, args.workers)
+        result = test.report(elapsed, args.rps)
+    finally:
+        # Signal whole process groups; the backend's password hashing pool runs in child processes
+        for process in processes:
+            _signal_group(process, signal.SIGTERM)
+        for process in processes:
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                _signal_group(process, signal.SIGKILL)
+
+    print(f'{"scenario":10} {"requests":>9} {"errors":>8} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"max ms":>9}')
+    for name, row in result['scenarios'].items():
+        print(f'{name:10} {row["requests"]:9d} {row["error_rate"]:8.2%} {row["p50_ms"]:9.1f} '
+              f'{row["p95_ms"]:9.1f} {row["p99_ms"]:9.1f} {row["max_ms"]:9.1f}')
+    print(f'target {result["target_rps"]} rps, achieved {result["achieved_rps"]} rps over {result["duration_s"]} s')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f'baseline saved to {args.save_baseline}')
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+        print('no regressions against baseline')
+
+
+if __name__ == '__main__':
+    main()
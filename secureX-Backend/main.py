@@ -1,17 +1,212 @@
-from flask import Flask
+import multiprocessing
+import os
+import threading
+from flask import Flask, request, Response, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db
+from controllers import (deposit_funds, withdraw_funds, deposit_funds_async, withdraw_funds_async, get_job_status,
+                         get_transaction_history, export_transaction_history, get_balance,
+                         login_account, biometrics_login, logout_account, revoke_device,
+                         import_bank_connections, create_account, get_activity_summary)
+from auth_tokens import init_auth, token_cache, revocation_list
+from idempotency import idempotent
+from rate_limit import (rate_limited, limiter, LOGIN_RATE_LIMIT, LOGIN_IP_RATE_LIMIT,
+                        TRANSFER_RATE_LIMIT, TRANSFER_IP_RATE_LIMIT)
+from jobs import JobWorkerPool
+from saga import OutboxDispatcher
+from horizon_ingester import HorizonIngester
+from metrics import init_metrics, registry
+from http_client import client
+from circuit_breaker import breakers
+from balance_cache import balance_cache
+from db_config import configure_database
+from migrate import upgrade
 
 app = Flask(__name__)
 CORS(app)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+configure_database(app)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'aHGJJnAU26XyIix4qY7jxRfOAdTVm0ExK0IedAbTxakfeVa'
+# When enabled, deposits and withdrawals return 202 with a job id and run on background workers
+app.config['ASYNC_TRANSFERS'] = os.environ.get('ASYNC_TRANSFERS', 'false').lower() == 'true'
 
 db.init_app(app)
+init_auth(app)
+init_metrics(app)
 
+with app.app_context():
+    upgrade(db.engine)
+
+
+def _other_user(data):
+    # Tokens only act on their own user's records
+    user_id = data.get('user_id')
+    if user_id is not None and str(user_id) != get_jwt_identity():
+        return jsonify({'message': 'Token does not belong to this user'}), 403
+    return None
+
+@app.route('/register', methods=['POST'])
+@rate_limited('register', LOGIN_RATE_LIMIT, LOGIN_IP_RATE_LIMIT)
+def register():
+    return create_account(request.get_json())
+
+@app.route('/login', methods=['POST'])
+@rate_limited('login', LOGIN_RATE_LIMIT, LOGIN_IP_RATE_LIMIT)
+def login():
+    return login_account(request.get_json())
+
+@app.route('/login/biometrics', methods=['POST'])
+@rate_limited('login', LOGIN_RATE_LIMIT, LOGIN_IP_RATE_LIMIT)
+def login_biometrics():
+    return biometrics_login(request.get_json())
+
+@app.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    return logout_account()
+
+@app.route('/devices/revoke', methods=['POST'])
+@jwt_required()
+def devices_revoke():
+    return revoke_device(request.get_json())
+
+@app.route('/bank-connections/import', methods=['POST'])
+@jwt_required()
+def bank_connections_import():
+    # Accepts text/csv with a header line, or a JSON list (or {"accounts": [...]})
+    return import_bank_connections({
+        'user_id': get_jwt_identity(),
+        'payload': request.get_data(as_text=True),
+        'content_type': request.mimetype
+    })
+
+@app.route('/deposit', methods=['POST'])
+@jwt_required()
+@idempotent('deposit')
+@rate_limited('transfer', TRANSFER_RATE_LIMIT, TRANSFER_IP_RATE_LIMIT)
+def deposit():
+    data = request.get_json()
+    if forbidden := _other_user(data):
+        return forbidden
+    if app.config['ASYNC_TRANSFERS']:
+        return deposit_funds_async(data)
+    return deposit_funds(data)
+
+@app.route('/withdraw', methods=['POST'])
+@jwt_required()
+@idempotent('withdraw')
+@rate_limited('transfer', TRANSFER_RATE_LIMIT, TRANSFER_IP_RATE_LIMIT)
+def withdraw():
+    data = request.get_json()
+    if forbidden := _other_user(data):
+        return forbidden
+    if app.config['ASYNC_TRANSFERS']:
+        return withdraw_funds_async(data)
+    return withdraw_funds(data)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def job_status(job_id):
+    return get_job_status(job_id, get_jwt_identity())
+
+@app.route('/balance', methods=['GET'])
+@jwt_required()
+def balance():
+    data = request.args.to_dict()
+    if forbidden := _other_user(data):
+        return forbidden
+    return get_balance(data)
+
+@app.route('/dashboard/summary', methods=['GET'])
+@jwt_required()
+def dashboard_summary():
+    data = request.args.to_dict()
+    data.setdefault('user_id', get_jwt_identity())
+    if forbidden := _other_user(data):
+        return forbidden
+    return get_activity_summary(data)
+
+@app.route('/transactions/history', methods=['GET'])
+@jwt_required()
+def transaction_history():
+    data = request.args.to_dict()
+    if forbidden := _other_user(data):
+        return forbidden
+    return get_transaction_history(data)
+
+@app.route('/transactions/export', methods=['GET'])
+@jwt_required()
+def transaction_export():
+    data = request.args.to_dict()
+    if forbidden := _other_user(data):
+        return forbidden
+    return export_transaction_history(data)
+
+def _runtime_metrics():
+    pools = client.pool_stats()
+    yield ('http_client_connections_opened', 'counter', 'Connections opened per partner host.',
+           [({'host': host}, stats['connections_opened']) for host, stats in pools.items()])
+    yield ('http_client_retries', 'counter', 'Retried partner calls per host.',
+           [({'host': host}, stats['retries']) for host, stats in pools.items()])
+    yield ('rate_limit_store_errors', 'counter', 'Limiter store failures that admitted the request.',
+           [({}, limiter.store_errors)])
+    yield ('balance_cache_events', 'counter', 'Balance cache hits, misses, evictions and expirations.',
+           [({'event': name}, value) for name, value in balance_cache.stats().items()])
+    yield ('auth_token_cache_events', 'counter', 'Decoded-token cache hits and misses.',
+           [({'event': 'hits'}, token_cache.hits), ({'event': 'misses'}, token_cache.misses)])
+    yield ('auth_revocation_checks', 'counter', 'Revocation filter matches confirmed against the database.',
+           [({'result': name}, value) for name, value in revocation_list.stats().items()])
+
+    states = breakers.snapshot()
+    yield ('circuit_breaker_open', 'gauge', 'Whether a partner endpoint is failing fast (1 = open or half-open).',
+           [({'endpoint': endpoint}, int(state['state'] != 'closed')) for endpoint, state in states.items()])
+
+registry.register_collector(_runtime_metrics)
+
+@app.route('/health', methods=['GET'])
+def health():
+    try:
+        db.session.execute(db.text('SELECT 1'))
+        database = 'ok'
+    except Exception as e:
+        database = str(e)
+    states = breakers.snapshot()
+    degraded = [endpoint for endpoint, state in states.items() if state['state'] != 'closed']
+    status = 'ok' if database == 'ok' and not degraded else 'degraded'
+    # Partner outages keep this 200 so the load balancer does not pull healthy instances
+    return jsonify({'status': status, 'database': database, 'breakers': states}), 200 if database == 'ok' else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def start_background_workers(app):
+    """Outbox dispatcher, job workers and, if enabled, the Horizon ingester, in this process."""
+    OutboxDispatcher(app).start()
+    JobWorkerPool(app).start()
+    if os.environ.get('HORIZON_INGEST', 'false').lower() == 'true':
+        HorizonIngester(app).start()
+
+@app.cli.command('run-workers')
+def run_workers():
+    """Run the background workers until interrupted, e.g. beside a gunicorn web tier."""
+    start_background_workers(app)
+    threading.Event().wait()
+
+# Web processes that drain the queues themselves (e.g. under gunicorn, one app per worker);
+# otherwise run `flask --app main run-workers` beside them or nothing executes async jobs
+BACKGROUND_WORKERS = os.environ.get('BACKGROUND_WORKERS', 'false').lower() == 'true'
+# Not in children of the password-hashing pool, which re-import this module
+if BACKGROUND_WORKERS and multiprocessing.parent_process() is None:
+    start_background_workers(app)
 
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    use_reloader = os.environ.get('FLASK_USE_RELOADER', 'true').lower() == 'true'
+    # With the reloader only its child serves requests, so only the child runs the workers
+    if not BACKGROUND_WORKERS and (not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        start_background_workers(app)
+    app.run(debug=True, host='0.0.0.0', port=5000, use_reloader=use_reloader)
@@ -0,0 +1,157 @@
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, values)} {total}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        # Per-bucket (non-cumulative) counts keep the hot path to one index bump
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = [(values, list(counts), total, count)
+                        for values, (counts, total, count) in sorted(self._series.items())]
+        for values, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = _labels(self.labels + ('le',), values + (bound,))
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, values)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labels, values)} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        # collector() -> iterable of (name, type, documentation, [(labels dict, value), ...])
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_labels(tuple(labels), tuple(labels.values()))} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_latency = registry.register(Histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint.', ('endpoint', 'method', 'status')))
+request_queries = registry.register(Histogram(
+    'http_request_db_queries', 'Database queries issued per request.', ('endpoint',), buckets=COUNT_BUCKETS))
+partner_latency = registry.register(Histogram(
+    'partner_call_duration_seconds', 'Latency of outbound bank and Horizon calls.', ('host', 'path', 'outcome')))
+db_latency = registry.register(Histogram(
+    'db_query_duration_seconds', 'Database statement latency by statement type.', ('statement',)))
+rate_limit_rejections = registry.register(Counter(
+    'rate_limit_rejections', 'Requests turned away by the rate limiter.', ('scope',)))
+partner_calls_shed = registry.register(Counter(
+    'partner_calls_shed', 'Outbound calls refused because the host was at its concurrency cap.', ('host',)))
+
+
+def observe_partner_call(host, path, outcome, seconds):
+    partner_latency.observe(seconds, host, path, outcome)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    db_latency.observe(elapsed, statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER')
+    if has_app_context() and 'query_count' in g:
+        g.query_count += 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute; drop its start time
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts and context.execution_context is not None:
+        starts.pop()
+
+
+def init_metrics(app):
+    @app.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+        g.query_count = 0
+
+    @app.after_request
+    def _record_request(response):
+        if 'request_start' in g:
+            endpoint = request.endpoint or 'unmatched'
+            request_latency.observe(time.perf_counter() - g.request_start,
+                                    endpoint, request.method, response.status_code)
+            request_queries.observe(g.query_count, endpoint)
+        return response
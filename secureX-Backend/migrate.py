@@ -0,0 +1,64 @@
+import importlib
+import os
+import sys
+
+from sqlalchemy import text
+
+from models import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Versioned schema migrations: migrations/NNNN_name.py modules, each with upgrade(connection).
+#   python migrate.py [database-url]    apply pending migrations
+#   python migrate.py --status [url]    list applied and pending versions
+
+
+def available_migrations():
+    names = sorted(name[:-3] for name in os.listdir(MIGRATIONS_DIR)
+                   if name[:4].isdigit() and name.endswith('.py'))
+    return [(name.split('_', 1)[0], name) for name in names]
+
+
+def _applied(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version VARCHAR(20) PRIMARY KEY, name VARCHAR(100) NOT NULL, '
+        'applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)'))
+    return {version for (version,) in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def upgrade(engine):
+    """Create missing tables, then apply every pending migration in its own transaction."""
+    db.metadata.create_all(engine)
+    applied_now = []
+    for version, name in available_migrations():
+        with engine.begin() as connection:
+            if version in _applied(connection):
+                continue
+            importlib.import_module(f'migrations.{name}').upgrade(connection)
+            connection.execute(text('INSERT INTO schema_migrations (version, name) VALUES (:version, :name)'),
+                               {'version': version, 'name': name})
+            applied_now.append(name)
+    return applied_now
+
+
+def status(engine):
+    with engine.begin() as connection:
+        applied = _applied(connection)
+    return [(name, version in applied) for version, name in available_migrations()]
+
+
+if __name__ == '__main__':
+    from db_config import DATABASE_URL, make_engine
+
+    args = sys.argv[1:]
+    show_status = '--status' in args
+    args = [arg for arg in args if arg != '--status']
+    # Relative SQLite URLs resolve to the instance folder, the file the app opens
+    engine = make_engine(args[0] if args else DATABASE_URL)
+    if show_status:
+        for name, done in status(engine):
+            print(f'{"applied" if done else "pending":8} {name}')
+    else:
+        for name in upgrade(engine):
+            print(f'applied {name}')
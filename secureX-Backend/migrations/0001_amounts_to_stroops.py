@@ -0,0 +1,42 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.types import Float, Numeric
+
+from money import STROOPS_PER_UNIT
+
+# Float money columns converted to integer stroops
+MONEY_COLUMNS = [
+    ('bank_transactions', 'amount'),
+    ('stellar_accounts', 'balance'),
+    ('stellar_accounts', 'reserved_balance'),
+    ('balance_holds', 'amount'),
+]
+
+
+def upgrade(connection):
+    """Rewrite Float money columns as BIGINT stroops, rounding each value once.
+
+    Uses add/copy/drop/rename so it works on SQLite (3.35+) as well as PostgreSQL.
+    Columns that are already integers are left alone, so it is safe to re-run.
+    """
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    converted = []
+    for table, column in MONEY_COLUMNS:
+        if table not in tables:
+            continue
+        columns = {col['name']: col for col in inspector.get_columns(table)}
+        if column not in columns:
+            # Added after the table was first created, create_all() never back-fills it
+            connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} BIGINT NOT NULL DEFAULT 0'))
+            converted.append(f'{table}.{column}')
+            continue
+        if not isinstance(columns[column]['type'], (Float, Numeric)):
+            continue
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column}_stroops BIGINT NOT NULL DEFAULT 0'))
+        connection.execute(text(
+            f'UPDATE {table} SET {column}_stroops = CAST(ROUND({column} * {STROOPS_PER_UNIT}) AS BIGINT)'))
+        connection.execute(text(f'ALTER TABLE {table} DROP COLUMN {column}'))
+        connection.execute(text(f'ALTER TABLE {table} RENAME COLUMN {column}_stroops TO {column}'))
+        converted.append(f'{table}.{column}')
+    return converted
+
@@ -0,0 +1,20 @@
+from sqlalchemy import inspect, text
+
+# Composite indexes for the lookups in controllers.py, which also cover the user_id foreign keys
+INDEXES = [
+    ('ix_users_email_authorised_device', 'users', ('email', 'authorised_device')),
+    ('ix_bank_connections_user_id_id', 'bank_connections', ('user_id', 'id')),
+    ('ix_stellar_accounts_user_id_stellar_address', 'stellar_accounts', ('user_id', 'stellar_address')),
+    ('ix_bank_transactions_connection_date_id', 'bank_transactions', ('bank_connection_id', 'transaction_date', 'id')),
+]
+
+
+def upgrade(connection):
+    tables = set(inspect(connection).get_table_names())
+    created = []
+    for name, table, columns in INDEXES:
+        if table not in tables:
+            continue
+        connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})'))
+        created.append(name)
+    return created
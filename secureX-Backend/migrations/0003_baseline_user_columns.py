@@ -0,0 +1,25 @@
+from sqlalchemy import inspect, text
+
+# Columns the models gained after the original database.db was created
+COLUMNS = [
+    ('users', 'biometrics', 'BOOLEAN DEFAULT FALSE'),
+    ('users', 'location', 'VARCHAR(100)'),
+    ('users', 'last_login', 'TIMESTAMP'),
+    ('users', 'created_at', 'TIMESTAMP'),
+    ('users', 'updated_at', 'TIMESTAMP'),
+    ('bank_connections', 'created_at', 'TIMESTAMP'),
+]
+
+
+def upgrade(connection):
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    added = []
+    for table, column, definition in COLUMNS:
+        if table not in tables:
+            continue
+        if column in {col['name'] for col in inspector.get_columns(table)}:
+            continue
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {definition}'))
+        added.append(f'{table}.{column}')
+    return added
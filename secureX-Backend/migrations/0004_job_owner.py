@@ -0,0 +1,12 @@
+from sqlalchemy import inspect, text
+
+
+def upgrade(connection):
+    # Jobs record the user who queued them, so /jobs/<job_id> only answers that user
+    inspector = inspect(connection)
+    if 'jobs' not in inspector.get_table_names():
+        return []
+    if 'user_id' in {column['name'] for column in inspector.get_columns('jobs')}:
+        return []
+    connection.execute(text('ALTER TABLE jobs ADD COLUMN user_id INTEGER REFERENCES users (id)'))
+    return ['jobs.user_id']
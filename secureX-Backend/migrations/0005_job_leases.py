@@ -0,0 +1,21 @@
+from sqlalchemy import inspect, text
+
+# Running jobs are leased to a worker pool, so recovery only fails those whose pool died
+COLUMNS = [
+    ('jobs', 'claimed_by', 'VARCHAR(32)'),
+    ('jobs', 'heartbeat_at', 'TIMESTAMP'),
+]
+
+
+def upgrade(connection):
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    added = []
+    for table, column, definition in COLUMNS:
+        if table not in tables:
+            continue
+        if column in {col['name'] for col in inspector.get_columns(table)}:
+            continue
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {definition}'))
+        added.append(f'{table}.{column}')
+    return added
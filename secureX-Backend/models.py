@@ -1,6 +1,9 @@
+import json
 from flask_sqlalchemy import SQLAlchemy
+from money import Money, MoneyType
+from db_config import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -16,6 +19,10 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
     updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
 
+    __table_args__ = (
+        db.Index('ix_users_email_authorised_device', 'email', 'authorised_device'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -40,6 +47,10 @@ class BankConnection(db.Model):
     
     user = db.relationship('User', backref=db.backref('bank_connections', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_bank_connections_user_id_id', 'user_id', 'id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -56,18 +67,23 @@ class BankTransaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     bank_connection_id = db.Column(db.Integer, db.ForeignKey('bank_connections.id'), nullable=False)
     transaction_date = db.Column(db.DateTime, nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(MoneyType, nullable=False)  # Stroops
     description = db.Column(db.String(200), nullable=False)
     transaction_type = db.Column(db.Enum('debit', 'credit'), nullable=False)  
 
     bank_connection = db.relationship('BankConnection', backref=db.backref('transactions', lazy=True))
 
+    __table_args__ = (
+        # Serves keyset pagination of a connection's history in date order
+        db.Index('ix_bank_transactions_connection_date_id', 'bank_connection_id', 'transaction_date', 'id'),
+    )
+
     def to_dict(self):
         return {
             'id': self.id,
             'bank_connection_id': self.bank_connection_id,
             'transaction_date': self.transaction_date,
-            'amount': self.amount,
+            'amount': str(self.amount),
             'description': self.description,
             'transaction_type': self.transaction_type
         }
@@ -78,16 +94,245 @@ class StellarAccount(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     stellar_address = db.Column(db.String(100), unique=True, nullable=False)
     stellar_secret = db.Column(db.String(200), nullable=False)
-    balance = db.Column(db.Float, nullable=False, default=0.0)
+    balance = db.Column(MoneyType, nullable=False, default=Money())  # Stroops
+    reserved_balance = db.Column(MoneyType, nullable=False, default=Money())  # Sum of active holds, in stroops
 
     user = db.relationship('User', backref=db.backref('stellar_accounts', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_stellar_accounts_user_id_stellar_address', 'user_id', 'stellar_address'),
+    )
+
+    @property
+    def available_balance(self):
+        return self.balance - self.reserved_balance
+
     def to_dict(self):
         return {
             'id': self.id,
             'user_id': self.user_id,
             'stellar_address': self.stellar_address,
             'stellar_secret': self.stellar_secret,
-            'balance': self.balance
+            'balance': str(self.balance),
+            'reserved_balance': str(self.reserved_balance)
+        }
+
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    id = db.Column(db.String(32), primary_key=True)
+    job_type = db.Column(db.String(20), nullable=False)  # e.g., 'deposit', 'withdraw'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)  # Only this user may read the job
+    payload = db.Column(db.Text, nullable=False)  # JSON encoded request data
+    status = db.Column(db.String(20), nullable=False, default='pending')  # 'pending', 'running', 'completed', 'failed'
+    result = db.Column(db.Text, nullable=True)  # JSON encoded response body
+    status_code = db.Column(db.Integer, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    claimed_by = db.Column(db.String(32), nullable=True)  # Worker pool running the job
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # Lease, renewed while the job runs
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.Index('ix_jobs_status_created_at', 'status', 'created_at'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'result': json.loads(self.result) if self.result else None,
+            'status_code': self.status_code,
+            'attempts': self.attempts,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
+
+class Saga(db.Model):
+    __tablename__ = 'sagas'
+    id = db.Column(db.String(32), primary_key=True)
+    saga_type = db.Column(db.String(20), nullable=False)  # e.g., 'deposit', 'withdraw'
+    payload = db.Column(db.Text, nullable=False)  # JSON encoded request data
+    status = db.Column(db.String(20), nullable=False, default='running')  # 'running', 'completed', 'compensating', 'compensated', 'failed'
+    owner = db.Column(db.String(32), nullable=True)  # Process running the saga's steps
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # Lease, renewed at every step
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.Index('ix_sagas_status', 'status'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'saga_type': self.saga_type,
+            'status': self.status,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
         }
 
+class OutboxMessage(db.Model):
+    __tablename__ = 'outbox'
+    id = db.Column(db.Integer, primary_key=True)
+    saga_id = db.Column(db.String(32), db.ForeignKey('sagas.id'), nullable=False)
+    step = db.Column(db.String(50), nullable=False)  # e.g., 'bank_withdraw', 'bank_refund'
+    kind = db.Column(db.String(20), nullable=False)  # 'action' or 'compensation'
+    compensates_id = db.Column(db.Integer, db.ForeignKey('outbox.id'), nullable=True)
+    url = db.Column(db.String(300), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON encoded request body
+    # 'held' (compensation not needed yet), 'pending', 'in_flight', 'done', 'failed', 'cancelled',
+    # or 'unknown' (an action whose outcome replays never settled)
+    status = db.Column(db.String(20), nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)
+    claimed_by = db.Column(db.String(32), nullable=True)
+    reference = db.Column(db.String(100), nullable=True)  # Partner transaction id/hash once the call succeeded
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+    saga = db.relationship('Saga', backref=db.backref('messages', lazy=True))
+
+    __table_args__ = (
+        db.Index('ix_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+        db.Index('ix_outbox_saga_id', 'saga_id'),
+        db.Index('ix_outbox_reference', 'reference'),
+    )
+
+    @property
+    def idempotency_key(self):
+        return f'{self.saga_id}-{self.id}'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'saga_id': self.saga_id,
+            'step': self.step,
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'last_error': self.last_error,
+            'created_at': self.created_at
+        }
+
+class StreamCursor(db.Model):
+    __tablename__ = 'stream_cursors'
+    name = db.Column(db.String(50), primary_key=True)  # e.g., 'horizon_payments'
+    paging_token = db.Column(db.String(50), nullable=False)
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+class BalanceHold(db.Model):
+    __tablename__ = 'balance_holds'
+    id = db.Column(db.Integer, primary_key=True)
+    stellar_account_id = db.Column(db.Integer, db.ForeignKey('stellar_accounts.id'), nullable=False)
+    saga_id = db.Column(db.String(32), db.ForeignKey('sagas.id'), nullable=False)
+    amount = db.Column(MoneyType, nullable=False)  # Stroops
+    status = db.Column(db.String(20), nullable=False, default='held')  # 'held', 'settled', 'released'
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    updated_at = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.Index('ix_balance_holds_saga_id_status', 'saga_id', 'status'),
+        db.Index('ix_balance_holds_account_status', 'stellar_account_id', 'status'),
+    )
+
+class RevokedToken(db.Model):
+    __tablename__ = 'revoked_tokens'
+    id = db.Column(db.Integer, primary_key=True)  # Monotonic, so processes can load only new revocations
+    key = db.Column(db.String(150), nullable=False)  # 'jti:<jti>' or 'device:<user_id>:<device>'
+    revoked_at = db.Column(db.Integer, nullable=False)  # Unix seconds; device revocations cover tokens issued before this
+    expires_at = db.Column(db.Integer, nullable=False)  # Unix seconds after which every covered token has expired
+
+    __table_args__ = (
+        db.Index('ix_revoked_tokens_key', 'key'),
+        db.Index('ix_revoked_tokens_expires_at', 'expires_at'),
+    )
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(50), nullable=False)  # Keys are scoped to the token's user
+    key = db.Column(db.String(255), nullable=False)  # Client-supplied Idempotency-Key header
+    endpoint = db.Column(db.String(50), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # sha256 of endpoint and request body
+    status = db.Column(db.String(20), nullable=False, default='in_progress')  # 'in_progress', 'completed'
+    status_code = db.Column(db.Integer, nullable=True)
+    response = db.Column(db.Text, nullable=True)  # JSON encoded response body
+    locked_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_id_key'),
+        db.Index('ix_idempotency_keys_expires_at', 'expires_at'),
+    )
+
+class LedgerEntry(db.Model):
+    __tablename__ = 'ledger_entries'
+    id = db.Column(db.Integer, primary_key=True)
+    saga_id = db.Column(db.String(32), db.ForeignKey('sagas.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    stellar_account_id = db.Column(db.Integer, db.ForeignKey('stellar_accounts.id'), nullable=False)
+    bank_connection_id = db.Column(db.Integer, db.ForeignKey('bank_connections.id'), nullable=False)
+    entry_type = db.Column(db.String(20), nullable=False)  # 'deposit' (bank -> Stellar) or 'withdrawal'
+    amount = db.Column(MoneyType, nullable=False)  # Stroops
+    bank_reference = db.Column(db.String(100), nullable=True)  # Bank's id for the bank leg
+    stellar_reference = db.Column(db.String(100), nullable=True)  # Horizon transaction hash for the Stellar leg
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+    __table_args__ = (
+        db.UniqueConstraint('saga_id', name='uq_ledger_entries_saga_id'),
+        # Reconciliation walks each leg in reference order
+        db.Index('ix_ledger_entries_bank_reference_id', 'bank_reference', 'id'),
+        db.Index('ix_ledger_entries_stellar_reference_id', 'stellar_reference', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'stellar_account_id': self.stellar_account_id,
+            'bank_connection_id': self.bank_connection_id,
+            'entry_type': self.entry_type,
+            'amount': str(self.amount),
+            'bank_reference': self.bank_reference,
+            'stellar_reference': self.stellar_reference,
+            'created_at': self.created_at
+        }
+
+# Dashboard aggregates over ledger_entries, kept current by activity.record_transfer in the
+# transaction that writes each entry and rebuilt with `python activity.py`. All three share
+# the same counters so the dashboard reads them with one UNION ALL.
+
+class UserActivity(db.Model):
+    __tablename__ = 'user_activity'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    deposited = db.Column(MoneyType, nullable=False, default=Money())  # Stroops moved bank -> Stellar
+    withdrawn = db.Column(MoneyType, nullable=False, default=Money())  # Stroops moved Stellar -> bank
+    deposit_count = db.Column(db.Integer, nullable=False, default=0)
+    withdrawal_count = db.Column(db.Integer, nullable=False, default=0)
+    last_activity_at = db.Column(db.DateTime, nullable=True)
+
+class ConnectionActivity(db.Model):
+    __tablename__ = 'connection_activity'
+    bank_connection_id = db.Column(db.Integer, db.ForeignKey('bank_connections.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    deposited = db.Column(MoneyType, nullable=False, default=Money())
+    withdrawn = db.Column(MoneyType, nullable=False, default=Money())
+    deposit_count = db.Column(db.Integer, nullable=False, default=0)
+    withdrawal_count = db.Column(db.Integer, nullable=False, default=0)
+    last_activity_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_connection_activity_user_id_connection', 'user_id', 'bank_connection_id'),
+    )
+
+class DailyActivity(db.Model):
+    __tablename__ = 'daily_activity'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)  # UTC, like ledger_entries.created_at
+    deposited = db.Column(MoneyType, nullable=False, default=Money())
+    withdrawn = db.Column(MoneyType, nullable=False, default=Money())
+    deposit_count = db.Column(db.Integer, nullable=False, default=0)
+    withdrawal_count = db.Column(db.Integer, nullable=False, default=0)
+    last_activity_at = db.Column(db.DateTime, nullable=True)
@@ -0,0 +1,121 @@
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import BigInteger, func
+from sqlalchemy.types import TypeDecorator
+
+# Stellar amounts have 7 decimal places; 1 stroop = 0.0000001 XLM
+STROOPS_PER_UNIT = 10_000_000
+
+
+class Money:
+    """Exact amount stored as an integer number of stroops."""
+
+    __slots__ = ('stroops',)
+
+    def __init__(self, stroops=0):
+        if not isinstance(stroops, int):
+            raise TypeError('Money is built from integer stroops, use Money.parse for decimal amounts')
+        object.__setattr__(self, 'stroops', stroops)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Money is immutable')
+
+    @classmethod
+    def parse(cls, value):
+        if isinstance(value, Money):
+            return value
+        if isinstance(value, bool) or value is None:
+            raise ValueError(f'Invalid amount: {value!r}')
+        try:
+            # str() first so floats such as 0.1 parse as written, not as their binary expansion
+            amount = Decimal(str(value).strip())
+        except InvalidOperation:
+            raise ValueError(f'Invalid amount: {value!r}')
+        if not amount.is_finite():
+            raise ValueError(f'Invalid amount: {value!r}')
+        stroops = amount * STROOPS_PER_UNIT
+        if stroops != stroops.to_integral_value():
+            raise ValueError(f'Amount has more than 7 decimal places: {value!r}')
+        return cls(int(stroops))
+
+    @classmethod
+    def from_stroops(cls, stroops):
+        return cls(int(stroops or 0))
+
+    def to_decimal(self):
+        return Decimal(self.stroops) / STROOPS_PER_UNIT
+
+    def __str__(self):
+        sign = '-' if self.stroops < 0 else ''
+        units, stroops = divmod(abs(self.stroops), STROOPS_PER_UNIT)
+        return f'{sign}{units}.{stroops:07d}'
+
+    def __repr__(self):
+        return f'Money({str(self)!r})'
+
+    def __add__(self, other):
+        return Money(self.stroops + Money.parse(other).stroops)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Money(self.stroops - Money.parse(other).stroops)
+
+    def __rsub__(self, other):
+        return Money(Money.parse(other).stroops - self.stroops)
+
+    def __neg__(self):
+        return Money(-self.stroops)
+
+    def __bool__(self):
+        return self.stroops != 0
+
+    def __eq__(self, other):
+        try:
+            return self.stroops == Money.parse(other).stroops
+        except ValueError:
+            return NotImplemented
+
+    def __lt__(self, other):
+        return self.stroops < Money.parse(other).stroops
+
+    def __le__(self, other):
+        return self.stroops <= Money.parse(other).stroops
+
+    def __gt__(self, other):
+        return self.stroops > Money.parse(other).stroops
+
+    def __ge__(self, other):
+        return self.stroops >= Money.parse(other).stroops
+
+    def __hash__(self):
+        return hash(self.stroops)
+
+
+class MoneyType(TypeDecorator):
+    """BIGINT column of stroops that reads and writes Money values."""
+
+    impl = BigInteger
+    cache_ok = True
+
+    def coerce_compared_value(self, op, value):
+        # Literals compared with or added to a money column are money too
+        return self
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, Money):
+            # A bare number is ambiguous: Money.parse reads units, the column stores stroops
+            raise TypeError(f'Money columns take Money values, got {value!r}')
+        return value.stroops
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return Money.from_stroops(value)
+
+
+def sum_money(column):
+    # Exact integer SUM in the database, returned as Money
+    return func.coalesce(func.sum(column), 0, type_=MoneyType)
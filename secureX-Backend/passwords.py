@@ -0,0 +1,118 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+
+# werkzeug method string; scrypt:N:r:p or pbkdf2:sha256:iterations. Run this module to benchmark candidates.
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 2)))
+# Concurrent verifications allowed per account before further attempts are turned away
+PASSWORD_VERIFY_PER_ACCOUNT = int(os.environ.get('PASSWORD_VERIFY_PER_ACCOUNT', '2'))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', '10'))
+
+# Parameters werkzeug fills in for a shorthand method such as 'scrypt' or 'pbkdf2:sha256'
+METHOD_DEFAULTS = {
+    'scrypt': ('scrypt', '32768', '8', '1'),
+    'pbkdf2': ('pbkdf2', 'sha256', str(DEFAULT_PBKDF2_ITERATIONS)),
+}
+
+
+class AccountBusy(Exception):
+    pass
+
+
+def normalize_method(method):
+    """The full method string werkzeug records in a hash made with this method."""
+    parts = method.split(':')
+    defaults = METHOD_DEFAULTS.get(parts[0], ())
+    return ':'.join(parts + list(defaults[len(parts):]))
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+class PasswordHasher:
+    """Runs KDF work in a bounded process pool so it never holds the GIL of a web worker."""
+
+    def __init__(self, method=PASSWORD_HASH_METHOD, workers=PASSWORD_HASH_WORKERS,
+                 per_account=PASSWORD_VERIFY_PER_ACCOUNT, timeout=PASSWORD_HASH_TIMEOUT):
+        self.method = method
+        self.workers = workers
+        self.per_account = per_account
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                # Forking a threaded server would copy locks other threads hold into the children
+                start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context(start_method))
+            executor = self._executor
+        try:
+            return executor.submit(fn, *args).result(self.timeout)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM killed); start a fresh pool for the next call
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise
+
+    def hash(self, password):
+        return self._submit(_hash, password, self.method)
+
+    def verify(self, account, password_hash, password):
+        # Credential-stuffing bursts against one account can only occupy per_account workers
+        with self._lock:
+            if self._in_flight.get(account, 0) >= self.per_account:
+                raise AccountBusy(account)
+            self._in_flight[account] = self._in_flight.get(account, 0) + 1
+        try:
+            return self._submit(_verify, password_hash, password)
+        finally:
+            with self._lock:
+                self._in_flight[account] -= 1
+                if not self._in_flight[account]:
+                    del self._in_flight[account]
+
+    def needs_rehash(self, password_hash):
+        # werkzeug hashes look like "<method>$<salt>$<hash>", with the method's parameters spelled out
+        return normalize_method(password_hash.split('$', 1)[0]) != normalize_method(self.method)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def benchmark(methods, password='correct horse battery staple', rounds=5):
+    results = {}
+    for method in methods:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            _hash(password, method)
+        results[method] = (time.perf_counter() - start) / rounds
+    return results
+
+
+password_hasher = PasswordHasher()
+
+
+if __name__ == '__main__':
+    candidates = [PASSWORD_HASH_METHOD, 'scrypt:16384:8:1', 'scrypt:32768:8:1', 'scrypt:65536:8:1',
+                  'pbkdf2:sha256:600000', 'pbkdf2:sha256:1000000']
+    for method, seconds in benchmark(dict.fromkeys(candidates)).items():
+        print(f'{method:28} {seconds * 1000:8.1f} ms/hash')
@@ -0,0 +1,81 @@
+import sys
+from datetime import date, datetime
+
+from sqlalchemy import select, tuple_
+
+from models import User, BankConnection, StellarAccount, BankTransaction, IdempotencyKey
+from activity import summary_statement
+
+# Query-plan regression check for the hot lookups in controllers.py. Exits non-zero when
+# any of them stops using an index:
+#   python query_plans.py [database-url]
+
+
+def hot_path_queries():
+    return {
+        'user_by_email_device': select(User).where(
+            User.email == 'user@example.com', User.authorised_device == 'device'),
+        'user_by_id_device': select(User).where(User.id == 1, User.authorised_device == 'device'),
+        'bank_connection_by_id_user': select(BankConnection).where(
+            BankConnection.id == 1, BankConnection.user_id == 1),
+        'bank_connections_by_user': select(BankConnection).where(BankConnection.user_id == 1),
+        'stellar_account_by_user_address': select(StellarAccount).where(
+            StellarAccount.user_id == 1, StellarAccount.stellar_address == 'G'),
+        'stellar_accounts_by_user': select(StellarAccount).where(StellarAccount.user_id == 1),
+        'history_page': select(BankTransaction).where(
+            BankTransaction.bank_connection_id == 1,
+            tuple_(BankTransaction.transaction_date, BankTransaction.id) < (datetime(2030, 1, 1), 1)
+        ).order_by(BankTransaction.transaction_date.desc(), BankTransaction.id.desc()).limit(50),
+        'idempotency_key': select(IdempotencyKey).where(IdempotencyKey.user_id == '1', IdempotencyKey.key == 'k'),
+        'idempotency_expiry': select(IdempotencyKey.id).where(IdempotencyKey.expires_at < datetime(2030, 1, 1)),
+        'activity_summary': summary_statement(1, date(2030, 1, 1)),
+    }
+
+
+def explain(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).all()
+        return [row[-1] for row in rows]
+    # Planners skip indexes on tiny tables, so ask PostgreSQL for the plan it would use at scale
+    connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    rows = connection.exec_driver_sql(f'EXPLAIN {compiled}', params).all()
+    return [row[0] for row in rows]
+
+
+def is_full_scan(plan_line):
+    line = plan_line.strip()
+    if line.startswith('SCAN') and 'USING' not in line:
+        return True  # SQLite table scan
+    return 'Seq Scan' in line  # PostgreSQL sequential scan
+
+
+def check(engine):
+    failures = {}
+    with engine.begin() as connection:
+        for name, statement in hot_path_queries().items():
+            plan = explain(connection, statement)
+            if any(is_full_scan(line) for line in plan):
+                failures[name] = plan
+    return failures
+
+
+if __name__ == '__main__':
+    from db_config import make_engine
+    from migrate import upgrade
+
+    # Defaults to a fresh in-memory schema; a database URL given here resolves like the app's
+    engine = make_engine(sys.argv[1] if len(sys.argv) > 1 else 'sqlite://')
+    upgrade(engine)
+    failures = check(engine)
+    for name, plan in failures.items():
+        print(f'FULL SCAN {name}:')
+        for line in plan:
+            print(f'    {line}')
+    if failures:
+        sys.exit(1)
+    print(f'{len(hot_path_queries())} hot-path queries use indexes')
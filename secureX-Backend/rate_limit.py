@@ -0,0 +1,156 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, jsonify
+from flask_jwt_extended import get_jwt
+
+from metrics import rate_limit_rejections
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # 'memory' or 'redis'
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+
+# "<requests>/<seconds>": bucket size and refill period. User and device share a limit;
+# IPs get their own, looser one since several users can sit behind one address.
+LOGIN_RATE_LIMIT = os.environ.get('LOGIN_RATE_LIMIT', '5/60')
+LOGIN_IP_RATE_LIMIT = os.environ.get('LOGIN_IP_RATE_LIMIT', '20/60')
+TRANSFER_RATE_LIMIT = os.environ.get('TRANSFER_RATE_LIMIT', '20/60')
+TRANSFER_IP_RATE_LIMIT = os.environ.get('TRANSFER_IP_RATE_LIMIT', '60/60')
+
+
+def parse_limit(limit):
+    requests, seconds = limit.split('/')
+    return int(requests), int(requests) / float(seconds)
+
+
+class MemoryStore:
+    """Token buckets for this process, oldest keys dropped beyond max_keys."""
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, limits):
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            wait = 0.0
+            for key, capacity, rate in limits:
+                tokens, updated = self._buckets.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - updated) * rate)
+                levels.append((key, tokens))
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / rate)
+            # Only spend tokens when every bucket admits the request
+            for key, tokens in levels:
+                self._buckets[key] = (tokens if wait else tokens - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class RedisStore:
+    """Token buckets shared by every process through Redis; one script call per request."""
+
+    SCRIPT = """
+    local now = tonumber(ARGV[1])
+    local levels = {}
+    local wait = 0
+    for i, key in ipairs(KEYS) do
+        local capacity = tonumber(ARGV[i * 2])
+        local rate = tonumber(ARGV[i * 2 + 1])
+        local state = redis.call('HMGET', key, 'tokens', 'updated')
+        local tokens = tonumber(state[1]) or capacity
+        local updated = tonumber(state[2]) or now
+        tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+        levels[i] = tokens
+        if tokens < 1 then
+            wait = math.max(wait, (1 - tokens) / rate)
+        end
+    end
+    for i, key in ipairs(KEYS) do
+        local capacity = tonumber(ARGV[i * 2])
+        local rate = tonumber(ARGV[i * 2 + 1])
+        local tokens = levels[i]
+        if wait == 0 then
+            tokens = tokens - 1
+        end
+        redis.call('HSET', key, 'tokens', tokens, 'updated', now)
+        redis.call('PEXPIRE', key, math.ceil(capacity / rate * 1000))
+    end
+    return tostring(wait)
+    """
+
+    def __init__(self, url=REDIS_URL):
+        import redis  # Only needed when RATE_LIMIT_BACKEND=redis
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(self.SCRIPT)
+
+    def take(self, limits):
+        keys = [f'ratelimit:{key}' for key, _, _ in limits]
+        args = [time.time()]
+        for _, capacity, rate in limits:
+            args.extend([capacity, rate])
+        return float(self._take(keys=keys, args=args))
+
+
+class RateLimiter:
+    def __init__(self, store=None):
+        self.store = store or (RedisStore() if RATE_LIMIT_BACKEND == 'redis' else MemoryStore())
+        self.store_errors = 0
+
+    def check(self, limits):
+        """Spend one token from every (key, capacity, rate) bucket; returns seconds to wait, 0 if admitted."""
+        if not limits:
+            return 0.0
+        try:
+            return self.store.take(limits)
+        except Exception:
+            # An unreachable limiter store must not take logins and transfers down with it
+            self.store_errors += 1
+            return 0.0
+
+
+limiter = RateLimiter()
+
+
+def _request_identities():
+    data = request.get_json(silent=True) or {}
+    try:
+        claims = get_jwt()
+    except RuntimeError:
+        claims = {}  # Login routes run before a token exists
+    user = claims.get('sub') or data.get('email') or data.get('user_id')
+    device = claims.get('device') or data.get('authorised_device') or data.get('device_id')
+    return {'user': user, 'device': device, 'ip': request.remote_addr}
+
+
+def rate_limited(scope, limit, ip_limit):
+    """Throttle a route per user, device and client IP; place it below @jwt_required()."""
+    capacity, rate = parse_limit(limit)
+    ip_capacity, ip_rate = parse_limit(ip_limit)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            identities = _request_identities()
+            limits = []
+            for dimension, value in identities.items():
+                if value:
+                    bucket = (ip_capacity, ip_rate) if dimension == 'ip' else (capacity, rate)
+                    limits.append((f'{scope}:{dimension}:{value}', *bucket))
+            wait = limiter.check(limits)
+            if wait:
+                rate_limit_rejections.inc(scope)
+                response = jsonify({'message': 'Too many requests, try again shortly'})
+                response.headers['Retry-After'] = str(math.ceil(wait))
+                return response, 429
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
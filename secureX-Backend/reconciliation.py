@@ -0,0 +1,278 @@
+import argparse
+import csv
+import heapq
+import itertools
+import json
+import os
+import sys
+import tempfile
+from collections import Counter, namedtuple
+from operator import attrgetter
+
+from sqlalchemy import select, tuple_
+
+from models import LedgerEntry, OutboxMessage, Saga
+from http_client import client, BANK_API_URL, HORIZON_URL, DISTRIBUTION_ACCOUNT
+from horizon_ingester import payment_deltas
+from money import Money
+
+# Streaming reconciliation of our ledger against partner statements. Both sides are read
+# in reference order, a chunk at a time, and diffed with a merge-join, so memory stays
+# constant however many rows there are:
+#   python reconciliation.py bank [--statement bank.csv] [--output mismatches.ndjson] [--url database-url]
+#   python reconciliation.py stellar
+
+RECONCILE_CHUNK_SIZE = int(os.environ.get('RECONCILE_CHUNK_SIZE', '5000'))
+# Lines sorted in memory at once when a source is not already in reference order; larger
+# sources are sorted in runs spilled to temporary files and merged
+RECONCILE_SORT_BUFFER = int(os.environ.get('RECONCILE_SORT_BUFFER', '200000'))
+HORIZON_PAGE_LIMIT = 200  # Horizon's maximum page size
+
+# One money movement at a partner, seen from the customer's account there
+Line = namedtuple('Line', 'reference direction stroops source')
+Mismatch = namedtuple('Mismatch', 'kind reference local partner')
+
+# Direction of each ledger leg, per entry type
+LEDGER_LEGS = {
+    'bank': (LedgerEntry.bank_reference, {'deposit': 'debit', 'withdrawal': 'credit'}),
+    'stellar': (LedgerEntry.stellar_reference, {'deposit': 'credit', 'withdrawal': 'debit'}),
+}
+# Partner and direction of each saga step (see deposit_funds and withdraw_funds)
+STEP_LEGS = {
+    'bank_withdraw': ('bank', 'debit'),
+    'bank_refund': ('bank', 'credit'),
+    'bank_deposit': ('bank', 'credit'),
+    'bank_reversal': ('bank', 'debit'),
+    'stellar_deposit': ('stellar', 'credit'),
+    'stellar_reversal': ('stellar', 'debit'),
+    'stellar_withdraw': ('stellar', 'debit'),
+    'stellar_refund': ('stellar', 'credit'),
+}
+
+
+def _code_point_order(connection, column):
+    # The merge-join compares references as Python strings; PostgreSQL must sort them the same way
+    return column.collate('C') if connection.dialect.name == 'postgresql' else column
+
+
+def _keyset(connection, statement, key_columns, chunk_size):
+    """Yield the rows of statement in key order, one chunk_size query at a time.
+
+    The key columns must come first in the select list and be unique together.
+    """
+    after = None
+    while True:
+        page = statement if after is None else statement.where(tuple_(*key_columns) > after)
+        rows = connection.execute(page.order_by(*key_columns).limit(chunk_size)).all()
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after = tuple(rows[-1][:len(key_columns)])
+
+
+def ledger_lines(connection, partner, chunk_size=RECONCILE_CHUNK_SIZE):
+    """Legs of completed transfers at the partner."""
+    column, directions = LEDGER_LEGS[partner]
+    reference = _code_point_order(connection, column)
+    statement = (select(reference, LedgerEntry.id, LedgerEntry.entry_type, LedgerEntry.amount)
+                 .where(column.isnot(None)))
+    for ref, entry_id, entry_type, amount in _keyset(connection, statement, (reference, LedgerEntry.id),
+                                                     chunk_size):
+        yield Line(ref, directions[entry_type], amount.stroops, f'ledger:{entry_id}')
+
+
+def unsettled_call_lines(connection, partner, chunk_size=RECONCILE_CHUNK_SIZE):
+    """Partner calls of sagas that never completed: the money moved, then (usually) moved back."""
+    steps = [step for step, (leg_partner, _) in STEP_LEGS.items() if leg_partner == partner]
+    reference = _code_point_order(connection, OutboxMessage.reference)
+    statement = (select(reference, OutboxMessage.id, OutboxMessage.step, OutboxMessage.payload)
+                 .join(Saga, Saga.id == OutboxMessage.saga_id)
+                 .where(OutboxMessage.status == 'done',
+                        OutboxMessage.reference.isnot(None),
+                        OutboxMessage.step.in_(steps),
+                        Saga.status != 'completed'))
+    for ref, message_id, step, payload in _keyset(connection, statement, (reference, OutboxMessage.id),
+                                                  chunk_size):
+        amount = Money.parse(json.loads(payload)['amount'])
+        yield Line(ref, STEP_LEGS[step][1], amount.stroops, f'outbox:{message_id}')
+
+
+def local_lines(connection, partner, chunk_size=RECONCILE_CHUNK_SIZE):
+    return heapq.merge(ledger_lines(connection, partner, chunk_size),
+                       unsettled_call_lines(connection, partner, chunk_size),
+                       key=attrgetter('reference'))
+
+
+def bank_statement_lines(chunk_size=RECONCILE_CHUNK_SIZE):
+    """The bank's statement, which it pages in id order."""
+    after = ''
+    while True:
+        response = client.get(BANK_API_URL + '/statements', params={'after': after, 'limit': chunk_size})
+        response.raise_for_status()
+        lines = response.json().get('lines') or []
+        for line in lines:
+            yield Line(str(line['id']), line['type'], Money.parse(line['amount']).stroops, f'bank:{line["id"]}')
+        if len(lines) < chunk_size:
+            return
+        after = lines[-1]['id']
+
+
+def horizon_payment_lines(limit=HORIZON_PAGE_LIMIT, distribution=DISTRIBUTION_ACCOUNT):
+    """Horizon's payments to or from our distribution account, in ledger order, which is not hash order."""
+    cursor = ''
+    while True:
+        response = client.get(HORIZON_URL + '/payments', params={'cursor': cursor, 'limit': limit, 'order': 'asc'})
+        response.raise_for_status()
+        records = response.json()['_embedded']['records']
+        for record in records:
+            if record.get('transaction_successful') is False:
+                continue
+            for address, delta in payment_deltas(record):
+                if address == distribution:
+                    # What the distribution account received, the customer's account paid
+                    yield Line(record['transaction_hash'], 'debit' if delta > 0 else 'credit', abs(delta),
+                               f'stellar:{record["id"]}')
+        if len(records) < limit:
+            return
+        cursor = records[-1]['paging_token']
+
+
+def statement_file_lines(path):
+    """An exported statement: CSV with reference, direction and amount columns, or NDJSON with the same keys."""
+    with open(path, newline='') as statement:
+        if path.endswith('.csv'):
+            records = csv.DictReader(statement)
+        else:
+            records = (json.loads(row) for row in statement if row.strip())
+        for number, record in enumerate(records, start=1):
+            yield Line(str(record['reference']), record['direction'], Money.parse(record['amount']).stroops,
+                       f'{os.path.basename(path)}:{number}')
+
+
+def sort_lines(lines, buffer_size=RECONCILE_SORT_BUFFER):
+    """Yield lines in reference order, holding at most buffer_size of them in memory."""
+    runs = []
+    try:
+        while True:
+            chunk = sorted(itertools.islice(lines, buffer_size))
+            if not chunk:
+                break
+            if not runs and len(chunk) < buffer_size:
+                yield from chunk  # Small enough to never touch disk
+                return
+            run = tempfile.TemporaryFile('w+')
+            run.writelines(json.dumps(line) + '\n' for line in chunk)
+            run.seek(0)
+            runs.append(run)
+            del chunk
+        yield from heapq.merge(*((Line(*json.loads(row)) for row in run) for run in runs))
+    finally:
+        for run in runs:
+            run.close()
+
+
+def _groups(lines, side):
+    # Several lines can share a reference (operations of one batched Horizon transaction)
+    previous = None
+    for reference, group in itertools.groupby(lines, key=attrgetter('reference')):
+        if previous is not None and reference <= previous:
+            raise ValueError(f'{side} lines are not in reference order ({reference!r} after {previous!r})')
+        previous = reference
+        yield reference, list(group)
+
+
+def _diff_group(reference, local, partner):
+    unmatched = list(partner)
+    leftovers = []
+    for line in local:
+        for i, other in enumerate(unmatched):
+            if (other.direction, other.stroops) == (line.direction, line.stroops):
+                del unmatched[i]
+                break
+        else:
+            leftovers.append(line)
+    for line, other in itertools.zip_longest(leftovers, unmatched):
+        if other is None:
+            yield Mismatch('missing_at_partner', reference, line, None)
+        elif line is None:
+            yield Mismatch('missing_locally', reference, None, other)
+        elif line.direction != other.direction:
+            yield Mismatch('direction_mismatch', reference, line, other)
+        else:
+            yield Mismatch('amount_mismatch', reference, line, other)
+
+
+def merge_join(local, partner):
+    """Yield a Mismatch for every line the two reference-ordered streams do not agree on."""
+    local_groups = _groups(local, 'local')
+    partner_groups = _groups(partner, 'partner')
+    left = next(local_groups, None)
+    right = next(partner_groups, None)
+    while left is not None or right is not None:
+        if right is None or (left is not None and left[0] < right[0]):
+            yield from _diff_group(left[0], left[1], [])
+            left = next(local_groups, None)
+        elif left is None or right[0] < left[0]:
+            yield from _diff_group(right[0], [], right[1])
+            right = next(partner_groups, None)
+        else:
+            yield from _diff_group(left[0], left[1], right[1])
+            left = next(local_groups, None)
+            right = next(partner_groups, None)
+
+
+def _counted(lines, counts, name):
+    for line in lines:
+        counts[name] += 1
+        yield line
+
+
+def partner_lines(partner, statement=None, chunk_size=RECONCILE_CHUNK_SIZE, sort_buffer=RECONCILE_SORT_BUFFER):
+    if statement:
+        return sort_lines(statement_file_lines(statement), sort_buffer)
+    if partner == 'bank':
+        return bank_statement_lines(chunk_size)
+    return sort_lines(horizon_payment_lines(), sort_buffer)
+
+
+def reconcile(connection, partner, statement=None, report=None,
+              chunk_size=RECONCILE_CHUNK_SIZE, sort_buffer=RECONCILE_SORT_BUFFER):
+    """Diff one partner's statement against our records; mismatches are written to report as NDJSON."""
+    counts = Counter()
+    local = _counted(local_lines(connection, partner, chunk_size), counts, 'local_lines')
+    remote = _counted(partner_lines(partner, statement, chunk_size, sort_buffer), counts, 'partner_lines')
+    mismatches = Counter()
+    for mismatch in merge_join(local, remote):
+        mismatches[mismatch.kind] += 1
+        if report is not None:
+            report.write(json.dumps({
+                'kind': mismatch.kind,
+                'reference': mismatch.reference,
+                'local': mismatch.local._asdict() if mismatch.local else None,
+                'partner': mismatch.partner._asdict() if mismatch.partner else None
+            }) + '\n')
+    return {'partner': partner, **counts, 'mismatches': dict(mismatches)}
+
+
+if __name__ == '__main__':
+    from db_config import DATABASE_URL, make_engine
+
+    parser = argparse.ArgumentParser(description='Reconcile the ledger against a partner statement.')
+    parser.add_argument('partner', choices=sorted(LEDGER_LEGS))
+    parser.add_argument('--statement', help='exported statement file (.csv or NDJSON) instead of the partner API')
+    parser.add_argument('--output', help='write mismatches here as NDJSON (default: stdout)')
+    parser.add_argument('--url', default=DATABASE_URL, help='database URL')
+    parser.add_argument('--chunk-size', type=int, default=RECONCILE_CHUNK_SIZE)
+    parser.add_argument('--sort-buffer', type=int, default=RECONCILE_SORT_BUFFER)
+    args = parser.parse_args()
+
+    engine = make_engine(args.url)
+    report = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        with engine.connect() as connection:
+            summary = reconcile(connection, args.partner, args.statement, report, args.chunk_size, args.sort_buffer)
+    finally:
+        if report is not sys.stdout:
+            report.close()
+    print(json.dumps(summary), file=sys.stderr)
+    sys.exit(1 if summary['mismatches'] else 0)
@@ -0,0 +1,74 @@
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+from flask import g, has_app_context
+from sqlalchemy import and_, event
+from sqlalchemy.engine import Engine
+
+from models import db, User, BankConnection, StellarAccount
+
+TransferContext = namedtuple('TransferContext', ['user', 'bank_connection', 'stellar_account'])
+
+
+def load_transfer_context(user_id, bank_connection_id=None, stellar_address=None):
+    """Load a user with the requested bank connection and Stellar account in one query.
+
+    The result is memoized on flask.g, so repeat lookups in the same request are free.
+    Missing rows come back as None.
+    """
+    key = (str(user_id), str(bank_connection_id), stellar_address)
+    memo = g.setdefault('transfer_contexts', {}) if has_app_context() else {}
+    if key in memo:
+        return memo[key]
+
+    query = db.session.query(User)
+    entities = [User]
+    if bank_connection_id is not None:
+        query = query.outerjoin(BankConnection, and_(BankConnection.user_id == User.id,
+                                                     BankConnection.id == bank_connection_id))
+        entities.append(BankConnection)
+    if stellar_address is not None:
+        query = query.outerjoin(StellarAccount, and_(StellarAccount.user_id == User.id,
+                                                     StellarAccount.stellar_address == stellar_address))
+        entities.append(StellarAccount)
+    row = query.with_entities(*entities).filter(User.id == user_id).first()
+
+    if row is None:
+        context = TransferContext(None, None, None)
+    else:
+        found = dict(zip(entities, row))
+        context = TransferContext(found[User], found.get(BankConnection), found.get(StellarAccount))
+    memo[key] = context
+    return context
+
+
+_counters = threading.local()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_counters, 'active', ()):
+        counter.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """Collect the SQL statements executed on this thread inside the block."""
+    statements = []
+    active = getattr(_counters, 'active', None)
+    if active is None:
+        active = _counters.active = []
+    active.append(statements)
+    try:
+        yield statements
+    finally:
+        active.remove(statements)
+
+
+@contextmanager
+def assert_max_queries(limit):
+    with count_queries() as statements:
+        yield statements
+    if len(statements) > limit:
+        raise AssertionError(f'Expected at most {limit} queries, got {len(statements)}:\n' + '\n'.join(statements))
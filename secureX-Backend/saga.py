@@ -0,0 +1,291 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+
+from models import db, Saga, OutboxMessage
+from http_client import client, PartnerBusy, PartnerUnavailable, reached_partner
+from horizon_batcher import horizon_batcher
+from balances import release_holds
+
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '50'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '10'))
+OUTBOX_RETRY_DELAY = float(os.environ.get('OUTBOX_RETRY_DELAY', '5'))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', '2'))
+# A running saga (or claimed outbox message) not renewed for this long belongs to a dead
+# process; it must outlast the slowest partner call, client timeouts and retries included
+SAGA_LEASE_TIMEOUT = float(os.environ.get('SAGA_LEASE_TIMEOUT', '120'))
+
+PROCESS_ID = uuid.uuid4().hex
+_wakeup = threading.Event()
+
+
+def start_saga(saga_type, payload):
+    saga = Saga(id=uuid.uuid4().hex, saga_type=saga_type, payload=json.dumps(payload), status='running',
+                owner=PROCESS_ID, heartbeat_at=datetime.now())
+    db.session.add(saga)
+    db.session.commit()
+    return saga
+
+
+def _post(message):
+    payload = json.loads(message.payload)
+    if message.url == horizon_batcher.url:
+        # Horizon records the key on the payment, so the ingester can tell our own payments apart
+        if horizon_batcher.enabled:
+            return horizon_batcher.submit(payload, reference=message.idempotency_key)
+        payload['reference'] = message.idempotency_key
+    # The idempotency key lets partners (and our retries) collapse duplicate deliveries
+    return client.post(message.url, json=payload, idempotent=True,
+                       headers={'Idempotency-Key': message.idempotency_key})
+
+
+def _response_reference(response):
+    # Horizon returns the transaction hash; reconciliation matches it against the statement
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    if not isinstance(body, dict):
+        return None
+    reference = body.get('hash') or body.get('transaction_id') or body.get('id')
+    return str(reference) if reference else None
+
+
+def run_step(saga, step, url, payload, compensation=None):
+    """Record a forward step (and its held compensation) before calling the partner.
+
+    compensation is an optional (step, url, payload) tuple. A step whose outcome is unknown
+    (read timeout, 5xx, crash around the send) is left 'in_flight'; aborting the saga has the
+    outbox replay it with the same idempotency key until the partner's answer settles it.
+    """
+    action = OutboxMessage(saga_id=saga.id, step=step, kind='action', url=url,
+                           payload=json.dumps(payload), status='in_flight', attempts=1)
+    db.session.add(action)
+    db.session.flush()
+    if compensation:
+        comp_step, comp_url, comp_payload = compensation
+        db.session.add(OutboxMessage(saga_id=saga.id, step=comp_step, kind='compensation',
+                                     compensates_id=action.id, url=comp_url,
+                                     payload=json.dumps(comp_payload), status='held'))
+    saga.heartbeat_at = datetime.now()
+    db.session.commit()
+
+    try:
+        response = _post(action)
+    except Exception as e:
+        action.last_error = str(e)
+        if not reached_partner(e):
+            # Refused or failed to connect: nothing was sent, so there is nothing to compensate
+            action.status = 'failed'
+        db.session.commit()
+        raise
+    if response.status_code == 200:
+        action.status = 'done'
+        action.reference = _response_reference(response)
+    else:
+        action.last_error = f'HTTP {response.status_code}'
+        if response.status_code < 500:
+            action.status = 'failed'
+    db.session.commit()
+    return response
+
+
+def complete_saga(saga):
+    # Called with the caller's balance update still pending in the session so both commit together
+    saga.status = 'completed'
+    (OutboxMessage.query
+     .filter(OutboxMessage.saga_id == saga.id, OutboxMessage.status == 'held')
+     .update({OutboxMessage.status: 'cancelled'}, synchronize_session=False))
+    db.session.commit()
+
+
+def _action_ids(saga_id, status):
+    return [message_id for (message_id,) in
+            db.session.query(OutboxMessage.id)
+            .filter(OutboxMessage.saga_id == saga_id,
+                    OutboxMessage.kind == 'action',
+                    OutboxMessage.status == status)]
+
+
+def _release_compensations(action_ids, status):
+    # 'pending' arms the held compensations of these actions, 'cancelled' drops them
+    if not action_ids:
+        return 0
+    changes = {OutboxMessage.status: status}
+    if status == 'pending':
+        changes[OutboxMessage.next_attempt_at] = datetime.now()
+    return (OutboxMessage.query
+            .filter(OutboxMessage.status == 'held', OutboxMessage.compensates_id.in_(action_ids))
+            .update(changes, synchronize_session=False))
+
+
+def abort_saga(saga):
+    db.session.rollback()
+    saga = db.session.get(Saga, saga.id)
+    # Only steps the partner confirmed are compensated
+    armed = _release_compensations(_action_ids(saga.id, 'done'), 'pending')
+    _release_compensations(_action_ids(saga.id, 'failed'), 'cancelled')
+    # Steps with an unknown outcome are replayed under their idempotency key; the dispatcher
+    # arms or cancels their compensation once the partner answers
+    settling = (OutboxMessage.query
+                .filter(OutboxMessage.saga_id == saga.id,
+                        OutboxMessage.kind == 'action',
+                        OutboxMessage.status == 'in_flight')
+                .update({OutboxMessage.status: 'pending', OutboxMessage.claimed_by: None,
+                         OutboxMessage.next_attempt_at: datetime.now()},
+                        synchronize_session=False))
+    release_holds(saga.id)
+    saga.status = 'compensating' if armed or settling else 'compensated'
+    db.session.commit()
+    if armed or settling:
+        _wakeup.set()
+    return saga
+
+
+def recover_sagas(lease_timeout=SAGA_LEASE_TIMEOUT):
+    # Both lookups hit the status indexes, so the periodic scan stays cheap. Only expired
+    # leases are taken over: other live processes keep their sagas and claimed messages
+    expired = datetime.now() - timedelta(seconds=lease_timeout)
+    # Messages a dead dispatcher had claimed go back in the queue; replays are idempotent
+    (OutboxMessage.query
+     .filter(OutboxMessage.claimed_by.isnot(None), OutboxMessage.status == 'in_flight',
+             OutboxMessage.next_attempt_at < expired)
+     .update({OutboxMessage.status: 'pending', OutboxMessage.claimed_by: None},
+             synchronize_session=False))
+    db.session.commit()
+
+    interrupted = [saga_id for (saga_id,) in
+                   db.session.query(Saga.id)
+                   .filter(Saga.status == 'running', or_(Saga.heartbeat_at.is_(None), Saga.heartbeat_at < expired))
+                   .all()]
+    for saga_id in interrupted:
+        abort_saga(db.session.get(Saga, saga_id))
+    return len(interrupted)
+
+
+def _finish_saga_if_compensated(saga_id):
+    remaining = (OutboxMessage.query
+                 .filter(OutboxMessage.saga_id == saga_id,
+                         OutboxMessage.status.in_(['pending', 'in_flight']))
+                 .count())
+    if remaining == 0:
+        # A compensation that gave up, or a step never settled, needs an operator
+        failed = (OutboxMessage.query
+                  .filter(OutboxMessage.saga_id == saga_id,
+                          or_(and_(OutboxMessage.kind == 'compensation', OutboxMessage.status == 'failed'),
+                              and_(OutboxMessage.kind == 'action', OutboxMessage.status == 'unknown')))
+                  .count())
+        db.session.get(Saga, saga_id).status = 'failed' if failed else 'compensated'
+
+
+def dispatch_batch(batch_size=OUTBOX_BATCH_SIZE):
+    token = uuid.uuid4().hex
+    now = datetime.now()
+    due = [message_id for (message_id,) in
+           db.session.query(OutboxMessage.id)
+           .filter(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now)
+           .order_by(OutboxMessage.next_attempt_at)
+           .limit(batch_size)]
+    if not due:
+        return 0
+    (OutboxMessage.query
+     .filter(OutboxMessage.id.in_(due), OutboxMessage.status == 'pending')
+     .update({OutboxMessage.status: 'in_flight', OutboxMessage.claimed_by: token,
+              OutboxMessage.next_attempt_at: now},
+             synchronize_session=False))
+    db.session.commit()
+
+    messages = OutboxMessage.query.filter_by(claimed_by=token, status='in_flight').all()
+    for message in messages:
+        # While claimed, next_attempt_at is the claim's heartbeat; renew what is left of the batch
+        (OutboxMessage.query
+         .filter(OutboxMessage.claimed_by == token, OutboxMessage.status == 'in_flight')
+         .update({OutboxMessage.next_attempt_at: datetime.now()}, synchronize_session=False))
+        db.session.commit()
+        message.attempts += 1
+        deferred_until = None
+        try:
+            response = _post(message)
+            if response.status_code == 200:
+                message.status = 'done'
+                message.reference = _response_reference(response)
+            else:
+                message.last_error = f'HTTP {response.status_code}'
+                if message.kind == 'action' and response.status_code < 500:
+                    message.status = 'failed'  # The partner refused the replay, so it never applied
+        except PartnerBusy as e:
+            # Never sent, so the attempt does not count towards OUTBOX_MAX_ATTEMPTS
+            message.attempts -= 1
+            message.last_error = str(e)
+            if isinstance(e, PartnerUnavailable):
+                # Park refunds for a sick partner until its breaker lets a probe through
+                deferred_until = datetime.now() + timedelta(seconds=e.retry_after)
+        except Exception as e:
+            message.last_error = str(e)
+
+        if message.status not in ('done', 'failed'):
+            if message.attempts >= OUTBOX_MAX_ATTEMPTS:
+                # An action that never settled may or may not have moved money
+                message.status = 'unknown' if message.kind == 'action' else 'failed'
+            else:
+                message.status = 'pending'
+                message.next_attempt_at = deferred_until or datetime.now() + timedelta(
+                    seconds=OUTBOX_RETRY_DELAY * (2 ** (message.attempts - 1)))
+        message.claimed_by = None
+        if message.kind == 'action' and message.status in ('done', 'failed'):
+            if _release_compensations([message.id], 'pending' if message.status == 'done' else 'cancelled'):
+                _wakeup.set()
+        db.session.flush()
+        if message.status in ('done', 'failed', 'unknown'):
+            _finish_saga_if_compensated(message.saga_id)
+        db.session.commit()
+    return len(messages)
+
+
+class OutboxDispatcher:
+    """Background thread that delivers pending outbox messages in batches."""
+
+    def __init__(self, app, poll_interval=OUTBOX_POLL_INTERVAL, batch_size=OUTBOX_BATCH_SIZE,
+                 lease_timeout=SAGA_LEASE_TIMEOUT):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.lease_timeout = lease_timeout
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        with self.app.app_context():
+            recover_sagas(self.lease_timeout)
+        self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        _wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        # Leases of other processes can expire at any time, not only before we started
+        next_recovery = time.monotonic() + self.lease_timeout / 2
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    if time.monotonic() >= next_recovery:
+                        next_recovery = time.monotonic() + self.lease_timeout / 2
+                        recover_sagas(self.lease_timeout)
+                    if dispatch_batch(self.batch_size):
+                        continue
+                except Exception:
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            _wakeup.wait(self.poll_interval)
+            _wakeup.clear()
@@ -0,0 +1,57 @@
+import importlib.util
+import os
+import tempfile
+import threading
+import uuid
+
+import pytest
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _serve_fake(name, directory):
+    # The fake partners are plain Flask apps; serve them in-process on a free port
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, directory, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    server = make_server('127.0.0.1', 0, module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name=name, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def pytest_configure(config):
+    # Partner URLs and the database are read at import time, so set them before any test imports the app
+    os.environ['BANK_API_URL'] = _serve_fake('fake_bank', 'test-Bank-1')
+    os.environ['HORIZON_URL'] = _serve_fake('fake_horizon', 'test-Horizon')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'test.db')
+    os.environ['BREAKER_STORE'] = 'memory'
+    # Query-count tests refresh the revocation list themselves, so no request pays for it
+    os.environ['REVOCATION_REFRESH_INTERVAL'] = '3600'
+
+
+@pytest.fixture(scope='session')
+def app():
+    from main import app
+    return app
+
+
+@pytest.fixture
+def account(app):
+    """A fresh user with one bank connection and a Stellar account holding 100."""
+    from models import db, User, BankConnection, StellarAccount
+    from money import Money
+
+    with app.app_context():
+        user = User(email=f'{uuid.uuid4().hex}@example.com', password='x', name='Test', phone='0',
+                    authorised_device='device')
+        db.session.add(user)
+        db.session.flush()
+        connection = BankConnection(user_id=user.id, bank_name='Test Bank 1', account_number=uuid.uuid4().hex[:12],
+                                    connection_status='connected', routing_number='110000001')
+        stellar_account = StellarAccount(user_id=user.id, stellar_address='G' + uuid.uuid4().hex.upper(),
+                                         stellar_secret='S', balance=Money.parse('100'))
+        db.session.add_all([connection, stellar_account])
+        db.session.commit()
+        return {'user_id': user.id, 'bank_connection_id': connection.id,
+                'stellar_address': stellar_account.stellar_address, 'stellar_account_id': stellar_account.id}
@@ -0,0 +1,49 @@
+from models import db, User
+from auth_tokens import issue_access_token, token_cache, revocation_list
+
+
+def _tokens(app, account, count):
+    with app.app_context():
+        user = db.session.get(User, account['user_id'])
+        tokens = [issue_access_token(user) for _ in range(count)]
+        revocation_list.refresh()
+    return tokens
+
+
+def _balance(client, account, token):
+    return client.get('/balance', headers={'Authorization': f'Bearer {token}'}, query_string={
+        'user_id': account['user_id'], 'stellar_address': account['stellar_address']})
+
+
+def _cache(client, account, token):
+    # The second request is answered from the token cache, without decoding again
+    assert _balance(client, account, token).status_code == 200
+    hits = token_cache.hits
+    assert _balance(client, account, token).status_code == 200
+    assert token_cache.hits == hits + 1
+
+
+def test_logout_revokes_a_cached_token(app, account):
+    client = app.test_client()
+    token, other = _tokens(app, account, 2)
+    _cache(client, account, token)
+
+    assert client.post('/logout', headers={'Authorization': f'Bearer {token}'}).status_code == 200
+
+    assert _balance(client, account, token).status_code == 401
+    # Only the logged-out token: another session of the same user keeps working
+    assert _balance(client, account, other).status_code == 200
+
+
+def test_device_revoke_covers_every_cached_token_of_the_device(app, account):
+    client = app.test_client()
+    tokens = _tokens(app, account, 2)
+    for token in tokens:
+        _cache(client, account, token)
+
+    response = client.post('/devices/revoke', json={'device_id': 'device'},
+                           headers={'Authorization': f'Bearer {tokens[0]}'})
+    assert response.status_code == 200
+
+    for token in tokens:
+        assert _balance(client, account, token).status_code == 401
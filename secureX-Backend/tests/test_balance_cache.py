@@ -0,0 +1,27 @@
+from balance_cache import BalanceCache, MemoryBackend
+from money import Money
+
+
+def test_invalidated_keys_stay_within_the_lru_bound():
+    backend = MemoryBackend(max_entries=10)
+    cache = BalanceCache(backend)
+    for user_id in range(1000):
+        key = cache.key(user_id, 'GADDRESS')
+        cache.get(key, lambda: Money.parse('1'))
+        cache.invalidate(key)
+    assert len(backend._entries) == 10
+    assert backend.evictions == 990
+
+
+def test_write_during_a_fill_is_not_overwritten():
+    cache = BalanceCache(MemoryBackend(max_entries=10))
+    key = cache.key(1, 'GADDRESS')
+
+    def stale_read():
+        # A transfer commits and invalidates while this read is still loading
+        cache.invalidate(key)
+        return Money.parse('100')
+
+    assert cache.get(key, stale_read) == Money.parse('100')
+    assert cache.get(key, lambda: Money.parse('101')) == Money.parse('101')
+    assert cache.get(key, lambda: Money.parse('999')) == Money.parse('101')
@@ -0,0 +1,34 @@
+import json
+import uuid
+
+from models import db, User, BankConnection
+from auth_tokens import issue_access_token, revocation_list
+
+
+def test_bad_rows_are_reported_and_the_rest_imported(app, account):
+    with app.app_context():
+        token = issue_access_token(db.session.get(User, account['user_id']))
+        revocation_list.refresh()
+    good, other = uuid.uuid4().hex[:12], uuid.uuid4().hex[:12]
+    rows = [
+        {'bank_name': 'Test Bank 1', 'account_number': good},
+        {'bank_name': '', 'account_number': uuid.uuid4().hex[:12]},
+        {'bank_name': 'Test Bank 1', 'account_number': '1' * 21},
+        {'bank_name': 'Test Bank 1', 'account_number': good},
+        {'bank_name': 'Test Bank 1', 'account_number': other},
+    ]
+
+    response = app.test_client().post('/bank-connections/import', json=rows,
+                                      headers={'Authorization': f'Bearer {token}'})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    # Every row is answered, then the stream ends with its summary
+    assert lines[-1] == {'summary': {'connected': 2, 'invalid': 2, 'duplicate': 1, 'total': 5}}
+    statuses = {line['row']: line['status'] for line in lines[:-1]}
+    assert statuses == {1: 'connected', 2: 'invalid', 3: 'invalid', 4: 'duplicate', 5: 'connected'}
+    with app.app_context():
+        imported = {connection.account_number for connection in
+                    BankConnection.query.filter_by(user_id=account['user_id'])}
+    assert {good, other} <= imported
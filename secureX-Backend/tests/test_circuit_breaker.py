@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpen, SqliteStore
+
+
+@pytest.fixture
+def pair(tmp_path):
+    # Two workers of one host: each has its own breaker and connection, sharing the file
+    path = str(tmp_path / 'breakers.db')
+    return [CircuitBreaker('bank/withdraw', SqliteStore(path), min_calls=4, open_seconds=0.2,
+                           probe_timeout=5, sync_interval=0) for _ in range(2)]
+
+
+def _trip(breaker):
+    for _ in range(breaker.min_calls):
+        breaker.before_call()
+        breaker.record(False)
+
+
+def test_breaker_opens_probes_once_and_closes_across_processes(pair):
+    first, second = pair
+    _trip(first)
+    assert first.snapshot()['state'] == 'open'
+    # The other worker sees the open breaker without having failed a call itself
+    with pytest.raises(CircuitOpen) as excinfo:
+        second.before_call()
+    assert 0 < excinfo.value.retry_after <= 0.2
+
+    time.sleep(0.25)
+    first.before_call()  # This worker's call is the single half-open probe
+    assert first.snapshot()['state'] == 'half_open'
+    with pytest.raises(CircuitOpen):
+        second.before_call()
+
+    first.record(True)
+    second.before_call()
+    assert second.snapshot()['state'] == 'closed'
+
+
+def test_failed_probe_reopens_the_breaker(pair):
+    first, second = pair
+    _trip(first)
+    time.sleep(0.25)
+
+    second.before_call()
+    second.record(False)
+
+    for breaker in pair:
+        with pytest.raises(CircuitOpen):
+            breaker.before_call()
+    assert first.snapshot()['state'] == 'open'
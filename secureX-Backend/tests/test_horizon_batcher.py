@@ -0,0 +1,66 @@
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from horizon_batcher import HorizonBatcher, BatchTimeout
+from http_client import client
+
+
+def _batcher(window=0.5, **kwargs):
+    return HorizonBatcher(url=os.environ['HORIZON_URL'] + '/transactions', window=window, **kwargs)
+
+
+def _payment(amount='1'):
+    return {'stellar_address': 'G' + uuid.uuid4().hex.upper(), 'amount': amount, 'user_id': 1}
+
+
+def _submit_all(batcher, operations):
+    with ThreadPoolExecutor(max_workers=len(operations)) as executor:
+        futures = [executor.submit(batcher.submit, operation, uuid.uuid4().hex) for operation in operations]
+        return [future.result() for future in futures]
+
+
+def _transactions_posted():
+    return client.get(os.environ['HORIZON_URL'] + '/stats').json()['transactions']
+
+
+def test_concurrent_payments_share_one_transaction(app):
+    batcher = _batcher()
+    before = _transactions_posted()
+
+    results = _submit_all(batcher, [_payment() for _ in range(5)])
+
+    assert [result.status_code for result in results] == [200] * 5
+    assert len({result.json()['transaction_id'] for result in results}) == 1
+    assert batcher.batches_submitted == 1
+    assert batcher.operations_submitted == 5
+    assert _transactions_posted() - before == 1
+
+
+def test_rejected_operation_fails_alone_and_the_rest_are_resubmitted(app):
+    batcher = _batcher()
+    operations = [_payment(), _payment(), _payment('-1'), _payment()]
+
+    results = _submit_all(batcher, operations)
+
+    assert results[2].status_code == 400
+    assert results[2].json() == {'result_code': 'op_malformed'}
+    accepted = [results[i] for i in (0, 1, 3)]
+    assert [result.status_code for result in accepted] == [200] * 3
+    assert len({result.json()['transaction_id'] for result in accepted}) == 1
+    # The atomic batch failed once, then the three valid payments went out together
+    assert batcher.batches_submitted == 2
+
+
+def test_operation_still_queued_at_timeout_is_withdrawn(app):
+    batcher = _batcher(timeout=0.1)
+
+    with pytest.raises(BatchTimeout):
+        batcher.submit(_payment(), uuid.uuid4().hex)
+
+    time.sleep(0.6)  # Past the window: the batch it would have joined has been taken
+    assert batcher.batches_submitted == 0
+    assert batcher._pending == []
@@ -0,0 +1,88 @@
+import threading
+import time
+
+from models import db, OutboxMessage, StellarAccount, StreamCursor
+from controllers import deposit_funds
+from horizon_ingester import HorizonIngester, apply_batch, iter_events
+from http_client import client, HORIZON_URL
+from money import Money
+from saga import start_saga
+
+
+def _payment(paging_token, address, amount, reference=None):
+    return {'paging_token': paging_token, 'type': 'payment', 'asset_type': 'native', 'to': address,
+            'from': 'GEXTERNAL', 'amount': amount, 'transaction_hash': 'h' + paging_token, 'reference': reference}
+
+
+def test_own_payments_are_skipped_by_reference(app, account):
+    with app.app_context():
+        saga = start_saga('deposit', {})
+        message = OutboxMessage(saga_id=saga.id, step='stellar_deposit', kind='action', url='/transactions',
+                                payload='{}', status='in_flight')
+        db.session.add(message)
+        db.session.commit()
+
+        # The step has no partner reference yet, as when the stream beats the submit call's response
+        address = account['stellar_address']
+        apply_batch([_payment('1', address, '5', reference=message.idempotency_key),
+                     _payment('2', address, '2', reference=f'{saga.id}-{message.id + 1000}'),
+                     _payment('3', address, '1')], name=f'test-{saga.id}')
+
+        balance = db.session.get(StellarAccount, account['stellar_account_id']).balance
+        assert balance == Money.parse('103')
+
+
+def _latest_paging_token():
+    records = client.get(HORIZON_URL + '/payments', params={'order': 'desc', 'limit': 1}).json()['_embedded']['records']
+    return records[0]['paging_token'] if records else '0'
+
+
+def test_iter_events_streams_new_payments_from_now():
+    stop = threading.Event()
+    received = []
+
+    def read():
+        for record in iter_events(HORIZON_URL + '/payments', 'now', stop):
+            received.append(record)
+            stop.set()
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    # Keep paying until the stream, connected at some point, sees one
+    deadline = time.monotonic() + 10
+    while not received and time.monotonic() < deadline:
+        client.post(HORIZON_URL + '/transactions', json={'from': 'GPAYER', 'to': 'GPAYEE', 'amount': '1'})
+        time.sleep(0.2)
+    stop.set()
+    reader.join(5)
+
+    assert received and received[0]['type'] == 'payment'
+    assert (received[0]['from'], received[0]['to'], received[0]['asset_type']) == ('GPAYER', 'GPAYEE', 'native')
+
+
+def test_ingester_applies_streamed_payments_except_our_own(app, account):
+    name = f'test-stream-{account["stellar_account_id"]}'
+    with app.app_context():
+        db.session.add(StreamCursor(name=name, paging_token=_latest_paging_token()))
+        db.session.commit()
+
+    ingester = HorizonIngester(app, flush_interval=0.1, name=name).start()
+    try:
+        # Someone else pays the account, then we deposit into it through the saga
+        response = client.post(HORIZON_URL + '/transactions', json={
+            'from': 'GEXTERNAL', 'to': account['stellar_address'], 'amount': '7'})
+        assert response.status_code == 200
+        with app.app_context():
+            _, status = deposit_funds(dict(account, amount='2'))
+            assert status == 200
+
+        deadline = time.monotonic() + 10
+        while ingester.applied < 2 and time.monotonic() < deadline:
+            time.sleep(0.1)
+    finally:
+        ingester.stop(5)
+
+    assert ingester.applied == 2
+    with app.app_context():
+        # The deposit was credited by the controller; the stream adds only the external payment
+        assert db.session.get(StellarAccount, account['stellar_account_id']).balance == Money.parse('109')
@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import Counter
+
+import pytest
+import requests
+from flask import Flask
+from werkzeug.serving import make_server
+
+import http_client
+from http_client import HttpClient, PartnerBusy, PartnerUnavailable
+from circuit_breaker import BreakerRegistry, MemoryStore, BREAKER_MIN_CALLS
+
+stub = Flask(__name__)
+hits = Counter()
+failures = Counter()
+in_flight = {'now': 0, 'max': 0}
+lock = threading.Lock()
+
+
+@stub.route('/flaky/<name>', methods=['GET', 'POST'])
+def flaky(name):
+    with lock:
+        hits[name] += 1
+        if failures[name]:
+            failures[name] -= 1
+            return 'unavailable', 503
+    return 'ok', 200
+
+
+@stub.route('/slow', methods=['POST'])
+def slow():
+    with lock:
+        in_flight['now'] += 1
+        in_flight['max'] = max(in_flight['max'], in_flight['now'])
+    time.sleep(0.5)
+    with lock:
+        in_flight['now'] -= 1
+    return 'ok', 200
+
+
+@stub.route('/hang', methods=['POST'])
+def hang():
+    with lock:
+        hits['hang'] += 1
+    time.sleep(0.3)
+    return 'late', 200
+
+
+@pytest.fixture(scope='module')
+def stub_url():
+    server = make_server('127.0.0.1', 0, stub, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def fresh_breakers(monkeypatch):
+    # Breaker state of the stub's endpoints must not leak between tests
+    monkeypatch.setattr(http_client, 'breakers', BreakerRegistry(MemoryStore()))
+
+
+def test_503_is_retried_only_for_idempotent_calls(stub_url):
+    client = HttpClient(max_retries=2, backoff_base=0.001)
+    failures['replayable'] = failures['once'] = 2
+
+    assert client.post(stub_url + '/flaky/replayable', idempotent=True).status_code == 200
+    assert hits['replayable'] == 3
+    assert client.post(stub_url + '/flaky/once').status_code == 503
+    assert hits['once'] == 1
+    assert client.pool_stats()[stub_url.split('//')[1]]['retries'] == 2
+
+
+def test_repeated_timeouts_surface_as_partner_unavailable(stub_url):
+    client = HttpClient(read_timeout=0.05, max_retries=0)
+    for _ in range(BREAKER_MIN_CALLS):  # All failures, so the breaker opens
+        with pytest.raises(requests.ReadTimeout):
+            client.post(stub_url + '/hang')
+
+    with pytest.raises(PartnerUnavailable) as refused:
+        client.post(stub_url + '/hang')
+    assert refused.value.retry_after > 0
+    assert hits['hang'] == BREAKER_MIN_CALLS  # The refused call never reached the partner
+
+
+def test_concurrency_cap_sheds_calls_beyond_it(stub_url):
+    client = HttpClient(max_concurrency=2, admission_wait=0.05, max_retries=0)
+    barrier = threading.Barrier(5)
+    outcomes = []
+
+    def call():
+        barrier.wait()
+        try:
+            outcomes.append(client.post(stub_url + '/slow').status_code)
+        except PartnerBusy:
+            outcomes.append('busy')
+
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(outcomes, key=str) == [200, 200, 'busy', 'busy', 'busy']
+    assert in_flight['max'] == 2
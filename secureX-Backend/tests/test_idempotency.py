@@ -0,0 +1,83 @@
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+import idempotency
+from models import db, User, StellarAccount
+from auth_tokens import issue_access_token, revocation_list
+from http_client import client as http
+
+
+@pytest.fixture
+def client(app, account):
+    with app.app_context():
+        token = issue_access_token(db.session.get(User, account['user_id']))
+        revocation_list.refresh()
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    return client
+
+
+def _deposit(client, account, key, amount='1'):
+    return client.post('/deposit', json=dict(account, amount=amount), headers={'Idempotency-Key': key})
+
+
+def _balance(app, account):
+    with app.app_context():
+        return str(db.session.get(StellarAccount, account['stellar_account_id']).balance)
+
+
+def test_retry_replays_the_first_response(app, client, account):
+    key = uuid.uuid4().hex
+    first = _deposit(client, account, key)
+    assert first.status_code == 200
+    assert 'Idempotent-Replayed' not in first.headers
+
+    retry = _deposit(client, account, key)
+    assert retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first.get_json()
+    assert _balance(app, account) == '101.0000000'
+
+
+def test_key_reused_for_a_different_body_is_rejected(app, client, account):
+    key = uuid.uuid4().hex
+    assert _deposit(client, account, key).status_code == 200
+
+    response = _deposit(client, account, key, amount='2')
+    assert response.status_code == 422
+    assert _balance(app, account) == '101.0000000'
+
+
+def test_concurrent_duplicate_waits_for_the_first_result(app, client, account):
+    bank = os.environ['BANK_API_URL']
+    http.post(bank + '/faults', json={'latency_ms': 500, 'paths': ['/withdraw']})
+    key = uuid.uuid4().hex
+    responses = {}
+
+    def first():
+        responses['first'] = _deposit(client, account, key)
+
+    try:
+        thread = threading.Thread(target=first)
+        thread.start()
+        time.sleep(0.2)  # The first request now holds the key, blocked in the slow bank call
+        duplicate = _deposit(client, account, key)
+        thread.join()
+    finally:
+        http.post(bank + '/faults', json={'latency_ms': 0, 'paths': []})
+
+    assert responses['first'].status_code == 200
+    assert duplicate.status_code == 200
+    assert duplicate.headers['Idempotent-Replayed'] == 'true'
+    assert duplicate.get_json() == responses['first'].get_json()
+    assert _balance(app, account) == '101.0000000'
+
+
+def test_waiter_that_gives_up_leaves_no_event_behind():
+    # The first request ran in another process, so nobody here ever notifies the key
+    idempotency._wait('user', 'key', time.monotonic() + 0.05)
+    assert ('user', 'key') not in idempotency._waiters
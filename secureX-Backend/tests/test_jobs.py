@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from models import db, Job, User
+from auth_tokens import issue_access_token
+from jobs import enqueue_job, claim_next_job, renew_leases, recover_interrupted_jobs
+
+
+def test_job_status_is_only_visible_to_its_owner(app, account):
+    tokens = {}
+    with app.app_context():
+        owner = db.session.get(User, account['user_id'])
+        job = enqueue_job('withdraw', {'user_id': owner.id}, user_id=owner.id)
+        stranger = User(email=f'stranger-{job.id}@example.com', password='x', name='Other', phone='0',
+                        authorised_device='device')
+        db.session.add(stranger)
+        db.session.commit()
+        tokens['owner'] = issue_access_token(owner)
+        tokens['stranger'] = issue_access_token(stranger)
+        job_id = job.id
+
+    client = app.test_client()
+    response = client.get(f'/jobs/{job_id}', headers={'Authorization': f'Bearer {tokens["owner"]}'})
+    assert response.status_code == 200
+    assert response.get_json()['id'] == job_id
+    response = client.get(f'/jobs/{job_id}', headers={'Authorization': f'Bearer {tokens["stranger"]}'})
+    assert response.status_code == 404
+
+
+def test_recovery_only_fails_jobs_whose_lease_expired(app):
+    with app.app_context():
+        live = enqueue_job('withdraw', {})
+        dead = enqueue_job('withdraw', {})
+        for job, heartbeat in ((live, datetime.now()), (dead, datetime.now() - timedelta(minutes=5))):
+            job.status, job.claimed_by, job.heartbeat_at = 'running', 'other-pool', heartbeat
+        db.session.commit()
+
+        recover_interrupted_jobs(lease_timeout=60)
+
+        assert db.session.get(Job, live.id).status == 'running'
+        assert db.session.get(Job, dead.id).status == 'failed'
+
+
+def test_claim_leases_the_job_to_the_pool(app):
+    with app.app_context():
+        Job.query.filter(Job.status == 'pending').update({Job.status: 'cancelled'})
+        job = enqueue_job('withdraw', {})
+        claimed = claim_next_job('pool-a')
+        assert claimed.id == job.id
+        assert claimed.claimed_by == 'pool-a' and claimed.heartbeat_at is not None
+        assert renew_leases('pool-a') == 1
+        assert renew_leases('pool-b') == 0
@@ -0,0 +1,26 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+from passwords import PasswordHasher
+
+
+@pytest.mark.parametrize('method', ['scrypt', 'pbkdf2:sha256', 'pbkdf2:sha256:1000'])
+def test_hashes_made_with_the_configured_method_are_kept(method):
+    hasher = PasswordHasher(method=method)
+    assert not hasher.needs_rehash(generate_password_hash('secret', method=method))
+
+
+def test_hashes_with_other_parameters_are_rehashed():
+    hasher = PasswordHasher(method='pbkdf2:sha256')
+    assert hasher.needs_rehash(generate_password_hash('secret', method='pbkdf2:sha256:1000'))
+    assert hasher.needs_rehash(generate_password_hash('secret', method='scrypt'))
+
+
+def test_pool_hashes_and_verifies_in_child_processes():
+    hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=1)
+    try:
+        password_hash = hasher.hash('secret')
+        assert hasher.verify('user@example.com', password_hash, 'secret')
+        assert not hasher.verify('user@example.com', password_hash, 'wrong')
+    finally:
+        hasher.shutdown()
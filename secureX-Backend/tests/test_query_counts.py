@@ -0,0 +1,42 @@
+import pytest
+
+from models import db, User
+from auth_tokens import issue_access_token, revocation_list
+from controllers import deposit_funds
+from request_context import assert_max_queries
+
+
+@pytest.fixture
+def client(app, account):
+    with app.app_context():
+        # A few transfers, so a per-row query would show up in the count
+        for _ in range(3):
+            _, status = deposit_funds(dict(account, amount='1'))
+            assert status == 200
+        token = issue_access_token(db.session.get(User, account['user_id']))
+        revocation_list.refresh()
+    client = app.test_client()
+    client.environ_base['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+    return client
+
+
+def test_history_is_two_queries(client, account):
+    # Transfer context (user and connection joined), then one keyset page
+    with assert_max_queries(2):
+        response = client.get('/transactions/history', query_string={
+            'user_id': account['user_id'], 'bank_connection_id': account['bank_connection_id']})
+    assert response.status_code == 200
+    assert len(response.get_json()['transactions']) == 3
+
+
+def test_balance_is_at_most_one_query(client, account):
+    # The transfers invalidated the cached balance, so this read refills it
+    with assert_max_queries(1) as statements:
+        response = client.get('/balance', query_string={
+            'user_id': account['user_id'], 'stellar_address': account['stellar_address']})
+    assert response.status_code == 200
+    assert response.get_json()['balance'] == '103.0000000'
+    assert len(statements) == 1
+    with assert_max_queries(0):
+        assert client.get('/balance', query_string={
+            'user_id': account['user_id'], 'stellar_address': account['stellar_address']}).status_code == 200
@@ -0,0 +1,22 @@
+from sqlalchemy import text
+
+from db_config import make_engine
+from migrate import upgrade
+from query_plans import check
+
+
+def _migrated_engine(tmp_path):
+    engine = make_engine(f'sqlite:///{tmp_path / "plans.db"}')
+    upgrade(engine)
+    return engine
+
+
+def test_hot_path_queries_use_indexes(tmp_path):
+    assert check(_migrated_engine(tmp_path)) == {}
+
+
+def test_a_dropped_index_is_reported(tmp_path):
+    engine = _migrated_engine(tmp_path)
+    with engine.begin() as connection:
+        connection.execute(text('DROP INDEX ix_bank_transactions_connection_date_id'))
+    assert 'history_page' in check(engine)
@@ -0,0 +1,52 @@
+import uuid
+
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter, MemoryStore, LOGIN_RATE_LIMIT, parse_limit
+
+
+class UnreachableStore:
+    def take(self, limits):
+        raise ConnectionError('Error 111 connecting to localhost:6379. Connection refused.')
+
+
+def _login(client, email):
+    # Users and devices each get a bucket, so every user logs in from their own device
+    return client.post('/login', json={'email': email, 'password': 'wrong', 'authorised_device': email})
+
+
+def test_empty_bucket_answers_429_with_retry_after(app, monkeypatch):
+    monkeypatch.setattr(rate_limit, 'limiter', RateLimiter(MemoryStore()))
+    client = app.test_client()
+    email = f'{uuid.uuid4().hex}@example.com'
+    capacity, rate = parse_limit(LOGIN_RATE_LIMIT)
+
+    for _ in range(capacity):
+        assert _login(client, email).status_code != 429
+    response = _login(client, email)
+
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) == pytest.approx(1 / rate, abs=1)
+    # Another user on another device is not throttled by this one's buckets
+    assert _login(client, f'{uuid.uuid4().hex}@example.com').status_code != 429
+
+
+def test_unreachable_store_admits_requests(app, monkeypatch):
+    limiter = RateLimiter(UnreachableStore())
+    monkeypatch.setattr(rate_limit, 'limiter', limiter)
+    client = app.test_client()
+    email = f'{uuid.uuid4().hex}@example.com'
+    capacity, _ = parse_limit(LOGIN_RATE_LIMIT)
+
+    for _ in range(capacity + 1):
+        assert _login(client, email).status_code != 429
+    assert limiter.store_errors == capacity + 1
+
+
+def test_redis_down_fails_open():
+    pytest.importorskip('redis')
+    # Nothing listens on port 1, so every script call fails to connect
+    limiter = RateLimiter(rate_limit.RedisStore('redis://127.0.0.1:1/0'))
+    assert limiter.check([('login:user:someone', 5, 5 / 60)]) == 0.0
+    assert limiter.store_errors == 1
@@ -0,0 +1,27 @@
+import io
+import json
+
+from models import db, LedgerEntry
+from controllers import deposit_funds, withdraw_funds
+from reconciliation import horizon_payment_lines, reconcile
+
+
+def test_stellar_legs_reconcile_by_direction(app, account):
+    with app.app_context():
+        for transfer, amount in ((deposit_funds, '5'), (withdraw_funds, '3')):
+            _, status = transfer(dict(account, amount=amount))
+            assert status == 200
+        entries = {entry.entry_type: entry.stellar_reference
+                   for entry in LedgerEntry.query.filter_by(stellar_account_id=account['stellar_account_id'])}
+
+        directions = {line.reference: line.direction for line in horizon_payment_lines()}
+        # Seen from the customer's account: deposits credit it, withdrawals debit it
+        assert directions[entries['deposit']] == 'credit'
+        assert directions[entries['withdrawal']] == 'debit'
+
+        # Other tests pay through the fake Horizon too, so only this account's transfers are checked
+        report = io.StringIO()
+        with db.engine.connect() as connection:
+            reconcile(connection, 'stellar', report=report)
+        mismatched = {json.loads(line)['reference'] for line in report.getvalue().splitlines()}
+        assert not mismatched & set(entries.values())
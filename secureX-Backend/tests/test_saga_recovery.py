@@ -0,0 +1,84 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from models import db, OutboxMessage, Saga
+from http_client import client
+from saga import start_saga, run_step, complete_saga, recover_sagas
+
+
+def _saga_with_done_step():
+    saga = start_saga('withdraw', {})
+    action = OutboxMessage(saga_id=saga.id, step='bank_deposit', kind='action', url='http://bank/deposit',
+                           payload=json.dumps({}), status='done', attempts=1)
+    db.session.add(action)
+    db.session.flush()
+    db.session.add(OutboxMessage(saga_id=saga.id, step='bank_reversal', kind='compensation',
+                                 compensates_id=action.id, url='http://bank/withdraw',
+                                 payload=json.dumps({}), status='held'))
+    db.session.commit()
+    return saga
+
+
+def _compensation_status(saga_id):
+    return OutboxMessage.query.filter_by(saga_id=saga_id, kind='compensation').one().status
+
+
+def test_recovery_leaves_sagas_of_live_processes_alone(app):
+    bank = os.environ['BANK_API_URL']
+    client.post(bank + '/faults', json={'latency_ms': 500, 'paths': ['/deposit']})
+    started = threading.Event()
+
+    def transfer(saga_id):
+        # A live saga, blocked in a slow partner call while another process recovers
+        with app.app_context():
+            saga = db.session.get(Saga, saga_id)
+            started.set()
+            response = run_step(saga, 'bank_deposit', bank + '/deposit', {'amount': '1', 'account_number': '1'},
+                                compensation=('bank_reversal', bank + '/withdraw', {'amount': '1'}))
+            assert response.status_code == 200
+            complete_saga(saga)
+            db.session.remove()
+
+    try:
+        with app.app_context():
+            live = start_saga('withdraw', {})
+            abandoned = _saga_with_done_step()
+            # The other process stopped renewing this one's lease
+            abandoned.owner = 'dead-process'
+            abandoned.heartbeat_at = datetime.now() - timedelta(minutes=10)
+            db.session.commit()
+
+            thread = threading.Thread(target=transfer, args=(live.id,))
+            thread.start()
+            started.wait()
+            time.sleep(0.2)
+            recover_sagas(lease_timeout=60)
+            thread.join()
+
+            db.session.expire_all()
+            assert db.session.get(Saga, live.id).status == 'completed'
+            assert _compensation_status(live.id) == 'cancelled'
+            assert db.session.get(Saga, abandoned.id).status == 'compensating'
+            assert _compensation_status(abandoned.id) == 'pending'
+    finally:
+        client.post(bank + '/faults', json={'latency_ms': 0, 'paths': []})
+
+
+def test_recovery_requeues_only_expired_outbox_claims(app):
+    with app.app_context():
+        saga = _saga_with_done_step()
+        saga.status = 'compensating'
+        fresh, stale = (OutboxMessage(saga_id=saga.id, step='bank_refund', kind='compensation',
+                                      url='http://bank/refund', payload='{}', status='in_flight',
+                                      claimed_by='dispatcher', next_attempt_at=claimed_at)
+                        for claimed_at in (datetime.now(), datetime.now() - timedelta(minutes=10)))
+        db.session.add_all([fresh, stale])
+        db.session.commit()
+
+        recover_sagas(lease_timeout=60)
+
+        assert db.session.get(OutboxMessage, fresh.id).status == 'in_flight'
+        assert db.session.get(OutboxMessage, stale.id).status == 'pending'
@@ -0,0 +1,36 @@
+import threading
+
+from models import db
+from balances import current_balance
+from controllers import withdraw_funds
+from money import Money
+
+THREADS = 20
+AMOUNT = Money.parse('10')
+
+
+def test_concurrent_withdrawals_never_overdraw(app, account):
+    barrier = threading.Barrier(THREADS)
+    statuses = []
+    lock = threading.Lock()
+
+    def withdraw():
+        with app.app_context():
+            barrier.wait()  # Release every thread at once so the reservations race
+            _, status = withdraw_funds(dict(account, amount=str(AMOUNT)))
+            db.session.remove()
+        with lock:
+            statuses.append(status)
+
+    threads = [threading.Thread(target=withdraw) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        balance = current_balance(account['stellar_account_id'])
+    successes = statuses.count(200)
+    assert statuses.count(400) == THREADS - successes  # The rest were refused for insufficient funds
+    assert successes == Money.parse('100').stroops // AMOUNT.stroops
+    assert balance == Money()
@@ -0,0 +1,148 @@
+import bisect
+import os
+import random
+import secrets
+import threading
+import time
+from flask import Flask, request, jsonify
+
+# Local stand-in for api.bankingpartner.com, point the backend at it with BANK_API_URL.
+# Latency, errors and timeouts can be injected through the environment or at runtime:
+#   curl -X POST localhost:8101/faults -H 'Content-Type: application/json' -d '{"error_rate": 0.2}'
+app = Flask(__name__)
+
+BANK_NAME = os.environ.get('BANK_NAME', 'Test Bank 1')
+ROUTING_NUMBER = os.environ.get('ROUTING_NUMBER', '110000001')
+OPENING_BALANCE = float(os.environ.get('OPENING_BALANCE', '1000000'))
+
+lock = threading.Lock()
+accounts = {}
+responses = {}  # Idempotency-Key -> (body, status) so retried calls are not applied twice
+statement = []  # Applied movements, kept in id order for /statements paging
+stats = {'requests': 0, 'injected_errors': 0, 'injected_timeouts': 0}
+faults = {
+    'latency_ms': float(os.environ.get('LATENCY_MS', '0')),
+    'jitter_ms': float(os.environ.get('JITTER_MS', '0')),
+    'error_rate': float(os.environ.get('ERROR_RATE', '0')),  # Fraction answered with 503
+    'timeout_rate': float(os.environ.get('TIMEOUT_RATE', '0')),  # Fraction held for timeout_s
+    'timeout_s': float(os.environ.get('TIMEOUT_S', '30')),
+    'paths': [path for path in os.environ.get('FAULT_PATHS', '').split(',') if path]  # Empty means all
+}
+
+
+@app.route('/faults', methods=['GET', 'POST'])
+def configure_faults():
+    if request.method == 'POST':
+        with lock:
+            faults.update({key: value for key, value in (request.get_json() or {}).items() if key in faults})
+    return jsonify(faults), 200
+
+
+@app.before_request
+def _inject_faults():
+    if request.path in ('/faults', '/stats'):
+        return None
+    with lock:
+        stats['requests'] += 1
+        config = dict(faults)
+    if config['paths'] and request.path not in config['paths']:
+        return None
+
+    delay = config['latency_ms'] + random.uniform(-config['jitter_ms'], config['jitter_ms'])
+    if delay > 0:
+        time.sleep(delay / 1000)
+    roll = random.random()
+    if roll < config['timeout_rate']:
+        with lock:
+            stats['injected_timeouts'] += 1
+        time.sleep(config['timeout_s'])
+        return jsonify({'message': 'Timed out'}), 504
+    if roll < config['timeout_rate'] + config['error_rate']:
+        with lock:
+            stats['injected_errors'] += 1
+        return jsonify({'message': 'Service unavailable'}), 503
+    return None
+
+
+def _amount(data):
+    try:
+        amount = float(data.get('amount'))
+    except (TypeError, ValueError):
+        return None
+    return amount if amount > 0 else None
+
+
+def _idempotent(handler):
+    key = request.headers.get('Idempotency-Key')
+    with lock:
+        if key and key in responses:
+            body, status = responses[key]
+            return jsonify(body), status
+        body, status = handler(request.get_json() or {})
+        if key:
+            responses[key] = (body, status)
+    return jsonify(body), status
+
+
+def _move(data, sign):
+    amount = _amount(data)
+    account_number = data.get('account_number')
+    if amount is None or not account_number:
+        return {'message': 'account_number and a positive amount are required'}, 400
+    balance = accounts.setdefault(account_number, OPENING_BALANCE)
+    if sign < 0 and balance < amount:
+        return {'message': 'Insufficient funds'}, 400
+    accounts[account_number] = balance + sign * amount
+    line = {'id': secrets.token_hex(8), 'account_number': account_number,
+            'type': 'credit' if sign > 0 else 'debit', 'amount': data.get('amount'), 'created_at': time.time()}
+    bisect.insort(statement, line, key=lambda entry: entry['id'])
+    return {'id': line['id'], 'status': 'completed', 'balance': accounts[account_number]}, 200
+
+
+@app.route('/connect', methods=['POST'])
+def connect():
+    data = request.get_json() or {}
+    if not data.get('account_number'):
+        return jsonify({'verified': False, 'message': 'account_number is required'}), 400
+    with lock:
+        accounts.setdefault(data['account_number'], OPENING_BALANCE)
+    return jsonify({'verified': True, 'bank_name': BANK_NAME, 'routing_number': ROUTING_NUMBER}), 200
+
+
+@app.route('/disconnect', methods=['POST'])
+def disconnect():
+    return jsonify({'status': 'disconnected'}), 200
+
+
+@app.route('/withdraw', methods=['POST'])
+def withdraw():
+    return _idempotent(lambda data: _move(data, -1))
+
+
+@app.route('/deposit', methods=['POST'])
+def deposit():
+    return _idempotent(lambda data: _move(data, 1))
+
+
+@app.route('/refund', methods=['POST'])
+def refund():
+    return _idempotent(lambda data: _move(data, 1))
+
+
+@app.route('/statements', methods=['GET'])
+def get_statement():
+    after = request.args.get('after', '')
+    limit = min(int(request.args.get('limit', '1000')), 10000)
+    with lock:
+        start = bisect.bisect_right(statement, after, key=lambda entry: entry['id'])
+        return jsonify({'lines': statement[start:start + limit]}), 200
+
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    with lock:
+        return jsonify(dict(stats, accounts=len(accounts))), 200
+
+
+if __name__ == '__main__':
+    app.run(host='127.0.0.1', port=int(os.environ.get('PORT', '8101')), threaded=True)
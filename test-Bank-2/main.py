@@ -0,0 +1,14 @@
+import os
+import runpy
+
+# Second bank partner: same service as test-Bank-1 with its own identity, port and a
+# slower default profile, so multi-bank runs see partners that behave differently
+os.environ.setdefault('BANK_NAME', 'Test Bank 2')
+os.environ.setdefault('ROUTING_NUMBER', '220000002')
+os.environ.setdefault('PORT', '8102')
+os.environ.setdefault('LATENCY_MS', '40')
+os.environ.setdefault('JITTER_MS', '20')
+
+if __name__ == '__main__':
+    runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test-Bank-1', 'main.py'),
+                   run_name='__main__')
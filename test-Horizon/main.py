@@ -0,0 +1,201 @@
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from flask import Flask, Response, request, jsonify
+
+# Local stand-in for horizon-testnet.stellar.org, point the backend at it with HORIZON_URL.
+# Latency, errors and timeouts can be injected through the environment or at runtime:
+#   curl -X POST localhost:8000/faults -H 'Content-Type: application/json' -d '{"latency_ms": 200}'
+app = Flask(__name__)
+
+# Pays out deposits and receives withdrawals, like the platform's Stellar distribution account
+DISTRIBUTION_ACCOUNT = os.environ.get('DISTRIBUTION_ACCOUNT', 'GSECUREXDISTRIBUTIONACCOUNT')
+# Idle /payments streams send a comment this often, so clients notice when to stop
+STREAM_KEEPALIVE_S = float(os.environ.get('STREAM_KEEPALIVE_S', '1'))
+
+lock = threading.Lock()
+payments_added = threading.Condition(lock)
+transactions = {}
+payments = []  # Every applied operation in submission order, paged by /payments
+applied = {}  # Operation reference -> its result
+stats = {'transactions': 0, 'operations': 0, 'injected_errors': 0, 'injected_timeouts': 0}
+faults = {
+    'latency_ms': float(os.environ.get('LATENCY_MS', '0')),
+    'jitter_ms': float(os.environ.get('JITTER_MS', '0')),
+    'error_rate': float(os.environ.get('ERROR_RATE', '0')),  # Fraction answered with 503
+    'timeout_rate': float(os.environ.get('TIMEOUT_RATE', '0')),  # Fraction held for timeout_s
+    'timeout_s': float(os.environ.get('TIMEOUT_S', '30')),
+    'paths': [path for path in os.environ.get('FAULT_PATHS', '').split(',') if path]  # Empty means all
+}
+
+
+@app.route('/faults', methods=['GET', 'POST'])
+def configure_faults():
+    if request.method == 'POST':
+        with lock:
+            faults.update({key: value for key, value in (request.get_json() or {}).items() if key in faults})
+    return jsonify(faults), 200
+
+
+@app.before_request
+def _inject_faults():
+    if request.path in ('/faults', '/stats'):
+        return None
+    with lock:
+        config = dict(faults)
+    if config['paths'] and request.path not in config['paths']:
+        return None
+
+    delay = config['latency_ms'] + random.uniform(-config['jitter_ms'], config['jitter_ms'])
+    if delay > 0:
+        time.sleep(delay / 1000)
+    roll = random.random()
+    if roll < config['timeout_rate']:
+        with lock:
+            stats['injected_timeouts'] += 1
+        time.sleep(config['timeout_s'])
+        return jsonify({'title': 'Timeout'}), 504
+    if roll < config['timeout_rate'] + config['error_rate']:
+        with lock:
+            stats['injected_errors'] += 1
+        return jsonify({'title': 'Service Unavailable'}), 503
+    return None
+
+
+def _check_operation(operation):
+    try:
+        amount = float(operation.get('amount'))
+    except (TypeError, ValueError):
+        return 'op_malformed'
+    if amount <= 0 or not (operation.get('stellar_address') or operation.get('to')):
+        return 'op_malformed'
+    return 'op_success'
+
+
+def _payment_record(transaction_id, n, operation):
+    # Shaped like Horizon's native payment records; 'from'/'to' in the operation send a plain
+    # payment between two accounts, otherwise the customer pays or is paid by the distribution account
+    if operation.get('from') and operation.get('to'):
+        source, destination = operation['from'], operation['to']
+    elif operation.get('operation') == 'withdrawal':
+        source, destination = operation.get('stellar_address'), DISTRIBUTION_ACCOUNT
+    else:
+        source, destination = DISTRIBUTION_ACCOUNT, operation.get('stellar_address')
+    return {
+        'id': f'{transaction_id}-{n}',
+        'paging_token': str(len(payments) + 1),
+        'type': 'payment',
+        'asset_type': 'native',
+        'source_account': source,
+        'from': source,
+        'to': destination,
+        'amount': str(operation.get('amount')),
+        'transaction_hash': transaction_id,
+        'transaction_successful': True,
+        'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'reference': operation.get('reference')
+    }
+
+
+@app.route('/accounts', methods=['POST'])
+def create_account():
+    return jsonify({
+        'account_id': 'G' + secrets.token_hex(28).upper(),
+        'seed': 'S' + secrets.token_hex(28).upper()
+    }), 200
+
+
+@app.route('/transactions', methods=['POST'])
+def submit_transaction():
+    data = request.get_json() or {}
+    # Batched submissions carry an operations list, single payments are the operation itself
+    operations = data.get('operations') or [data]
+    if len(operations) > 100:
+        return jsonify({'title': 'Transaction Malformed', 'extras': {'result_codes': {'transaction': 'tx_malformed'}}}), 400
+
+    codes = [_check_operation(operation) for operation in operations]
+    if any(code != 'op_success' for code in codes):
+        # Transactions are atomic, so one rejected operation fails all of them
+        return jsonify({
+            'title': 'Transaction Failed',
+            'extras': {'result_codes': {'transaction': 'tx_failed', 'operations': codes}}
+        }), 400
+
+    with lock:
+        # A replayed payment (same reference) gets its original result instead of paying twice
+        results = [applied.get(operation.get('reference')) for operation in operations]
+        fresh = [i for i, result in enumerate(results) if result is None]
+        if fresh:
+            transaction_id = secrets.token_hex(32)
+            transactions[transaction_id] = [operations[i] for i in fresh]
+            for n, i in enumerate(fresh):
+                operation = operations[i]
+                results[i] = {'id': f'{transaction_id}-{n}', 'transaction_hash': transaction_id,
+                              'reference': operation.get('reference')}
+                if operation.get('reference'):
+                    applied[operation['reference']] = results[i]
+                payments.append(_payment_record(transaction_id, n, operation))
+            payments_added.notify_all()
+            stats['transactions'] += 1
+            stats['operations'] += len(fresh)
+        else:
+            transaction_id = results[0]['transaction_hash']
+    return jsonify({'id': transaction_id, 'hash': transaction_id, 'operations': results}), 200
+
+
+@app.route('/transactions/<transaction_id>', methods=['GET'])
+def get_transaction(transaction_id):
+    with lock:
+        operations = transactions.get(transaction_id)
+    if operations is None:
+        return jsonify({'title': 'Resource Missing'}), 404
+    return jsonify({'id': transaction_id, 'hash': transaction_id, 'operation_count': len(operations)}), 200
+
+
+def _stream_payments(position):
+    # Server-sent events as Horizon streams them: a hello, then every payment after the cursor
+    yield 'retry: 1000\nevent: open\ndata: "hello"\n\n'
+    while True:
+        with payments_added:
+            if position >= len(payments):
+                payments_added.wait(STREAM_KEEPALIVE_S)
+            records = payments[position:]
+        position += len(records)
+        for record in records:
+            yield f'id: {record["paging_token"]}\ndata: {json.dumps(record)}\n\n'
+        if not records:
+            yield ': keepalive\n\n'
+
+
+@app.route('/payments', methods=['GET'])
+def list_payments():
+    # Paging tokens are positions in the payment log, like Horizon's ledger-ordered cursors;
+    # 'now' starts after the newest payment
+    cursor = request.args.get('cursor') or ''
+    with lock:
+        position = len(payments) if cursor == 'now' else int(cursor or 0)
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        return Response(_stream_payments(position), mimetype='text/event-stream')
+
+    limit = min(int(request.args.get('limit', '10')), 200)
+    with lock:
+        if request.args.get('order') == 'desc':
+            end = position - 1 if cursor and cursor != 'now' else len(payments)
+            records = payments[max(0, end - limit):max(0, end)][::-1]
+        else:
+            records = payments[position:position + limit]
+    return jsonify({'_embedded': {'records': records}}), 200
+
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    with lock:
+        return jsonify(stats), 200
+
+
+if __name__ == '__main__':
+    app.run(host='127.0.0.1', port=int(os.environ.get('PORT', '8000')), threaded=True)